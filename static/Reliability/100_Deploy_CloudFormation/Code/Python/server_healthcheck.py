@@ -236,6 +236,8 @@ def call_getRecommendation(region, user_id):
 
     return response
 
+USAGE = 'server.py -s <server_ip> -p <server_port> -r <AWS region>'
+
 # Initialize server
 def run(argv):
     try:
@@ -250,7 +252,7 @@ def run(argv):
             ]
         )
     except getopt.GetoptError:
-        print('server.py -s <server_ip> -p <server_port> -r <AWS region>')
+        print(USAGE)
         sys.exit(2)
     print(opts)
 
@@ -265,7 +267,7 @@ def run(argv):
     # Get commandline arguments
     for opt, arg in opts:
         if opt in ("-h", "--help"):
-            print('server.py -s <server_ip> -p <server_port> -r <AWS region>')
+            print(USAGE)
             sys.exit()
         elif opt in ("-s", "--server_ip"):
             server_ip = arg
@@ -12,14 +12,18 @@
 # Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance with the License. A copy of the License is located at
 # https://aws.amazon.com/apache2.0/
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial, lru_cache
 from ec2_metadata import ec2_metadata
 import sys
 import getopt
 import boto3
 import traceback
 import random
+import socket
+import string
+import threading
+import time
 
 __author__    = "Seth Eliot"
 __email__     = "seliot@amazon.com"
@@ -40,8 +44,35 @@ html = """
     </body>
 </html>"""
 
+# The page is split at its {placeholders} once and the static parts are kept as encoded
+# bytes, so building a page only encodes the field values and joins the parts
+class Template:
+    def __init__(self, text):
+        self.parts = [
+            (literal.encode('utf-8'), field)
+            for literal, field, _, _ in string.Formatter().parse(text)
+        ]
+
+    def render(self, **fields):
+        page = []
+        for literal, field in self.parts:
+            page.append(literal)
+            if field is not None:
+                page.append(str(fields[field]).encode('utf-8'))
+        return b''.join(page)
+
+page_template = Template(html)
+
 # RequestHandler: Response depends on type of request made
 class RequestHandler(BaseHTTPRequestHandler):
+    # Keep the connection open for the client's next request (every response sends a
+    # Content-Length for this). An idle connection is closed after timeout seconds
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+    # The headers and the page are written separately, so do not let the second write wait
+    # for the client to acknowledge the first one on a kept-alive connection
+    disable_nagle_algorithm = True
+
     def __init__(self, region, *args, **kwargs):
         self.region = region
         super().__init__(*args, **kwargs)
@@ -76,40 +107,40 @@ class RequestHandler(BaseHTTPRequestHandler):
             # info about the EC2 instance and Availability Zone
             message += get_metadata()
 
+            page = page_template.render(Title="Resiliency workshop", Content=message)
+
             # Send successful response status code
             self.send_response(200)
 
             # Send headers
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-Length', str(len(page)))
             self.end_headers()
 
             # Write html output
-            self.wfile.write(
-                bytes(
-                    html.format(Title="Resiliency workshop", Content=message),
-                    "utf-8"
-                )
-            )
+            self.wfile.write(page)
 
         # Healthcheck request - will be used by the Elastic Load Balancer
         elif self.path == '/healthcheck':
 
+            message = "<h1>Success</h1>"
+
+            # Add metadata
+            message += get_metadata()
+
+            page = page_template.render(Title="healthcheck", Content=message)
+
             # Return a success status code
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-Length', str(len(page)))
             self.end_headers()
 
-            message = "<h1>Success</h1>"
-
-            # Add metadata
-            message += get_metadata()
+            self.wfile.write(page)
 
-            self.wfile.write(
-                bytes(
-                    html.format(Title="healthcheck", Content=message),
-                    "utf-8"
-                )
-            )
+        # Anything else (for example /favicon.ico) is not found
+        else:
+            self.send_error(404)
 
         return
 
@@ -126,9 +157,16 @@ def recommendation_message (user_name, tv_show, is_custom_reco):
 
 # Retrieve Metadata which can be useful to students 
 # For example to see which instance /  AWS AZ they are hitting
+# Every metadata property is a call to the instance metadata service, and outside AWS each
+# one waits for a timeout. The metadata of the instance does not change while the server
+# runs, so the html is built once at startup
+@lru_cache(maxsize=1)
 def get_metadata():
     metadata = '<br/><hr><h3>EC2 Metadata</h3>'
     try:
+        # Outside AWS nothing answers on the metadata address, so fail fast
+        # instead of waiting for the ec2_metadata timeouts
+        socket.create_connection(('169.254.169.254', 80), timeout=0.5).close()
         message_parts = [
             'account_id: %s' % ec2_metadata.account_id,
             'ami_id: %s' % ec2_metadata.ami_id,
@@ -144,27 +182,71 @@ def get_metadata():
 
     return metadata
 
+# Creating a boto3 session and clients on every request dominates the request latency.
+# The clients are kept for max_age seconds and shared by the request threads (boto3 clients
+# are thread safe). In the lab we change permissions on the EC2 instance, and this is short
+# enough that we are sure to pick up the new credentials
+class ClientPool:
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def get(self, region):
+        with self.lock:
+            created, clients = self.clients.get(region, (0, None))
+            if clients is None or time.monotonic() - created > self.max_age:
+                session = boto3.Session()
+
+                # Setup client for DDB -- we will use this to mock a service dependency
+                ddb_client = session.client('dynamodb', region)
+
+                # Setup client for SSM -- we use this for parameters used as a 
+                # enable/disable switch in the lab
+                ssm_client = session.client('ssm', region_name=region)
+
+                clients = (ddb_client, ssm_client)
+                self.clients[region] = (time.monotonic(), clients)
+            return clients
+
+client_pool = ClientPool()
+
+# Reading the RecommendationServiceEnabled switch from SSM on every request doubles the calls
+# to dependencies. The value is kept in memory for ttl seconds, so a change in Parameter Store
+# still shows up within seconds. If SSM cannot be read, the last known value is used until
+# the next read
+class FeatureFlag:
+    def __init__(self, name, ttl=5):
+        self.name = name
+        self.ttl = ttl
+        self.values = {}
+
+    def get(self, region, ssm_client):
+        read_time, value = self.values.get(region, (0, None))
+        if time.monotonic() - read_time > self.ttl:
+            try:
+                parameter = ssm_client.get_parameter(Name=self.name)
+                value = parameter['Parameter']['Value'] == "true"
+            except Exception as e:
+                # There is no known value yet, so this read has to succeed
+                if value is None:
+                    raise
+                print('Unable to read ' + self.name + ', using the last known value: ' + str(e))
+            self.values[region] = (time.monotonic(), value)
+        return value
+
+recommendation_service_enabled = FeatureFlag('RecommendationServiceEnabled')
+
 # This method mocks the call to the RecommendationService.
 # Calls to the getRecommendation API are actually get_item
 # calls to a dynamoDB table 
 def call_getRecommendation(region, user_id):
 
-    # It would be more efficient to create the clients once on init
-    # But in the lab we change permissions on the EC2 instance
-    # and this way we are sure to pick up the new credentials
-    session = boto3.Session()
-
-    # Setup client for DDB -- we will use this to mock a service dependency
-    ddb_client = session.client('dynamodb', region)
-
-    # Setup client for SSM -- we use this for parameters used as a 
-    # enable/disable switch in the lab
-    ssm_client = session.client('ssm', region_name=region)
+    ddb_client, ssm_client = client_pool.get(region)
 
     # Configure if mocked recomendation service is enabled or if it should simulate
     # disabled (unreachable)
-    value = ssm_client.get_parameter(Name='RecommendationServiceEnabled')
-    dependency_enabled = value['Parameter']['Value'] == "true"
+    dependency_enabled = recommendation_service_enabled.get(region, ssm_client)
     table_name = "RecommendationService" if dependency_enabled else "dependencyShouldFail"
 
     # Call the RecommendationService 
@@ -183,6 +265,8 @@ def call_getRecommendation(region, user_id):
 
     return response
 
+USAGE = 'server.py -s <server_ip> -p <server_port> -r <AWS region>'
+
 # Initialize server
 def run(argv):
     try:
@@ -197,7 +281,7 @@ def run(argv):
             ]
         )
     except getopt.GetoptError:
-        print('server.py -s <server_ip> -p <server_port> -r <AWS region>')
+        print(USAGE)
         sys.exit(2)
     print(opts)
 
@@ -212,7 +296,7 @@ def run(argv):
     # Get commandline arguments
     for opt, arg in opts:
         if opt in ("-h", "--help"):
-            print('server.py -s <server_ip> -p <server_port> -r <AWS region>')
+            print(USAGE)
             sys.exit()
         elif opt in ("-s", "--server_ip"):
             server_ip = arg
@@ -223,10 +307,13 @@ def run(argv):
 
     # start server
     print('starting server...')
+    get_metadata()
     server_address = (server_ip, server_port)
 
+    # Each connection is served on its own thread, so a slow call to the RecommendationService
+    # does not hold up other requests or the load balancer health checks
     handler = partial(RequestHandler, region)
-    httpd = HTTPServer(server_address, handler)
+    httpd = ThreadingHTTPServer(server_address, handler)
     print('running server...')
     httpd.serve_forever()
 
@@ -13,13 +13,23 @@
 # https://aws.amazon.com/apache2.0/
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from functools import partial
+from functools import partial, lru_cache
 from ec2_metadata import ec2_metadata
 import sys
 import getopt
 import boto3
+import botocore.exceptions
 import traceback
 import random
+import collections
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+import gzip
+import string
 
 __author__    = "Seth Eliot"
 __email__     = "seliot@amazon.com"
@@ -40,12 +50,207 @@ html = """
     </body>
 </html>"""
 
+# The page is split at its {placeholders} once and the static parts are kept as encoded
+# bytes, so building a page only encodes the field values and joins the parts
+class Template:
+    def __init__(self, text):
+        self.parts = [
+            (literal.encode('utf-8'), field)
+            for literal, field, _, _ in string.Formatter().parse(text)
+        ]
+
+    def render(self, **fields):
+        page = []
+        for literal, field in self.parts:
+            page.append(literal)
+            if field is not None:
+                page.append(str(fields[field]).encode('utf-8'))
+        return b''.join(page)
+
+page_template = Template(html)
+
+# Smaller pages are not worth compressing
+GZIP_MIN_SIZE = 256
+
+# The same page is returned for every unknown path
+not_found_page = page_template.render(Title="not found", Content="<h1>Not found</h1>")
+
+# HTTPServer handles one request at a time, so a single slow call to a dependency holds up
+# every other request. PooledHTTPServer serves requests from a fixed pool of worker threads
+# fed by a bounded queue. When the queue is full the client gets an immediate 503
+# (backpressure) instead of waiting. Workers only take connections that have a request
+# waiting: new and kept-alive connections are watched by a selector thread, which queues a
+# connection when its next request arrives and closes it after idle_timeout seconds without
+# one. Health checks have their own workers and small queue, so the load balancer never sees
+# them wait behind slow requests.
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, server_address, handler, workers, queue_size, health_path='/healthcheck', health_workers=2, health_queue_size=8, idle_timeout=65, request_timeout=5):
+        super().__init__(server_address, handler)
+        self.health_request_prefix = ('GET ' + health_path + ' ').encode()
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self.request_queue = queue.Queue(maxsize=queue_size)
+        self.health_queue = queue.Queue(maxsize=health_queue_size)
+        # Connections handed to the selector thread, which is woken up through a socket pair
+        self.waiting = queue.Queue()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        threading.Thread(target=self.watch_connections, daemon=True).start()
+        for _ in range(workers):
+            threading.Thread(target=self.process_queue, args=(self.request_queue,), daemon=True).start()
+        for _ in range(health_workers):
+            threading.Thread(target=self.process_queue, args=(self.health_queue,), daemon=True).start()
+
+    # Runs on the thread accepting connections, so it never waits on the client
+    def process_request(self, request, client_address):
+        self.wait_for_request(request, client_address)
+
+    def wait_for_request(self, request, client_address):
+        self.waiting.put((request, client_address))
+        try:
+            self.wakeup_send.send(b'\0')
+        except BlockingIOError:
+            # The selector thread has not read the earlier wake ups yet, it will find this one too
+            pass
+
+    def watch_connections(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        # Connections that have only sent the start of a request line. They are neither a
+        # health check nor a normal request yet, so they are looked at again every few
+        # milliseconds until the rest arrives (for at most request_timeout seconds)
+        unclassified = {}
+        next_sweep = time.monotonic() + 1
+        while True:
+            for key, _ in selector.select(timeout=0.01 if unclassified else 1):
+                if key.fileobj is self.wakeup_recv:
+                    self.add_waiting(selector)
+                else:
+                    selector.unregister(key.fileobj)
+                    unclassified[key.fileobj] = (key.data[0], time.monotonic() + self.request_timeout)
+            for request, (client_address, deadline) in list(unclassified.items()):
+                kind = self.classify(request)
+                if kind == 'partial' and time.monotonic() < deadline:
+                    continue
+                del unclassified[request]
+                if kind == 'health':
+                    self.enqueue(self.health_queue, request, client_address)
+                elif kind == 'request':
+                    self.enqueue(self.request_queue, request, client_address)
+                else:
+                    self.shutdown_request(request)
+            if time.monotonic() >= next_sweep:
+                self.close_idle(selector)
+                next_sweep = time.monotonic() + 1
+
+    def add_waiting(self, selector):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        deadline = time.monotonic() + self.idle_timeout
+        while True:
+            try:
+                request, client_address = self.waiting.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                selector.register(request, selectors.EVENT_READ, (client_address, deadline))
+            except (ValueError, OSError):
+                self.shutdown_request(request)
+
+    def close_idle(self, selector):
+        now = time.monotonic()
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not self.wakeup_recv and key.data[1] < now:
+                selector.unregister(key.fileobj)
+                self.shutdown_request(key.fileobj)
+
+    # Look at the start of the request line without consuming it, the worker still reads the
+    # whole request. The socket is made non-blocking so this never waits on the client
+    def classify(self, request):
+        try:
+            request.setblocking(False)
+            data = request.recv(len(self.health_request_prefix), socket.MSG_PEEK)
+        except BlockingIOError:
+            return 'partial'
+        except OSError:
+            return 'closed'
+        if not data:
+            return 'closed'
+        if data == self.health_request_prefix:
+            return 'health'
+        if self.health_request_prefix.startswith(data):
+            return 'partial'
+        return 'request'
+
+    def enqueue(self, work_queue, request, client_address):
+        try:
+            work_queue.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.send(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def process_queue(self, work_queue):
+        while True:
+            request, client_address = work_queue.get()
+            keep_alive = False
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+                keep_alive = not handler.close_connection
+            except Exception:
+                self.handle_error(request, client_address)
+            if keep_alive:
+                self.wait_for_request(request, client_address)
+            else:
+                self.shutdown_request(request)
+
 # RequestHandler: Response depends on type of request made
 class RequestHandler(BaseHTTPRequestHandler):
+    # Connections are kept alive, but a worker only handles one request at a time and then
+    # gives the connection back to PooledHTTPServer to wait for the next one. The timeout
+    # bounds how long a worker waits for a slow client to finish sending its request
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+    # Read the socket unbuffered, so no part of the client's next request is left behind
+    # in a buffer when the connection goes back to wait
+    rbufsize = 0
+    # The headers and the page are written separately, so do not let the second write wait
+    # for the client to acknowledge the first one on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.handle_one_request()
+
     def __init__(self, region, *args, **kwargs):
         self.region = region
         super().__init__(*args, **kwargs)
 
+    # Send a complete html page. Content-Length lets the client reuse the connection
+    # for its next request
+    def send_page(self, status, title, content, keep_alive=True):
+        self.send_body(status, page_template.render(Title=title, Content=content), keep_alive)
+
+    def send_body(self, status, page, keep_alive=True):
+        self.send_response(status)
+        self.send_header('Content-type', 'text/html')
+        # Compress the page for clients that accept it
+        if len(page) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            page = gzip.compress(page, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(page)))
+        # The load balancer opens a new connection for every health check
+        if not keep_alive:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(page)
+
     def do_GET(self):
         print("path: ", self.path)
 
@@ -65,7 +270,8 @@ class RequestHandler(BaseHTTPRequestHandler):
             try:
 
                 # Call the getRecommendation API on the RecommendationService
-                response = call_getRecommendation(self.region, user_id)
+                # (a recent response for this user is used if there is one)
+                response, cached_age, error = recommendation_cache.get(self.region, user_id)
 
                 # Parses value of recommendation from DynamoDB JSON return value
                 # {'Item': {
@@ -76,6 +282,15 @@ class RequestHandler(BaseHTTPRequestHandler):
                 user_name = response['Item']['UserName']['S']
                 message += recommendation_message (user_name, tv_show, True)
 
+                # Say when the recommendation came from the cache, and why if the
+                # RecommendationService could not be reached (degraded mode)
+                if cached_age is not None:
+                    message += '<br><br><br><h2>Diagnostic Info:</h2>'
+                    message += '<br>This recommendation was cached %d seconds ago' % cached_age
+                    if error is not None:
+                        message += '<br>We are unable to reach the RecommendationService:'
+                        message += str(traceback.format_exception_only(error.__class__, error))
+
             # Error handling:
             # If the service dependency fails, and we cannot make a personalized recommendation
             # then give a pre-selected (static) recommendation
@@ -91,44 +306,29 @@ class RequestHandler(BaseHTTPRequestHandler):
             # info about the EC2 instance and Availability Zone
             message += get_metadata()
 
-            # Send successful response status code
-            self.send_response(200)
-
-            # Send headers
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-
-            # Write html output
-            self.wfile.write(
-                bytes(
-                    html.format(Title="Resiliency workshop", Content=message),
-                    "utf-8"
-                )
-            )
+            # Send successful response with the html output
+            self.send_page(200, "Resiliency workshop", message)
 
         # Healthcheck request - will be used by the Elastic Load Balancer
         elif self.path == '/healthcheck':
 
-            # Return a success status code
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-
             message = "<h1>Success</h1>"
 
             # Add metadata
             message += get_metadata()
 
-            self.wfile.write(
-                bytes(
-                    html.format(Title="healthcheck", Content=message),
-                    "utf-8"
-                )
-            )
+            # Return a success status code
+            self.send_page(200, "healthcheck", message, keep_alive=False)
+
+        # Anything else (for example /favicon.ico) is not found
+        else:
+            self.send_body(404, not_found_page)
 
         return
 
 # Utility function to consistently format how recommendations are displayed
+# There are only a few users and shows, so each message is only built once
+@lru_cache(maxsize=64)
 def recommendation_message (user_name, tv_show, is_custom_reco):
     if is_custom_reco:
         tag_line = "your recommendation is"
@@ -141,50 +341,168 @@ def recommendation_message (user_name, tv_show, is_custom_reco):
 
 # Retrieve Metadata which can be useful to students 
 # For example to see which instance /  AWS AZ they are hitting
+# Every metadata property is a call to the instance metadata service, and outside AWS each
+# one waits for a timeout. The html is built once at startup and rebuilt in the background
+# every interval seconds, so requests only read a string.
+class InstanceMetadata:
+    def __init__(self, interval=300):
+        self.interval = interval
+        self.html = ''
+
+    def on_ec2(self):
+        # Outside AWS nothing answers on the metadata address, so fail fast
+        # instead of waiting for the ec2_metadata timeouts
+        try:
+            socket.create_connection(('169.254.169.254', 80), timeout=0.5).close()
+            return True
+        except OSError:
+            return False
+
+    def render(self):
+        metadata = '<br/><hr><h3>EC2 Metadata</h3>'
+        try:
+            if not self.on_ec2():
+                raise OSError('The instance metadata service is not reachable')
+            message_parts = [
+                'account_id: %s' % ec2_metadata.account_id,
+                'ami_id: %s' % ec2_metadata.ami_id,
+                'availability_zone: %s' % ec2_metadata.availability_zone,
+                'instance_id: %s' % ec2_metadata.instance_id,
+                'instance_type: %s' % ec2_metadata.instance_type,
+                'private_hostname: %s' % ec2_metadata.private_hostname,
+                'private_ipv4: %s' % ec2_metadata.private_ipv4
+            ]
+            metadata += '<br>'.join(message_parts)
+        except Exception:
+            metadata += "Running outside AWS"
+        return metadata
+
+    def start(self):
+        self.html = self.render()
+        threading.Thread(target=self.refresh, daemon=True).start()
+        return self
+
+    def refresh(self):
+        while True:
+            time.sleep(self.interval)
+            # Forget the values kept by the ec2_metadata library so they are read again
+            ec2_metadata.clear_all()
+            self.html = self.render()
+
+instance_metadata = InstanceMetadata()
+
 def get_metadata():
-    metadata = '<br/><hr><h3>EC2 Metadata</h3>'
-    try:
-        message_parts = [
-            'account_id: %s' % ec2_metadata.account_id,
-            'ami_id: %s' % ec2_metadata.ami_id,
-            'availability_zone: %s' % ec2_metadata.availability_zone,
-            'instance_id: %s' % ec2_metadata.instance_id,
-            'instance_type: %s' % ec2_metadata.instance_type,
-            'private_hostname: %s' % ec2_metadata.private_hostname,
-            'private_ipv4: %s' % ec2_metadata.private_ipv4
-        ]
-        metadata += '<br>'.join(message_parts)
-    except Exception:
-        metadata += "Running outside AWS"
+    return instance_metadata.html
+
+# Creating a boto3 session and clients on every request dominates the request latency.
+# The clients are kept for max_age seconds and shared by the worker threads (boto3 clients
+# are thread safe). In the lab we change permissions on the EC2 instance, so the clients are
+# also rebuilt as soon as a call fails because the credentials expired or access was denied,
+# and this way we are sure to pick up the new credentials.
+class ClientPool:
+    REFRESH_ERROR_CODES = (
+        'AccessDenied',
+        'AccessDeniedException',
+        'UnauthorizedOperation',
+        'ExpiredToken',
+        'ExpiredTokenException',
+        'RequestExpired',
+        'InvalidClientTokenId',
+        'UnrecognizedClientException',
+        'SignatureDoesNotMatch',
+    )
 
-    return metadata
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def get(self, region):
+        with self.lock:
+            created, clients = self.clients.get(region, (0, None))
+            if clients is None or time.monotonic() - created > self.max_age:
+                session = boto3.Session()
+                clients = {
+                    # Setup client for DDB -- we will use this to mock a service dependency
+                    'dynamodb': session.client('dynamodb', region),
+                    # Setup client for SSM -- we use this for parameters used as a
+                    # enable/disable switch in the lab
+                    'ssm': session.client('ssm', region_name=region),
+                }
+                self.clients[region] = (time.monotonic(), clients)
+            return clients
+
+    def invalidate(self, region, clients):
+        # Only drop the clients that failed, another thread may already have replaced them
+        with self.lock:
+            if self.clients.get(region, (0, None))[1] is clients:
+                del self.clients[region]
+
+    def call(self, region, service, operation, **kwargs):
+        clients = self.get(region)
+        try:
+            return getattr(clients[service], operation)(**kwargs)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in self.REFRESH_ERROR_CODES:
+                raise
+        except botocore.exceptions.NoCredentialsError:
+            pass
+
+        # The credentials or permissions changed, retry once with new clients
+        self.invalidate(region, clients)
+        return getattr(self.get(region)[service], operation)(**kwargs)
+
+client_pool = ClientPool()
+
+# Reading the RecommendationServiceEnabled switch from SSM on every request doubles the calls
+# to dependencies. FeatureFlag keeps the value in memory and a background thread reads it
+# again every ttl seconds, so requests never wait for SSM (they use the current value while
+# the next one is read) and a change in Parameter Store still shows up within seconds.
+# If SSM cannot be read, the last known good value keeps being used.
+class FeatureFlag:
+    def __init__(self, name, ttl=5):
+        self.name = name
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def read(self, region):
+        value = client_pool.call(region, 'ssm', 'get_parameter', Name=self.name)
+        return value['Parameter']['Value'] == "true"
+
+    def get(self, region):
+        if region not in self.values:
+            with self.lock:
+                if region not in self.values:
+                    # There is no known good value yet, so this read has to succeed
+                    self.values[region] = self.read(region)
+                    threading.Thread(target=self.refresh, args=(region,), daemon=True).start()
+        return self.values[region]
+
+    def refresh(self, region):
+        while True:
+            time.sleep(self.ttl)
+            try:
+                self.values[region] = self.read(region)
+            except Exception as e:
+                print('Unable to read ' + self.name + ', using the last known value: ' + str(e))
+
+recommendation_service_enabled = FeatureFlag('RecommendationServiceEnabled')
 
 # This method mocks the call to the RecommendationService.
 # Calls to the getRecommendation API are actually get_item
 # calls to a dynamoDB table 
 def call_getRecommendation(region, user_id):
 
-    # It would be more efficient to create the clients once on init
-    # But in the lab we change permissions on the EC2 instance
-    # and this way we are sure to pick up the new credentials
-    session = boto3.Session()
-
-    # Setup client for DDB -- we will use this to mock a service dependency
-    ddb_client = session.client('dynamodb', region)
-
-    # Setup client for SSM -- we use this for parameters used as a 
-    # enable/disable switch in the lab
-    ssm_client = session.client('ssm', region_name=region)
-
     # Configure if mocked recomendation service is enabled or if it should simulate
     # disabled (unreachable)
-    value = ssm_client.get_parameter(Name='RecommendationServiceEnabled')
-    dependency_enabled = value['Parameter']['Value'] == "true"
+    dependency_enabled = recommendation_service_enabled.get(region)
     table_name = "RecommendationService" if dependency_enabled else "dependencyShouldFail"
 
     # Call the RecommendationService 
     # (actually just a simply lookup in a DynamoDB table, which is acting as a mock for the RecommendationService)
-    response = ddb_client.get_item(
+    response = client_pool.call(
+        region, 'dynamodb', 'get_item',
         TableName=table_name,
         Key={
             'ServiceAPI': {
@@ -198,27 +516,84 @@ def call_getRecommendation(region, user_id):
 
     return response
 
+# There are only a few users and their recommendations rarely change, so recent responses
+# are kept in memory for ttl seconds, for at most max_entries users (the least recently used
+# are dropped first). Users without a recommendation are remembered for negative_ttl seconds.
+# If the RecommendationService fails, a response up to max_stale seconds old is returned
+# together with the error, before the caller falls back to the static recommendation.
+class RecommendationCache:
+    def __init__(self, ttl=10, negative_ttl=5, max_stale=60, max_entries=1000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    # Returns the response, its age in seconds (None if it was not cached),
+    # and the error from the RecommendationService when a stale response is returned
+    def get(self, region, user_id):
+        key = (region, user_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        age = None
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            ttl = self.ttl if 'Item' in entry[1] else self.negative_ttl
+            if age < ttl:
+                return entry[1], age, None
+
+        try:
+            response = call_getRecommendation(region, user_id)
+        except Exception as e:
+            if age is not None and age < self.max_stale:
+                return entry[1], age, e
+            raise
+
+        with self.lock:
+            self.entries[key] = (time.monotonic(), response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return response, None, None
+
+recommendation_cache = RecommendationCache()
+
+USAGE = 'server.py -s <server_ip> -p <server_port> -r <AWS region> -t <worker threads> -q <queue size> -c <client max age seconds> -f <feature flag ttl seconds> -k <cache ttl seconds> -x <cache max stale seconds>'
+
 # Initialize server
 def run(argv):
     try:
         opts, args = getopt.getopt(
             argv,
-            "hs:p:r:",
+            "hs:p:r:t:q:c:f:k:x:",
             [
                 "help",
                 "server_ip=",
                 "server_port=",
-                "region="
+                "region=",
+                "threads=",
+                "queue_size=",
+                "client_max_age=",
+                "flag_ttl=",
+                "cache_ttl=",
+                "cache_max_stale="
             ]
         )
     except getopt.GetoptError:
-        print('server.py -s <server_ip> -p <server_port> -r <AWS region>')
+        print(USAGE)
         sys.exit(2)
     print(opts)
 
     # Default value - will be over-written if supplied via args
     server_port = 80
     server_ip = '0.0.0.0'
+    # Number of worker threads, and how many connections may wait for a free worker
+    threads = (os.cpu_count() or 1) * 4
+    queue_size = 64
     try:
         region = ec2_metadata.region
     except:
@@ -227,7 +602,7 @@ def run(argv):
     # Get commandline arguments
     for opt, arg in opts:
         if opt in ("-h", "--help"):
-            print('server.py -s <server_ip> -p <server_port> -r <AWS region>')
+            print(USAGE)
             sys.exit()
         elif opt in ("-s", "--server_ip"):
             server_ip = arg
@@ -235,14 +610,29 @@ def run(argv):
             server_port = int(arg)
         elif opt in ("-r", "--region"):
             region = arg
+        elif opt in ("-t", "--threads"):
+            threads = int(arg)
+        elif opt in ("-q", "--queue_size"):
+            queue_size = int(arg)
+        elif opt in ("-c", "--client_max_age"):
+            client_pool.max_age = int(arg)
+        elif opt in ("-f", "--flag_ttl"):
+            recommendation_service_enabled.ttl = float(arg)
+        elif opt in ("-k", "--cache_ttl"):
+            recommendation_cache.ttl = float(arg)
+        elif opt in ("-x", "--cache_max_stale"):
+            recommendation_cache.max_stale = float(arg)
+
+    # Read the EC2 metadata before the first request
+    instance_metadata.start()
 
     # start server
     print('starting server...')
     server_address = (server_ip, server_port)
 
     handler = partial(RequestHandler, region)
-    httpd = HTTPServer(server_address, handler)
-    print('running server...')
+    httpd = PooledHTTPServer(server_address, handler, threads, queue_size)
+    print('running server with %d worker threads...' % threads)
     httpd.serve_forever()
 
 
@@ -4,6 +4,19 @@ from ec2_metadata import ec2_metadata
 import sys
 import getopt
 import pymysql
+import contextlib
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+import datetime
+import collections
+import gzip
+import string
+
+
 html = """
 <!DOCTYPE html>
 <html>
@@ -19,101 +32,495 @@ html = """
         <img src="{WebSiteImage}" alt="" width="700">
     </body>
 </html>"""
+
+# The page is split at its {placeholders} once and the static parts are kept as encoded
+# bytes, so building a page only encodes the field values and joins the parts
+class Template:
+    def __init__(self, text):
+        self.parts = [
+            (literal.encode('utf-8'), field)
+            for literal, field, _, _ in string.Formatter().parse(text)
+        ]
+
+    def render(self, **fields):
+        page = []
+        for literal, field in self.parts:
+            page.append(literal)
+            if field is not None:
+                page.append(str(fields[field]).encode('utf-8'))
+        return b''.join(page)
+
+page_template = Template(html)
+
+# Smaller pages are not worth compressing
+GZIP_MIN_SIZE = 256
+
+# The same page is returned for every unknown path
+not_found_page = page_template.render(Content="", WebSiteImage="", Message="Not found", Link="..")
+
+# HTTPServer handles one request at a time, so a single slow call to a dependency holds up
+# every other request. PooledHTTPServer serves requests from a fixed pool of worker threads
+# fed by a bounded queue. When the queue is full the client gets an immediate 503
+# (backpressure) instead of waiting. Workers only take connections that have a request
+# waiting: new and kept-alive connections are watched by a selector thread, which queues a
+# connection when its next request arrives and closes it after idle_timeout seconds without
+# one. The load balancer checks this server on / itself, so health checks are served by the
+# same workers as every other request.
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, server_address, handler, workers, queue_size, idle_timeout=65):
+        super().__init__(server_address, handler)
+        self.idle_timeout = idle_timeout
+        self.request_queue = queue.Queue(maxsize=queue_size)
+        # Connections handed to the selector thread, which is woken up through a socket pair
+        self.waiting = queue.Queue()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        threading.Thread(target=self.watch_connections, daemon=True).start()
+        for _ in range(workers):
+            threading.Thread(target=self.process_queue, daemon=True).start()
+
+    # Runs on the thread accepting connections, so it never waits on the client
+    def process_request(self, request, client_address):
+        self.wait_for_request(request, client_address)
+
+    def wait_for_request(self, request, client_address):
+        self.waiting.put((request, client_address))
+        try:
+            self.wakeup_send.send(b'\0')
+        except BlockingIOError:
+            # The selector thread has not read the earlier wake ups yet, it will find this one too
+            pass
+
+    def watch_connections(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select(timeout=1):
+                if key.fileobj is self.wakeup_recv:
+                    self.add_waiting(selector)
+                else:
+                    selector.unregister(key.fileobj)
+                    self.enqueue(key.fileobj, key.data[0])
+            self.close_idle(selector)
+
+    def add_waiting(self, selector):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        deadline = time.monotonic() + self.idle_timeout
+        while True:
+            try:
+                request, client_address = self.waiting.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                selector.register(request, selectors.EVENT_READ, (client_address, deadline))
+            except (ValueError, OSError):
+                self.shutdown_request(request)
+
+    def close_idle(self, selector):
+        now = time.monotonic()
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not self.wakeup_recv and key.data[1] < now:
+                selector.unregister(key.fileobj)
+                self.shutdown_request(key.fileobj)
+
+    def enqueue(self, request, client_address):
+        try:
+            self.request_queue.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.setblocking(False)
+                request.send(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def process_queue(self):
+        while True:
+            request, client_address = self.request_queue.get()
+            keep_alive = False
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+                keep_alive = not handler.close_connection
+            except Exception:
+                self.handle_error(request, client_address)
+            if keep_alive:
+                self.wait_for_request(request, client_address)
+            else:
+                self.shutdown_request(request)
+
+
+# Every metadata property is a call to the instance metadata service, and outside AWS each
+# one waits for a timeout. The html is built once at startup and rebuilt in the background
+# every interval seconds, so requests only read a string.
+class InstanceMetadata:
+    def __init__(self, interval=300):
+        self.interval = interval
+        self.html = ''
+
+    def on_ec2(self):
+        # Outside AWS nothing answers on the metadata address, so fail fast
+        # instead of waiting for the ec2_metadata timeouts
+        try:
+            socket.create_connection(('169.254.169.254', 80), timeout=0.5).close()
+            return True
+        except OSError:
+            return False
+
+    def render(self):
+        metadata = ''
+        try:
+            if not self.on_ec2():
+                raise OSError('The instance metadata service is not reachable')
+            message_parts = [
+                'account_id: %s' % ec2_metadata.account_id,
+                'ami_id: %s' % ec2_metadata.ami_id,
+                'availability_zone: %s' % ec2_metadata.availability_zone,
+                'instance_id: %s' % ec2_metadata.instance_id,
+                'instance_type: %s' % ec2_metadata.instance_type,
+                'private_hostname: %s' % ec2_metadata.private_hostname,
+                'private_ipv4: %s' % ec2_metadata.private_ipv4
+            ]
+            metadata += '<br>'.join(message_parts)
+        except Exception:
+            metadata += "Running outside AWS"
+        return metadata
+
+    def start(self):
+        self.html = self.render()
+        threading.Thread(target=self.refresh, daemon=True).start()
+        return self
+
+    def refresh(self):
+        while True:
+            time.sleep(self.interval)
+            # Forget the values kept by the ec2_metadata library so they are read again
+            ec2_metadata.clear_all()
+            self.html = self.render()
+
+instance_metadata = InstanceMetadata()
+
+
+# Each worker thread borrows a database connection from ConnectionPool and returns it when the
+# request is done, so connections are reused and at most size of them are open. With reconnect,
+# a connection is checked with ping() before it is handed out, and replaced when it fails,
+# for example after an RDS failover moved the DNS name to the standby, or when it is older
+# than max_lifetime seconds. Without reconnect, the connections are opened at startup and
+# kept whatever happens to them.
+class ConnectionPool:
+    def __init__(self, connect, size=8, max_lifetime=300, reconnect=True):
+        self.connect = connect
+        self.max_lifetime = max_lifetime
+        self.reconnect = reconnect
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        if not reconnect:
+            for _ in range(size):
+                self.idle.put((connect(), time.monotonic()))
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self.slots:
+            db, created = self.checkout()
+            healthy = True
+            try:
+                yield db
+            except pymysql.err.Error:
+                healthy = False
+                raise
+            finally:
+                if healthy or not self.reconnect:
+                    self.idle.put((db, created))
+                else:
+                    self.close(db)
+
+    def checkout(self):
+        while True:
+            try:
+                db, created = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect(), time.monotonic()
+            if not self.reconnect:
+                return db, created
+            if self.max_lifetime and time.monotonic() - created > self.max_lifetime:
+                self.close(db)
+                continue
+            try:
+                db.ping(reconnect=False)
+                return db, created
+            except pymysql.err.Error:
+                self.close(db)
+
+    def close(self, db):
+        try:
+            db.close()
+        except Exception:
+            pass
+
+
+
+# /data shows the latest hits. RecentHits keeps them in memory, in a ring buffer of size
+# entries that is seeded from the database at startup and updated as hits are recorded, so
+# polling /data costs no database query. The other servers write to the same table, so every
+# reconcile_interval seconds the latest rows are read again and merged with the hits that
+# are not written yet (0 turns this off).
+class RecentHits:
+    def __init__(self, db_pool, size=10, reconcile_interval=5):
+        self.db_pool = db_pool
+        self.reconcile_interval = reconcile_interval
+        self.lock = threading.Lock()
+        self.hits = collections.deque(maxlen=size)
+
+    def start(self):
+        self.reconcile()
+        if self.reconcile_interval > 0:
+            threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def add(self, ip, hit_time):
+        with self.lock:
+            self.hits.append((ip, hit_time))
+
+    # Newest first, as (ip, time) rows
+    def latest(self):
+        with self.lock:
+            return list(reversed(self.hits))
+
+    def run(self):
+        while True:
+            time.sleep(self.reconcile_interval)
+            self.reconcile()
+
+    def reconcile(self):
+        try:
+            with self.db_pool.connection() as db:
+                with db.cursor() as cursor:
+                    cursor.execute("SELECT ip, time from hits order by time desc limit %s", (self.hits.maxlen,))
+                    rows = list(cursor.fetchall())
+                db.commit()
+        except Exception as e:
+            print('Unable to read the latest hits from the database: ' + str(e))
+            return
+        with self.lock:
+            # Hits recorded here after the newest row in the database are not written yet
+            newest = rows[0][1] if rows else None
+            rows += [hit for hit in self.hits if newest is None or hit[1] > newest]
+            rows.sort(key=lambda row: row[1])
+            self.hits.clear()
+            self.hits.extend(rows)
+
+
+# Writing every hit to the database before responding adds the commit latency to each request.
+# HitRecorder keeps the hits in a bounded buffer and a background thread writes them every
+# interval seconds, or as soon as batch_size hits are waiting, with one multi-row INSERT.
+# While the database is down and the buffer is full, new hits are appended to spill_file
+# (and written once the database is back) or dropped when there is no spill_file.
+# Requests still fail while hits cannot be written: the load balancer health check on /
+# relies on this to detect that the database is not available.
+class HitRecorder:
+    def __init__(self, db_pool, recent_hits, batch_size=100, interval=1.0, max_buffered=10000, spill_file=None):
+        self.db_pool = db_pool
+        self.recent_hits = recent_hits
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spill_file = spill_file
+        self.buffer = queue.Queue(maxsize=max_buffered)
+        self.pending = []
+        self.wakeup = threading.Event()
+        self.flush_lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+        self.error = None
+        self.dropped = 0
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def record(self, ip):
+        # Same format as the DATETIME default of the hits table (UTC on RDS)
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        hit = (ip, now.strftime('%Y-%m-%d %H:%M:%S'))
+        self.recent_hits.add(ip, now)
+        try:
+            self.buffer.put_nowait(hit)
+        except queue.Full:
+            self.spill([hit])
+        if self.buffer.qsize() >= self.batch_size:
+            self.wakeup.set()
+        if self.error is not None:
+            raise RuntimeError('Unable to write hits to the database: ' + self.error)
+
+    def spill(self, hits):
+        with self.spill_lock:
+            if self.spill_file is None:
+                self.dropped += len(hits)
+                return
+            with open(self.spill_file, 'a') as spill:
+                spill.writelines('%s\t%s\n' % hit for hit in hits)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            while True:
+                while len(self.pending) < self.batch_size:
+                    try:
+                        self.pending.append(self.buffer.get_nowait())
+                    except queue.Empty:
+                        break
+                if not self.pending:
+                    break
+                try:
+                    self.write(self.pending)
+                except Exception as e:
+                    self.error = str(e)
+                    print('Unable to write hits to the database: ' + self.error)
+                    return
+                self.pending = []
+                self.error = None
+            self.replay_spill()
+
+    def replay_spill(self):
+        with self.spill_lock:
+            if self.spill_file is None or not os.path.exists(self.spill_file):
+                return
+            with open(self.spill_file) as spill:
+                hits = [tuple(line.split('\t')) for line in spill.read().splitlines() if line]
+            os.remove(self.spill_file)
+        for start in range(0, len(hits), self.batch_size):
+            try:
+                self.write(hits[start:start + self.batch_size])
+            except Exception as e:
+                self.error = str(e)
+                self.spill(hits[start:])
+                return
+
+    def write(self, hits):
+        # pymysql sends executemany of an INSERT ... VALUES as one multi-row INSERT
+        with self.db_pool.connection() as db:
+            with db.cursor() as cursor:
+                cursor.executemany("INSERT INTO hits(ip, time) VALUES (%s, %s)", hits)
+            db.commit()
+
+
 class RequestHandler(BaseHTTPRequestHandler):
-    def __init__(self, url_image, db_host, db_user, db_pswd, db_name, *args, **kwargs):
+    # Connections are kept alive, but a worker only handles one request at a time and then
+    # gives the connection back to PooledHTTPServer to wait for the next one. The timeout
+    # bounds how long a worker waits for a slow client to finish sending its request
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+    # Read the socket unbuffered, so no part of the client's next request is left behind
+    # in a buffer when the connection goes back to wait
+    rbufsize = 0
+    # The headers and the page are written separately, so do not let the second write wait
+    # for the client to acknowledge the first one on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.handle_one_request()
+
+    def __init__(self, url_image, hit_recorder, recent_hits, *args, **kwargs):
         self.url_image = url_image
-        self.db_host = db_host
-        self.db_user = db_user
-        self.db_pswd = db_pswd
-        self.db_name = db_name
+        self.hit_recorder = hit_recorder
+        self.recent_hits = recent_hits
         super().__init__(*args, **kwargs)
 
-    def _execute_db_sql(self, sql, return_results=False):
-        db = pymysql.connect(host=self.db_host, user=self.db_user, password=self.db_pswd, database=self.db_name)
-        try:
-            with db.cursor() as cursor:
-              cursor.execute(sql)
-              results = cursor.fetchall() if return_results else None
-              db.commit()
-        finally:
-            db.close()
-        return results
+    # Send a complete html page. Content-Length lets the client reuse the connection
+    # for its next request
+    def send_page(self, status, **fields):
+        self.send_body(status, page_template.render(**fields))
+
+    def send_body(self, status, page):
+        self.send_response(status)
+        self.send_header('Content-type', 'text/html')
+        # Compress the page for clients that accept it
+        if len(page) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            page = gzip.compress(page, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
 
     def do_GET(self):
         print("path: ", self.path)
+
         if self.path == '/':
             link = "data"
-            try:
-                message_parts = [
-                    'account_id: %s' % ec2_metadata.account_id,
-                    'ami_id: %s' % ec2_metadata.ami_id,
-                    'availability_zone: %s' % ec2_metadata.availability_zone,
-                    'instance_id: %s' % ec2_metadata.instance_id,
-                    'instance_type: %s' % ec2_metadata.instance_type,
-                    'private_hostname: %s' % ec2_metadata.private_hostname,
-                    'private_ipv4: %s' % ec2_metadata.private_ipv4
-                ]
-                message = '<br>'.join(message_parts)
-            except Exception:
-                message = "Running outside AWS"
-            # Write data into the Database
-            sql = "INSERT INTO hits(ip) VALUES ('{IPAddress}')".format(IPAddress=self.client_address[0])
-            self._execute_db_sql(sql, return_results=False)
-            # Send response status code
-            self.send_response(200)
-            # Send headers
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(
-                bytes(
-                    html.format(Content=message, WebSiteImage=self.url_image, Message="Data from the metadata API", Link=link),
-                    "utf-8"
-                )
-            )
+            message = instance_metadata.html
+
+            # Write data into the Database (in the background)
+            self.hit_recorder.record(self.client_address[0])
+
+            # Send response with the html output
+            self.send_page(200, Content=message, WebSiteImage=self.url_image, Message="Data from the metadata API", Link=link)
         elif self.path == '/data':
+
             link = ".."
-            sql = "SELECT * from hits order by time desc limit 10"
-            results = self._execute_db_sql(sql, return_results=True)
+
+            # The latest hits are kept in memory
+            results = self.recent_hits.latest()
             message = []
             for row in results:
                 ip = row[0]
                 time = row[1]
                 message.append("ip = %s   time = %s" % (ip, time))
+
             msg = '<br>'.join(message)
-            self.send_response(200)
-            # Send headers
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(
-                bytes(
-                    html.format(Content=msg, WebSiteImage="", Message="Data from the Database", Link=link),
-                    "utf-8"
-                )
-            )
+
+            self.send_page(200, Content=msg, WebSiteImage="", Message="Data from the Database", Link=link)
+
+        # Anything else (for example /favicon.ico) is not found
+        else:
+            self.send_body(404, not_found_page)
         return
+
+
+USAGE = 'server.py -u <image_url> -p <server_port> -s <db_user> -w <db_pswd> -d <db_name> -o <db_host> -t <worker threads> -q <queue size> -f <hits spill file> -r <data refresh seconds>'
+
+
 def run(argv):
     image_url = "https://aws-well-architected-labs-ohio.s3.us-east-2.amazonaws.com/images/Cirque_of_the_Towers.jpg"
+    # Number of worker threads, and how many connections may wait for a free worker
+    threads = (os.cpu_count() or 1) * 4
+    queue_size = 64
+    # Where hits are kept while the database is not available (dropped if not set)
+    spill_file = None
+    # How often the latest hits of all servers are read for /data (0 for this server only)
+    data_refresh = 5
     try:
         opts, args = getopt.getopt(
             argv,
-            "hu:p:s:w:d:o:",
+            "hu:p:s:w:d:o:t:q:f:r:",
             [
-                "help"
+                "help",
                 "image_url=",
                 "server_port=",
                 "db_user=",
                 "db_pswd=",
                 "db_name=",
                 "db_host=",
+                "threads=",
+                "queue_size=",
+                "spill_file=",
+                "data_refresh=",
             ]
         )
     except getopt.GetoptError:
-        print('server.py -u <image_url> -p <server_port> -s <db_user> -w <db_pswd> -d <db_name> -o <db_host>')
+        print(USAGE)
         sys.exit(2)
     print(opts)
     for opt, arg in opts:
         if opt in ("-h", "--help"):
-            print('server.py -u <image_url> -p <server_port> -s <db_user> -w <db_pswd> -d <db_name> -o <db_host>')
+            print(USAGE)
             sys.exit()
         elif opt in ("-u", "--image_url"):
             image_url = arg
@@ -127,13 +534,37 @@ def run(argv):
             db_name = arg
         elif opt in ("-o", "--db_host"):
             db_host = arg
+        elif opt in ("-t", "--threads"):
+            threads = int(arg)
+        elif opt in ("-q", "--queue_size"):
+            queue_size = int(arg)
+        elif opt in ("-f", "--spill_file"):
+            spill_file = arg
+        elif opt in ("-r", "--data_refresh"):
+            data_refresh = float(arg)
+
     # Setup DB
     print(db_host, db_user, db_pswd, db_name)
+    connect = partial(pymysql.connect, host=db_host, user=db_user, password=db_pswd, database=db_name)
+    # One connection writes the hits, the other reads the latest hits for /data
+    db_pool = ConnectionPool(connect, size=2)
+
+    # Read the EC2 metadata before the first request
+    instance_metadata.start()
     print('starting server...')
     server_address = ('0.0.0.0', server_port)
-    handler = partial(RequestHandler, image_url, db_host, db_user, db_pswd, db_name)
-    httpd = HTTPServer(server_address, handler)
-    print('running server...')
-    httpd.serve_forever()
+
+    recent_hits = RecentHits(db_pool, reconcile_interval=data_refresh).start()
+    hit_recorder = HitRecorder(db_pool, recent_hits, spill_file=spill_file).start()
+    handler = partial(RequestHandler, image_url, hit_recorder, recent_hits)
+    httpd = PooledHTTPServer(server_address, handler, threads, queue_size)
+    print('running server with %d worker threads...' % threads)
+    try:
+        httpd.serve_forever()
+    finally:
+        # Write the hits that are still buffered
+        hit_recorder.flush()
+
+
 if __name__ == "__main__":
     run(sys.argv[1:])
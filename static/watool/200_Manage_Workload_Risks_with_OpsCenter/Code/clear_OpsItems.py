@@ -1,64 +1,127 @@
+import argparse
 import boto3
-import sys
+import botocore.config
+import botocore.exceptions
+import concurrent.futures
+import datetime
+import json
 
-try:
-    region = sys.argv[1]
-    ssm = boto3.client('ssm', region_name=region)
-
-    response = ssm.describe_ops_items(
-        OpsItemFilters=[
-            {
-                'Key': 'Source',
-                'Values': [
-                    'Well-Architected',
-                ],
-                'Operator': 'Equal'
-            },
-            {
-                'Key': 'Status',
-                'Values': [
-                    'Open',
-                ],
-                'Operator': 'Equal'
-            }
-        ]
+PARSER = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description='''\
+Resolve the OpsItems created by the Well-Architected risk tracking solution.
+By default every open OpsItem with the source Well-Architected is resolved.
+    '''
     )
+PARSER.add_argument('region', help='AWS Region used to walk through this lab')
+PARSER.add_argument('-w', '--workload', help='Only resolve OpsItems for this workload name')
+PARSER.add_argument('-p', '--pillar', help='Only resolve OpsItems for this pillar id (e.g. security, reliability)')
+PARSER.add_argument('-a', '--older-than-days', type=int, help='Only resolve OpsItems created more than this many days ago')
+PARSER.add_argument('-d', '--dry-run', action='store_true', help='Count the matching OpsItems without resolving them')
+PARSER.add_argument('-c', '--concurrency', type=int, default=10, help='Number of OpsItems resolved at the same time')
+
+def build_filters(workload=None, pillar=None, older_than_days=None):
+    filters = [
+        {
+            'Key': 'Source',
+            'Values': [
+                'Well-Architected',
+            ],
+            'Operator': 'Equal'
+        },
+        {
+            'Key': 'Status',
+            'Values': [
+                'Open',
+            ],
+            'Operator': 'Equal'
+        }
+    ]
+    # Workload name and pillar are stored as operational data by risk_tracking.py
+    if workload:
+        filters.append({
+            'Key': 'OperationalData',
+            'Values': [
+                json.dumps({'key': 'WorkloadName', 'value': workload}),
+            ],
+            'Operator': 'Equal'
+        })
+    if pillar:
+        filters.append({
+            'Key': 'OperationalData',
+            'Values': [
+                json.dumps({'key': 'Pillar', 'value': pillar}),
+            ],
+            'Operator': 'Equal'
+        })
+    if older_than_days is not None:
+        created_before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)
+        filters.append({
+            'Key': 'CreatedTime',
+            'Values': [
+                created_before.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            ],
+            'Operator': 'LessThan'
+        })
+    return(filters)
 
+def list_ops_items(ssm, filters):
+    # Yield every matching OpsItem id, passing NextToken back so each page is only read once
+    kwargs = {'OpsItemFilters': filters}
+    while True:
+        response = ssm.describe_ops_items(**kwargs)
+        for summary in response['OpsItemSummaries']:
+            yield summary['OpsItemId']
+        if 'NextToken' not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+
+def resolve_ops_item(ssm, opsitem):
+    ssm.update_ops_item(
+        Status='Resolved',
+        OpsItemId=opsitem
+    )
+    return(opsitem)
 
-    for i,val in enumerate(response['OpsItemSummaries']):
-            opsitem = response['OpsItemSummaries'][i]['OpsItemId']
-            update = ssm.update_ops_item(
-            Status='Resolved',
-            OpsItemId=opsitem
-        )
+def main():
+    arguments = PARSER.parse_args()
 
-    while 'NextToken' in response:
-        response = ssm.describe_ops_items(
-        OpsItemFilters=[
-            {
-                'Key': 'Source',
-                'Values': [
-                    'Well-Architected',
-                ],
-                'Operator': 'Equal'
-            },
-            {
-                'Key': 'Status',
-                'Values': [
-                    'Open',
-                ],
-                'Operator': 'Equal'
-            }
-        ]
+    # Adaptive retries back off and slow every worker down together when we are throttled
+    client_config = botocore.config.Config(
+        max_pool_connections=max(10, arguments.concurrency),
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
     )
+    ssm = boto3.client('ssm', region_name=arguments.region, config=client_config)
+
+    filters = build_filters(arguments.workload, arguments.pillar, arguments.older_than_days)
+
+    # Read every page before resolving anything, resolving items while paging over the
+    # open OpsItems would change the result set underneath the NextToken
+    opsitems = list(list_ops_items(ssm, filters))
+
+    if arguments.dry_run:
+        print('%d Well-Architected OpsItems would be resolved' % len(opsitems))
+        return
+
+    resolved = 0
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=arguments.concurrency) as executor:
+        futures = [executor.submit(resolve_ops_item, ssm, opsitem) for opsitem in opsitems]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+                resolved += 1
+            except botocore.exceptions.ClientError as e:
+                print('Unable to resolve OpsItem: ' + str(e))
+                failed += 1
 
-        for i,val in enumerate(response['OpsItemSummaries']):
-            opsitem = response['OpsItemSummaries'][i]['OpsItemId']
-            update = ssm.update_ops_item(
-            Status='Resolved',
-            OpsItemId=opsitem
-        )
+    print('%d Well-Architected OpsItems have been resolved' % resolved)
+    if failed:
+        print('%d OpsItems could not be resolved, run the script again to retry them' % failed)
 
-    print('Well-Architected OpsItems have been resolved')
-except:
-    print('Please specify an AWS Region and try again.')
+if __name__ == '__main__':
+    try:
+        main()
+    except (botocore.exceptions.ClientError, botocore.exceptions.NoRegionError, botocore.exceptions.EndpointConnectionError) as e:
+        print(e)
+        print('Please check the AWS Region and credentials and try again.')
@@ -1,13 +1,46 @@
 import boto3
+import botocore.config
 import json
 import os
+import threading
+import time
 import urllib.request
+import concurrent.futures
 from bs4 import BeautifulSoup
 
-# Initialize API clients
-wa = boto3.client('wellarchitected')
-ssm = boto3.client('ssm')
-dynamodb = boto3.client('dynamodb')
+# Number of workloads processed at the same time
+WORKLOAD_CONCURRENCY = int(os.environ.get('workload_concurrency', '4'))
+# Number of OpsItems created at the same time, and the maximum number created per second
+OPSITEM_CONCURRENCY = int(os.environ.get('opsitem_concurrency', '5'))
+OPSITEM_RATE = float(os.environ.get('opsitem_rate', '5'))
+
+# DynamoDB batch limits
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_RETRIES = 8
+# Write the finished workload states right away once the Lambda has less than this left to run
+FLUSH_MARGIN_MS = int(os.environ.get('flush_margin_ms', '10000'))
+
+# Initialize API clients (clients are thread safe and shared by every worker)
+clientConfig = botocore.config.Config(
+    max_pool_connections=max(10, WORKLOAD_CONCURRENCY + OPSITEM_CONCURRENCY),
+    retries={'max_attempts': 10, 'mode': 'adaptive'}
+)
+wa = boto3.client('wellarchitected', config=clientConfig)
+ssm = boto3.client('ssm', config=clientConfig)
+dynamodb = boto3.client('dynamodb', config=clientConfig)
+
+# Skip workloads whose fingerprint (UpdatedAt and risk counts) is unchanged since the last run.
+# Set the environment variable incremental to 'false' to force a full scan of every workload.
+INCREMENTAL = os.environ.get('incremental', 'true').lower() != 'false'
+
+# Improvement plan pages shared by every question and workload, kept for the life of the Lambda container
+IMPROVEMENT_PLAN_PAGE_CACHE = {}
+CACHE_LOCK = threading.Lock()
+
+# Next time an OpsItem may be created, shared by every OpsItem worker
+RATE_LOCK = threading.Lock()
+NEXT_OPSITEM_SLOT = [0.0]
 
 def lambda_handler(event, context):
     #Print the incoming event
@@ -16,164 +49,221 @@ def lambda_handler(event, context):
     #Get a list of workloads from the WA Tool
     workloads = list_workloads()
 
-    for workload in workloads:
-        workload_details = wa.get_workload(
-            WorkloadId=workload
-        )
-
-        workload_name = workload_details['Workload']['WorkloadName']
-        workload_arn = workload_details['Workload']['WorkloadArn']
-        hri_count = workload_details['Workload']['RiskCounts']['HIGH']
-        mri_count = workload_details['Workload']['RiskCounts']['MEDIUM']
-
-        print(workload_name, hri_count, mri_count)
-
-        if hri_count == 0 and mri_count == 0:
-            print('No risks identified for workload: ' + workload_name)
-            continue
-
-        # Get a list of improvements for workload
-        improvements = list_improvements(workload)
-
-        # Get the list of best practices missing from the workload
-        missing_bps = get_current_state(workload)
-
-        for improvement,val in enumerate(improvements):
-            question_id = improvements[improvement]['QuestionId']
-            question_title = improvements[improvement]['QuestionTitle']
-            pillar = improvements[improvement]['PillarId']
-            risk = improvements[improvement]['Risk']
-            improvement_plan = improvements[improvement]['ImprovementPlanUrl']
-
-            if risk == 'HIGH' or risk == 'MEDIUM':
-                get_answer_response = wa.get_answer(
-                    WorkloadId=workload,
-                    LensAlias='wellarchitected',
-                    QuestionId=question_id
-                )
-
-                # Get the improvement plan URL
-                urlresponse = urllib.request.urlopen(improvement_plan)
-                htmlBytes = urlresponse.read()
-                htmlStr = htmlBytes.decode("utf8")
-                htmlSplit = htmlStr.split('\n')
-
-                # Get the best practices selected for a question
-                selected_choices = []
-                choice_answers = get_answer_response['Answer']['ChoiceAnswers']
-                for choice_answer in choice_answers:
-                    selected_choices.append(choice_answer['ChoiceId'])
-
-                # Get choice ID for option 'None of these'
-                for bp_choice in get_answer_response['Answer']['Choices']:
-                    if bp_choice['Title'] == 'None of these':
-                        none_of_these = bp_choice['ChoiceId']
-
-                # No best practices selected if 'None of these' is selected
-                for choice_id in selected_choices:
-                    if choice_id == none_of_these:
-                        selected_choices = []
-
-                for choice in get_answer_response['Answer']['Choices']:
-                    if ((choice['ChoiceId'] not in selected_choices) and (choice['Title'] != 'None of these') and (choice['ChoiceId'] not in missing_bps)):
-                        missing_bps.append(choice['ChoiceId'])
-
-                        improvement_plan_url = improvement_plan
-
-                        for line in htmlSplit:
-                            if choice['Title'] in line:
-                                parsed = BeautifulSoup(line,features="html.parser")
-                                improvement_plan_url = str(parsed.a['href'])
-
-                        risk_title = choice['Title'].replace('\n','').strip()
-
-                        if risk == 'HIGH':
-                            opsitem_description='High Risk Issue(HRI) identified'
-                            opsitem_title='High Risk' + ' - ' + workload_name + ' - ' + risk_title
-                            severity='2'
-                        elif risk == 'MEDIUM':
-                            opsitem_description='Medium Risk Issue(MRI) identified'
-                            opsitem_title='Medium Risk' + ' - ' + workload_name + ' - ' + risk_title
-                            severity='3'
-
-                        # Create an OpsItem for missing Best practice
-                        create_opsitem = ssm.create_ops_item(
-                                  Description=opsitem_description,
-                                  OperationalData={
-                                      '/aws/resources': {
-                                          'Value': '[{\"arn\":\"' + workload_arn + '\"}]',
-                                          'Type': 'SearchableString'
-                                      },
-                                      'WorkloadName': {
-                                          'Value': workload_name,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'Best practices missing': {
-                                          'Value': risk_title,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'Improvement Plan': {
-                                          'Value': improvement_plan_url,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'Pillar': {
-                                          'Value': pillar,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'Question': {
-                                          'Value': question_title,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'Risk level': {
-                                          'Value': risk,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'QuestionId': {
-                                          'Value': question_id,
-                                          'Type': 'SearchableString'
-                                      },
-                                      'ChoiceId': {
-                                          'Value': choice['ChoiceId'],
-                                          'Type': 'SearchableString'
-                                      }
+    # Get the last known state of every workload in as few DynamoDB calls as possible
+    current_states = get_current_states([workload['WorkloadId'] for workload in workloads])
+
+    # Workloads and OpsItems use separate pools so a workload waiting on its OpsItems never blocks them
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WORKLOAD_CONCURRENCY) as workload_executor, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=OPSITEM_CONCURRENCY) as opsitem_executor:
+        futures = {
+            workload_executor.submit(
+                process_workload,
+                workload_summary,
+                current_states.get(workload_summary['WorkloadId'], {}),
+                opsitem_executor
+            ): workload_summary['WorkloadName']
+            for workload_summary in workloads
+        }
+        # Update the workload states on dynamo in batches of finished workloads. Once the Lambda
+        # is close to its timeout every state is written as soon as its workload is done, so a
+        # run that times out part way keeps the OpsItems it created and the next run does not
+        # repeat them
+        workload_states = []
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    workload_state = future.result()
+                except Exception as e:
+                    print('Failed to process workload ' + futures[future] + ': ' + str(e))
+                    continue
+                if workload_state is not None:
+                    workload_states.append(workload_state)
+            if len(workload_states) >= BATCH_WRITE_SIZE or (workload_states and context.get_remaining_time_in_millis() < FLUSH_MARGIN_MS):
+                write_workload_states(workload_states)
+                workload_states = []
+        write_workload_states(workload_states)
+
+def process_workload(workload_summary, current_state, opsitem_executor):
+    # The workload summary already carries the name, ARN and risk counts, so no get_workload call is needed
+    workload = workload_summary['WorkloadId']
+    workload_name = workload_summary['WorkloadName']
+    workload_arn = workload_summary['WorkloadArn']
+    hri_count = workload_summary['RiskCounts'].get('HIGH', 0)
+    mri_count = workload_summary['RiskCounts'].get('MEDIUM', 0)
+
+    print(workload_name, hri_count, mri_count)
+
+    if hri_count == 0 and mri_count == 0:
+        print('No risks identified for workload: ' + workload_name)
+        return(None)
+
+    # Get the list of best practices missing from the workload and the fingerprint of the last run
+    missing_bps = current_state.get('missing_bps', {}).get('SS', [])
+    last_fingerprint = current_state.get('fingerprint', {}).get('S')
+
+    fingerprint = get_fingerprint(workload_summary)
+    if INCREMENTAL and fingerprint == last_fingerprint:
+        print('Workload unchanged since last run, skipping: ' + workload_name)
+        return(None)
+
+    # Get a list of improvements for workload
+    improvements = list_improvements(workload)
+
+    # Best practices this run creates an OpsItem for
+    new_bps = []
+
+    opsitem_futures = {}
+    for improvement,val in enumerate(improvements):
+        question_id = improvements[improvement]['QuestionId']
+        question_title = improvements[improvement]['QuestionTitle']
+        pillar = improvements[improvement]['PillarId']
+        risk = improvements[improvement]['Risk']
+        improvement_plan = improvements[improvement]['ImprovementPlanUrl']
+
+        if risk == 'HIGH' or risk == 'MEDIUM':
+            get_answer_response = wa.get_answer(
+                WorkloadId=workload,
+                LensAlias='wellarchitected',
+                QuestionId=question_id
+            )
+
+            # Get the improvement plan page (cached across questions and workloads)
+            htmlSplit = get_improvement_plan_page(improvement_plan)
+
+            # Get the best practices selected for a question
+            selected_choices = []
+            choice_answers = get_answer_response['Answer']['ChoiceAnswers']
+            for choice_answer in choice_answers:
+                selected_choices.append(choice_answer['ChoiceId'])
+
+            # Get choice ID for option 'None of these'
+            none_of_these = None
+            for bp_choice in get_answer_response['Answer']['Choices']:
+                if bp_choice['Title'] == 'None of these':
+                    none_of_these = bp_choice['ChoiceId']
+
+            # No best practices selected if 'None of these' is selected
+            for choice_id in selected_choices:
+                if choice_id == none_of_these:
+                    selected_choices = []
+
+            for choice in get_answer_response['Answer']['Choices']:
+                if ((choice['ChoiceId'] not in selected_choices) and (choice['Title'] != 'None of these') and (choice['ChoiceId'] not in missing_bps)):
+                    missing_bps.append(choice['ChoiceId'])
+                    new_bps.append(choice['ChoiceId'])
+
+                    improvement_plan_url = improvement_plan
+
+                    for line in htmlSplit:
+                        if choice['Title'] in line:
+                            parsed = BeautifulSoup(line,features="html.parser")
+                            improvement_plan_url = str(parsed.a['href'])
+
+                    risk_title = choice['Title'].replace('\n','').strip()
+
+                    if risk == 'HIGH':
+                        opsitem_description='High Risk Issue(HRI) identified'
+                        opsitem_title='High Risk' + ' - ' + workload_name + ' - ' + risk_title
+                        severity='2'
+                    elif risk == 'MEDIUM':
+                        opsitem_description='Medium Risk Issue(MRI) identified'
+                        opsitem_title='Medium Risk' + ' - ' + workload_name + ' - ' + risk_title
+                        severity='3'
+
+                    # Create an OpsItem for missing Best practice
+                    opsitem = dict(
+                              Description=opsitem_description,
+                              OperationalData={
+                                  '/aws/resources': {
+                                      'Value': '[{\"arn\":\"' + workload_arn + '\"}]',
+                                      'Type': 'SearchableString'
                                   },
-                                  Source='Well-Architected',
-                                  Notifications=[
-                                    {
-                                        'Arn': os.environ['sns_topic_arn']
-                                    }
-                                  ],
-                                  Title=opsitem_title,
-                                  Severity=severity
-                                )
-
-                        print(create_opsitem)
-
-        # Update the workload state on dynamo
-        update_workload_state = dynamodb.put_item(
-            TableName='wa_workload_data',
-            Item={
-                'workload_id': {
-                    'S': workload
-                },
-                'missing_bps': {
-                    'SS': missing_bps
-                }
-            }
-        )
-
-        print(update_workload_state)
+                                  'WorkloadName': {
+                                      'Value': workload_name,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'Best practices missing': {
+                                      'Value': risk_title,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'Improvement Plan': {
+                                      'Value': improvement_plan_url,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'Pillar': {
+                                      'Value': pillar,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'Question': {
+                                      'Value': question_title,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'Risk level': {
+                                      'Value': risk,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'QuestionId': {
+                                      'Value': question_id,
+                                      'Type': 'SearchableString'
+                                  },
+                                  'ChoiceId': {
+                                      'Value': choice['ChoiceId'],
+                                      'Type': 'SearchableString'
+                                  }
+                              },
+                              Source='Well-Architected',
+                              Notifications=[
+                                {
+                                    'Arn': os.environ['sns_topic_arn']
+                                }
+                              ],
+                              Title=opsitem_title,
+                              Severity=severity
+                            )
+
+                    opsitem_futures[opsitem_executor.submit(create_opsitem, opsitem)] = choice['ChoiceId']
+
+    # Only record best practices whose OpsItem was created, failed ones are retried on the next run
+    for future in concurrent.futures.as_completed(opsitem_futures):
+        try:
+            print(future.result())
+        except Exception as e:
+            print('Failed to create OpsItem for ' + workload_name + ': ' + str(e))
+            new_bps.remove(opsitem_futures[future])
+            # Force the workload to be processed again on the next run
+            fingerprint = 'retry'
+
+    workload_state = {
+        'workload_id': workload,
+        'fingerprint': fingerprint,
+        'new_bps': new_bps
+    }
+    return(workload_state)
+
+def create_opsitem(opsitem):
+    # Space out OpsItem creation across all workers to stay under the OpsCenter request rate
+    with RATE_LOCK:
+        now = time.monotonic()
+        wait = NEXT_OPSITEM_SLOT[0] - now
+        NEXT_OPSITEM_SLOT[0] = max(now, NEXT_OPSITEM_SLOT[0]) + 1.0 / OPSITEM_RATE
+    if wait > 0:
+        time.sleep(wait)
+
+    create_opsitem_response = ssm.create_ops_item(**opsitem)
+    return(create_opsitem_response['OpsItemId'])
 
 def list_workloads():
     list_workloads_response = wa.list_workloads()
 
-    workloads = [workload['WorkloadId'] for workload in list_workloads_response['WorkloadSummaries']]
+    workloads = list_workloads_response['WorkloadSummaries']
 
     while 'NextToken' in list_workloads_response:
         list_workloads_response = wa.list_workloads(
         NextToken = list_workloads_response['NextToken']
         )
-        workloads.extend(workload['WorkloadId'] for workload in list_workloads_response['WorkloadSummaries'])
+        workloads.extend(list_workloads_response['WorkloadSummaries'])
 
     return(workloads)
 
@@ -195,17 +285,103 @@ def list_improvements(workload):
 
     return(improvements)
 
-def get_current_state(workload):
-    try:
-        workload_current_state = dynamodb.get_item(
-            TableName='wa_workload_data',
-            Key={
-                'workload_id': {
-                    'S': workload
-                }
+def get_current_states(workloads):
+    # Returns the stored item for each workload id, read in batches of up to 100 keys
+    current_states = {}
+    for start in range(0, len(workloads), BATCH_GET_SIZE):
+        request = {
+            'wa_workload_data': {
+                'Keys': [{'workload_id': {'S': workload}} for workload in workloads[start:start + BATCH_GET_SIZE]]
             }
-        )
-        missing_bps = workload_current_state['Item']['missing_bps']['SS']
-    except:
-        missing_bps = []
-    return(missing_bps)
+        }
+        attempt = 0
+        while request:
+            try:
+                batch_get_response = dynamodb.batch_get_item(RequestItems=request)
+            except Exception as e:
+                print('Unable to read workload state, processing as new workloads: ' + str(e))
+                break
+            for item in batch_get_response['Responses'].get('wa_workload_data', []):
+                current_states[item['workload_id']['S']] = item
+            request = batch_get_response.get('UnprocessedKeys')
+            attempt += 1
+            if request:
+                if attempt >= MAX_BATCH_RETRIES:
+                    print('Unable to read all workload state, processing the rest as new workloads')
+                    break
+                time.sleep(min(2 ** attempt * 0.1, 5))
+    return(current_states)
+
+def write_workload_states(workload_states):
+    # update_workload removes resolved best practices from missing_bps while this function runs,
+    # so the items are not replaced as a whole. Each update only sets the fingerprint and adds
+    # the best practices this run created OpsItems for. The updates are sent at the same time.
+    if not workload_states:
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(workload_states), WORKLOAD_CONCURRENCY)) as executor:
+        futures = {
+            executor.submit(write_workload_state, workload_state): workload_state['workload_id']
+            for workload_state in workload_states
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print('Unable to write workload state for ' + futures[future] + ': ' + str(e))
+
+def write_workload_state(workload_state):
+    update_expression = 'SET fingerprint = :fingerprint'
+    expression_values = {
+        ':fingerprint': {
+            'S': workload_state['fingerprint']
+        }
+    }
+    # DynamoDB does not allow empty string sets
+    if workload_state['new_bps']:
+        update_expression += ' ADD missing_bps :new_bps'
+        expression_values[':new_bps'] = {
+            'SS': workload_state['new_bps']
+        }
+    dynamodb.update_item(
+        TableName='wa_workload_data',
+        Key={
+            'workload_id': {
+                'S': workload_state['workload_id']
+            }
+        },
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=expression_values
+    )
+
+def get_fingerprint(workload_summary):
+    # A workload only needs to be processed again if it was updated or its risk counts changed
+    risk_counts = workload_summary['RiskCounts']
+    return('|'.join([
+        workload_summary['UpdatedAt'].isoformat(),
+        str(risk_counts.get('HIGH', 0)),
+        str(risk_counts.get('MEDIUM', 0))
+    ]))
+
+def get_improvement_plan_page(improvement_plan):
+    # Every best practice in a question shares the same page, only the #fragment differs
+    page_url = improvement_plan.split('#')[0]
+    # The first thread to ask for a page stores a Future for it and downloads it, any other
+    # thread asking for the same page waits on that Future instead of downloading it again
+    with CACHE_LOCK:
+        page_future = IMPROVEMENT_PLAN_PAGE_CACHE.get(page_url)
+        download_page = page_future is None
+        if download_page:
+            page_future = concurrent.futures.Future()
+            IMPROVEMENT_PLAN_PAGE_CACHE[page_url] = page_future
+    if download_page:
+        try:
+            urlresponse = urllib.request.urlopen(page_url)
+            htmlBytes = urlresponse.read()
+            htmlStr = htmlBytes.decode("utf8")
+            page_future.set_result(htmlStr.split('\n'))
+        except Exception as e:
+            # Do not keep the failure, the next caller will try the download again
+            with CACHE_LOCK:
+                del IMPROVEMENT_PLAN_PAGE_CACHE[page_url]
+            page_future.set_exception(e)
+    return(page_future.result())
@@ -7,61 +7,102 @@ ssm = boto3.client('ssm')
 wa = boto3.client('wellarchitected')
 dynamodb = boto3.client('dynamodb')
 
+#Choice ID of 'None of these' for each question, kept for the life of the Lambda container
+NONE_OF_THESE_CACHE = {}
+
 def lambda_handler(event, context):
 
     #Print the incoming event
     print('Incoming Event:' + json.dumps(event))
 
-    #Get OpsItem ID from incoming event
-    opsItem_id = event['Records'][0]['Sns']['Subject']
-    print(opsItem_id)
+    #Group the resolved best practices by workload and question so each question is updated once
+    resolved_bps = {}
+    for opsItem_id in get_opsitem_ids(event):
+        print(opsItem_id)
+
+        #Get OpsItem status
+        opsItem = ssm.get_ops_item(
+            OpsItemId=opsItem_id
+        )
 
-    #Get OpsItem status
-    opsItem = ssm.get_ops_item(
-        OpsItemId=opsItem_id
+        opsItem_status = opsItem['OpsItem']['Status']
+        print(opsItem_status)
+
+        if opsItem_status == 'Resolved':
+            workload = opsItem['OpsItem']['OperationalData']['/aws/resources']['Value'].split('"')[3].split('/')[1]
+            question_id = opsItem['OpsItem']['OperationalData']['QuestionId']['Value']
+            new_bp = opsItem['OpsItem']['OperationalData']['ChoiceId']['Value']
+            resolved_bps.setdefault(workload, {}).setdefault(question_id, set()).add(new_bp)
+
+    for workload, questions in resolved_bps.items():
+        for question_id, new_bps in questions.items():
+            update_question(workload, question_id, new_bps)
+
+        update_workload_state(workload, set().union(*questions.values()))
+
+def get_opsitem_ids(event):
+    #OpsItem IDs arrive as the SNS subject, either directly from SNS or wrapped in SQS messages
+    opsItem_ids = []
+    for record in event['Records']:
+        if 'Sns' in record:
+            opsItem_id = record['Sns']['Subject']
+        else:
+            opsItem_id = json.loads(record['body'])['Subject']
+        if opsItem_id not in opsItem_ids:
+            opsItem_ids.append(opsItem_id)
+    return(opsItem_ids)
+
+def update_question(workload, question_id, new_bps):
+    #Get current answer for the question
+    current_answer = wa.get_answer(
+        WorkloadId=workload,
+        LensAlias='wellarchitected',
+        QuestionId=question_id
     )
 
-    opsItem_status = opsItem['OpsItem']['Status']
-    print(opsItem_status)
+    #Check if none of these is a selected option
+    none_of_these = get_none_of_these(question_id, current_answer)
 
-    if opsItem_status == 'Resolved':
-        workload = opsItem['OpsItem']['OperationalData']['/aws/resources']['Value'].split('"')[3].split('/')[1]
-        question_id = opsItem['OpsItem']['OperationalData']['QuestionId']['Value']
-        new_bp = opsItem['OpsItem']['OperationalData']['ChoiceId']['Value']
+    selected_choices = current_answer['Answer']['SelectedChoices']
 
-        #Get current answer for the question
-        current_answer = wa.get_answer(
-            WorkloadId=workload,
-            LensAlias='wellarchitected',
-            QuestionId=question_id
-        )
+    #If none of these is selected, no best practices applied for this question
+    if none_of_these in selected_choices:
+        selected_choices = []
 
-        #Check if none of these is a selected option
-        for bp_choice in current_answer['Answer']['Choices']:
-            if bp_choice['Title'] == 'None of these':
-                none_of_these = bp_choice['ChoiceId']
+    selected_choices.extend(bp for bp in sorted(new_bps) if bp not in selected_choices)
 
-        selected_choices = current_answer['Answer']['SelectedChoices']
+    print('update answer: ', selected_choices)
 
-        #If none of these is selected, no best practices applied for this question
-        for choice_id in selected_choices:
-            if choice_id == none_of_these:
-                selected_choices = []
+    #Update the answers for the question on the AWS WA Tool
+    updated_answer = wa.update_answer(
+        WorkloadId=workload,
+        LensAlias='wellarchitected',
+        QuestionId=question_id,
+        SelectedChoices=selected_choices
+    )
 
-        selected_choices.append(new_bp)
+def get_none_of_these(question_id, answer):
+    #Choices for a question are fixed by the lens, so the scan only happens once per question
+    if question_id not in NONE_OF_THESE_CACHE:
+        NONE_OF_THESE_CACHE[question_id] = None
+        for bp_choice in answer['Answer']['Choices']:
+            if bp_choice['Title'] == 'None of these':
+                NONE_OF_THESE_CACHE[question_id] = bp_choice['ChoiceId']
+    return(NONE_OF_THESE_CACHE[question_id])
 
-        print('update answer: ', selected_choices)
+def update_workload_state(workload, new_bps):
+    #Get current HRI and MRI count for the workload
+    workload_details = wa.get_workload(
+        WorkloadId=workload
+    )
 
-        #Update the answers for the question on the AWS WA Tool
-        updated_answer = wa.update_answer(
-            WorkloadId=workload,
-            LensAlias='wellarchitected',
-            QuestionId=question_id,
-            SelectedChoices=selected_choices
-        )
+    hri_count = workload_details['Workload']['RiskCounts'].get('HIGH', 0)
+    mri_count = workload_details['Workload']['RiskCounts'].get('MEDIUM', 0)
 
-        #Get current state for the workload that is tracked in DynamoDB
-        workload_current_state = dynamodb.get_item(
+    #If risk count is 0, remove workload entry from DynamoDB, else remove the resolved best practices from the state on DynamoDB
+    try:
+        if hri_count == 0 and mri_count == 0:
+            delete_workload_state = dynamodb.delete_item(
                 TableName='wa_workload_data',
                 Key={
                     'workload_id': {
@@ -69,40 +110,24 @@ def lambda_handler(event, context):
                     }
                 }
             )
-
-        current_state = workload_current_state['Item']['missing_bps']['SS']
-
-        #Get current HRI and MRI count for the workload from DynamoDB
-        workload_details = wa.get_workload(
-            WorkloadId=workload
-        )
-
-        hri_count = workload_details['Workload']['RiskCounts']['HIGH']
-        mri_count = workload_details['Workload']['RiskCounts']['MEDIUM']
-
-        #If risk count is 0, remove workload entry from DynamoDB, else update state for the workload on DynamoDB
-        try:
-            if hri_count == 0 and mri_count == 0:
-                delete_workload_state = dynamodb.delete_item(
-                    TableName='wa_workload_data',
-                    Key={
-                        'workload_id': {
-                            'S': workload
-                        }
-                    }
-                )
-            else:
-                current_state.remove(new_bp)
-                workload_updated_state = dynamodb.put_item(
+        else:
+            #Single atomic update, only applied to workloads already tracked by the risk tracking function
+            workload_updated_state = dynamodb.update_item(
                 TableName='wa_workload_data',
-                Item={
+                Key={
                     'workload_id': {
                         'S': workload
-                    },
-                    'missing_bps': {
-                        'SS': current_state
+                    }
+                },
+                UpdateExpression='DELETE missing_bps :resolved',
+                ConditionExpression='attribute_exists(workload_id)',
+                ExpressionAttributeValues={
+                    ':resolved': {
+                        'SS': sorted(new_bps)
                     }
                 }
             )
-        except Exception as e:
-            print(e)
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        print('Workload ' + workload + ' is not tracked in DynamoDB')
+    except Exception as e:
+        print(e)
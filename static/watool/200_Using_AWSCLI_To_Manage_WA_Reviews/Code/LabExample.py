@@ -193,6 +193,84 @@ def listLens(
 
     return lenses
 
+def normalizeTitle(
+    title
+    ):
+    # Collapse whitespace and case so lookups are not thrown off by formatting
+    return " ".join(title.split()).lower()
+
+def buildQuestionIndex(
+    waclient,
+    workloadId,
+    lensAlias,
+    pillarId
+    ):
+    # Build a lookup index of every question and choice title for a lens pillar.
+    # list_answers already returns the choices for each question, so a single
+    # paginated pass is all we need for every lookup during this invocation.
+    # Errors are logged and re-raised, since no question can be resolved without the index
+    questionIndex = {"Questions": [], "Choices": {}}
+    try:
+        response=waclient.list_answers(
+        WorkloadId=workloadId,
+        LensAlias=lensAlias,
+        PillarId=pillarId
+        )
+        answers = response['AnswerSummaries']
+        while "NextToken" in response:
+            response = waclient.list_answers(WorkloadId=workloadId,LensAlias=lensAlias,PillarId=pillarId,NextToken=response["NextToken"])
+            answers.extend(response["AnswerSummaries"])
+    except botocore.exceptions.ParamValidationError as e:
+        logger.error("ERROR - Parameter validation error: %s" % e)
+        raise
+    except botocore.exceptions.ClientError as e:
+        logger.error("ERROR - Unexpected error: %s" % e)
+        raise
+
+    for answer in answers:
+        questionIndex["Questions"].append((normalizeTitle(answer['QuestionTitle']), answer['QuestionId']))
+        questionIndex["Choices"][answer['QuestionId']] = [(normalizeTitle(choice['Title']), choice['ChoiceId']) for choice in answer['Choices']]
+    return questionIndex
+
+def lookupTitle(
+    entries,
+    title
+    ):
+    # Exact match first, then fall back to the first title that starts with the search text
+    searchTitle = normalizeTitle(title)
+    for entryTitle, entryId in entries:
+        if entryTitle == searchTitle:
+            return entryId
+    for entryTitle, entryId in entries:
+        if entryTitle.startswith(searchTitle):
+            return entryId
+    return None
+
+def lookupQuestionId(
+    questionIndex,
+    questionTitle
+    ):
+    # Find a questionID using the questionTitle from a prebuilt index
+    questionId = lookupTitle(questionIndex["Questions"], questionTitle)
+    if questionId is None:
+        raise ValueError("No question found matching '%s'" % questionTitle)
+    return questionId
+
+def lookupChoiceIds(
+    questionIndex,
+    questionId,
+    choiceTitles
+    ):
+    # Find every choiceId for a list of choiceTitles from a prebuilt index
+    choices = questionIndex["Choices"].get(questionId, [])
+    choiceIds = []
+    for choiceTitle in choiceTitles:
+        choiceId = lookupTitle(choices, choiceTitle)
+        if choiceId is None:
+            raise ValueError("No choice found matching '%s' for question %s" % (choiceTitle, questionId))
+        choiceIds.append(choiceId)
+    return choiceIds
+
 def findQuestionId(
     waclient,
     workloadId,
@@ -534,17 +612,20 @@ def main():
     logger.info("3 - Performing a review")
 
     logger.info("3 - STEP1 - Find the QuestionId and ChoiceID for a particular pillar question and best practice")
+    # Build the lookup index once so the question and every choice can be found without more API calls
+    questionIndex = buildQuestionIndex(WACLIENT,workloadId,'wellarchitected','operationalExcellence')
     questionSearch = "How do you reduce defects, ease remediation, and improve flow into production"
-    questionId = findQuestionId(WACLIENT,workloadId,'wellarchitected','operationalExcellence',questionSearch)
+    questionId = lookupQuestionId(questionIndex,questionSearch)
     logger.info("Found QuestionID of '%s' for the question text of '%s'" % (questionId, questionSearch))
 
-    choiceSet = []
-    choiceSet.append(findChoiceId(WACLIENT,workloadId,'wellarchitected',questionId,"Use version control"))
+    choiceSet = lookupChoiceIds(questionIndex,questionId,["Use version control"])
     logger.info("Found choiceId of '%s' for the choice text of 'Use version control'" % choiceSet)
-    choiceSet.append(findChoiceId(WACLIENT,workloadId,'wellarchitected',questionId,"Use configuration management systems"))
-    choiceSet.append(findChoiceId(WACLIENT,workloadId,'wellarchitected',questionId,"Use build and deployment management systems"))
-    choiceSet.append(findChoiceId(WACLIENT,workloadId,'wellarchitected',questionId,"Perform patch management"))
-    choiceSet.append(findChoiceId(WACLIENT,workloadId,'wellarchitected',questionId,"Use multiple environments"))
+    choiceSet.extend(lookupChoiceIds(questionIndex,questionId,[
+        "Use configuration management systems",
+        "Use build and deployment management systems",
+        "Perform patch management",
+        "Use multiple environments"
+        ]))
     logger.info("All choices we will select for questionId of %s is %s" % (questionId, choiceSet))
 
     logger.info("3 - STEP2 - Use the QuestionID and ChoiceID to update the answer in well-architected review")
@@ -1,9 +1,10 @@
 import botocore
+import botocore.config
 import boto3
 import json
 import datetime
+import concurrent.futures
 from aws_lambda_powertools import Logger
-import jmespath
 import cfnresponse
 from pkg_resources import packaging
 
@@ -18,6 +19,14 @@ blankjson = {}
 response = ""
 logger = Logger()
 
+# Number of questions we update at the same time, unless the resource sets a Concurrency property
+DEFAULT_CONCURRENCY = 5
+
+# CloudFormation only accepts 4096 bytes of response data, so only this many failures are
+# reported back (each one shortened). The result for every question is in the function log
+MAX_REPORTED_FAILURES = 3
+MAX_FAILURE_LENGTH = 256
+
 # Helper class to convert a datetime item to JSON.
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, z):
@@ -26,88 +35,119 @@ class DateTimeEncoder(json.JSONEncoder):
         else:
             return super().default(z)
 
-def findQuestionId(
+def normalizeTitle(
+    title
+    ):
+    # Collapse whitespace and case so lookups are not thrown off by formatting
+    return " ".join(title.split()).lower()
+
+def buildQuestionIndex(
     waclient,
     workloadId,
     lensAlias,
-    pillarId,
-    questionTitle
+    pillarId
     ):
-
-    # Find a questionID using the questionTitle
+    # Build a lookup index of every question and choice title for a lens pillar.
+    # list_answers already returns the choices for each question, so a single
+    # paginated pass is all we need for every lookup during this invocation.
+    # Errors are logged and re-raised, since no question can be resolved without the index
+    questionIndex = {"Questions": [], "Choices": {}}
     try:
         response=waclient.list_answers(
         WorkloadId=workloadId,
         LensAlias=lensAlias,
         PillarId=pillarId
         )
+        answers = response['AnswerSummaries']
+        while "NextToken" in response:
+            response = waclient.list_answers(WorkloadId=workloadId,LensAlias=lensAlias,PillarId=pillarId,NextToken=response["NextToken"])
+            answers.extend(response["AnswerSummaries"])
     except botocore.exceptions.ParamValidationError as e:
         logger.error("ERROR - Parameter validation error: %s" % e)
+        raise
     except botocore.exceptions.ClientError as e:
         logger.error("ERROR - Unexpected error: %s" % e)
+        raise
 
-    answers = response['AnswerSummaries']
-    while "NextToken" in response:
-        response = waclient.list_answers(WorkloadId=workloadId,LensAlias=lensAlias,PillarId=pillarId,NextToken=response["NextToken"])
-        answers.extend(response["AnswerSummaries"])
-
-    jmesquery = "[?starts_with(QuestionTitle, `"+questionTitle+"`) == `true`].QuestionId"
-    questionId = jmespath.search(jmesquery, answers)
+    for answer in answers:
+        questionIndex["Questions"].append((normalizeTitle(answer['QuestionTitle']), answer['QuestionId']))
+        questionIndex["Choices"][answer['QuestionId']] = [(normalizeTitle(choice['Title']), choice['ChoiceId']) for choice in answer['Choices']]
+    return questionIndex
 
-    return questionId[0]
-
-def findChoiceId(
-    waclient,
-    workloadId,
-    lensAlias,
+def lookupTitle(
+    entries,
+    title
+    ):
+    # Exact match first, then fall back to the first title that starts with the search text
+    searchTitle = normalizeTitle(title)
+    for entryTitle, entryId in entries:
+        if entryTitle == searchTitle:
+            return entryId
+    for entryTitle, entryId in entries:
+        if entryTitle.startswith(searchTitle):
+            return entryId
+    return None
+
+def lookupQuestionId(
+    questionIndex,
+    questionTitle
+    ):
+    # Find a questionID using the questionTitle from a prebuilt index
+    questionId = lookupTitle(questionIndex["Questions"], questionTitle)
+    if questionId is None:
+        raise ValueError("No question found matching '%s'" % questionTitle)
+    return questionId
+
+def lookupChoiceIds(
+    questionIndex,
     questionId,
-    choiceTitle,
+    choiceTitles
     ):
-
-    # Find a choiceId using the choiceTitle
-    try:
-        response=waclient.get_answer(
-        WorkloadId=workloadId,
-        LensAlias=lensAlias,
-        QuestionId=questionId
-        )
-    except botocore.exceptions.ParamValidationError as e:
-        logger.error("ERROR - Parameter validation error: %s" % e)
-    except botocore.exceptions.ClientError as e:
-        logger.error("ERROR - Unexpected error: %s" % e)
-
-    jmesquery = "Answer.Choices[?starts_with(Title, `"+choiceTitle+"`) == `true`].ChoiceId"
-    choiceId = jmespath.search(jmesquery, response)
-
-    return choiceId[0]
-
-def updateAnswersForQuestion(
+    # Find every choiceId for a list of choiceTitles from a prebuilt index
+    choices = questionIndex["Choices"].get(questionId, [])
+    choiceIds = []
+    for choiceTitle in choiceTitles:
+        choiceId = lookupTitle(choices, choiceTitle)
+        if choiceId is None:
+            raise ValueError("No choice found matching '%s' for question %s" % (choiceTitle, questionId))
+        choiceIds.append(choiceId)
+    return choiceIds
+
+def updateQuestion(
     waclient,
     workloadId,
     lensAlias,
-    questionId,
-    selectedChoices,
-    notes
+    questionIndex,
+    question,
+    answerList
     ):
 
-    # Update a answer to a question
+    # Resolve and update a single question, returning its status ("UPDATED" or the error)
+    try:
+        questionId = lookupQuestionId(questionIndex,question)
+        logger.info("Found QuestionID of '%s' for the question text of '%s'" % (questionId, question))
+        choiceSet = lookupChoiceIds(questionIndex,questionId,answerList)
+    except ValueError as e:
+        logger.error("ERROR - %s" % e)
+        return "ERROR: %s" % e
+
+    logger.info("All choices we will select for questionId of %s is %s" % (questionId, choiceSet))
+    # Update the answer for the question
     try:
-        response=waclient.update_answer(
+        waclient.update_answer(
         WorkloadId=workloadId,
         LensAlias=lensAlias,
         QuestionId=questionId,
-        SelectedChoices=selectedChoices,
-        Notes=notes
+        SelectedChoices=choiceSet,
+        Notes='Added by Python'
         )
     except botocore.exceptions.ParamValidationError as e:
         logger.error("ERROR - Parameter validation error: %s" % e)
+        return "ERROR: Parameter validation error"
     except botocore.exceptions.ClientError as e:
         logger.error("ERROR - Unexpected error: %s" % e)
-
-    # print(json.dumps(response))
-    jmesquery = "Answer.SelectedChoices"
-    answers = jmespath.search(jmesquery, response)
-    return answers
+        return "ERROR: %s" % e.response['Error']['Code']
+    return "UPDATED"
 
 def lambda_handler(event, context):
     boto3_min_version = "1.16.38"
@@ -123,6 +163,7 @@ def lambda_handler(event, context):
         LENS = event['ResourceProperties']['Lens']
         QUESTIONANSWERS = event['ResourceProperties']['QuestionAnswers']
         SERVICETOKEN = event['ResourceProperties']['ServiceToken']
+        CONCURRENCY = max(1, int(event['ResourceProperties'].get('Concurrency', DEFAULT_CONCURRENCY)))
     except:
         responseData['Error'] = "ERROR LOADING RESOURCE PROPERTIES"
         cfnresponse.send(event, context, cfnresponse.FAILED, responseData, 'createWAWorkloadHelperFunction')
@@ -135,23 +176,48 @@ def lambda_handler(event, context):
     # Create a new boto3 session
     SESSION = boto3.session.Session()
     # Initiate the well-architected session using the region defined above
+    # Adaptive retries keep the concurrent update_answer calls under the API throttling limits
     WACLIENT = SESSION.client(
         service_name='wellarchitected',
         region_name=REGION_NAME,
+        config=botocore.config.Config(
+            max_pool_connections=max(10, CONCURRENCY),
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
     )
 
+    # Build the question and choice lookup index once for every question in this invocation
+    try:
+        questionIndex = buildQuestionIndex(WACLIENT,WORKLOADID,LENS,PILLAR)
+    except (botocore.exceptions.ParamValidationError, botocore.exceptions.ClientError) as e:
+        responseData['Error'] = "ERROR LISTING ANSWERS: %s" % e
+        cfnresponse.send(event, context, cfnresponse.FAILED, responseData, 'createWAWorkloadHelperFunction')
+        return
+
+    questionList = []
     for qaList in QUESTIONANSWERS:
         for question, answerList in qaList.items():
             print(question, answerList)
-            # First we must find the questionID
-            questionId = findQuestionId(WACLIENT,WORKLOADID,LENS,PILLAR,question)
-            logger.info("Found QuestionID of '%s' for the question text of '%s'" % (questionId, question))
-            choiceSet = []
-            # Now we build the choice selection based on the answers provided
-            for answers in answerList:
-                choiceSet.append(findChoiceId(WACLIENT,WORKLOADID,LENS,questionId,answers))
-            logger.info("All choices we will select for questionId of %s is %s" % (questionId, choiceSet))
-            # Update the answer for the question
-            updateAnswersForQuestion(WACLIENT,WORKLOADID,LENS,questionId,choiceSet,'Added by Python')
+            questionList.append((question, answerList))
+
+    # Every question is resolved from the index above, so the only API calls left
+    # are the updates themselves which we run with bounded parallelism
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        futures = [executor.submit(updateQuestion,WACLIENT,WORKLOADID,LENS,questionIndex,question,answerList) for question, answerList in questionList]
+        results = [future.result() for future in futures]
+
+    # Log the result for each question, and report the counts and the first few failures back to CloudFormation
+    failures = []
+    for (question, answerList), resultStatus in zip(questionList, results):
+        logger.info("Result for question '%s': %s" % (question, resultStatus))
+        if resultStatus != "UPDATED":
+            failures.append(("%s: %s" % (question, resultStatus))[0:MAX_FAILURE_LENGTH])
+    responseData['Updated'] = len(results) - len(failures)
+    responseData['Failed'] = len(failures)
     # exit()
-    cfnresponse.send(event, context, cfnresponse.SUCCESS, responseData, 'createWAWorkloadHelperFunction')
+    if failures:
+        responseData['Failures'] = " | ".join(failures[0:MAX_REPORTED_FAILURES])
+        responseData['Error'] = "%d of %d questions failed to update, see the function log for every result" % (len(failures), len(results))
+        cfnresponse.send(event, context, cfnresponse.FAILED, responseData, 'createWAWorkloadHelperFunction')
+    else:
+        cfnresponse.send(event, context, cfnresponse.SUCCESS, responseData, 'createWAWorkloadHelperFunction')
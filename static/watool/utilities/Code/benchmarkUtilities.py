@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+This is a tool to benchmark the Well-Architected utilities against the local stand-in
+in localWAToolStandIn.py, reporting API calls, wall time and peak memory for each
+utility at increasing portfolio sizes
+
+No AWS account or credentials are needed, every boto3 session and client the
+utilities create is routed to the stand-in while they run.
+
+This code is only for use in Well-Architected labs
+*** NOT FOR PRODUCTION USE ***
+
+Licensed under the Apache 2.0 and MITnoAttr License.
+
+Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at https://aws.amazon.com/apache2.0/
+"""
+
+import builtins
+import contextlib
+import io
+import json
+import logging
+import os
+import runpy
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import argparse
+
+import localWAToolStandIn
+
+
+__author__    = "Eric Pullen"
+__email__     = "eppullen@amazon.com"
+__copyright__ = "Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved."
+__credits__   = ["Eric Pullen"]
+__version__   = "0.1"
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+WATOOL_DIR = os.path.dirname(os.path.dirname(CODE_DIR))
+
+# Each scenario runs one utility the way a user would, the arguments are built once the
+# synthetic portfolio exists. Lambda functions are loaded as a module and their handler called.
+SCENARIOS = [
+    {
+        "name": "exportAnswersToXLSX",
+        "script": os.path.join(CODE_DIR, "exportAnswersToXLSX.py"),
+        "args": lambda ctx: ["-w", ctx["workloadId"], "-f", os.path.join(ctx["outputDir"], "single.xlsx")],
+        "scales": False,
+    },
+    {
+        "name": "exportAnswersToXLSX-batch",
+        "script": os.path.join(CODE_DIR, "exportAnswersToXLSX.py"),
+        "args": lambda ctx: ["-n", ctx["prefix"], "-m", "-f", os.path.join(ctx["outputDir"], "batch.xlsx")],
+    },
+    {
+        "name": "generateWAFReport",
+        "script": os.path.join(CODE_DIR, "generateWAFReport.py"),
+        "args": lambda ctx: ["--workloadprefix", ctx["prefix"], "--outputdir", os.path.join(ctx["outputDir"], "report")],
+    },
+    {
+        "name": "duplicateWAFR",
+        "script": os.path.join(CODE_DIR, "duplicateWAFR.py"),
+        "args": lambda ctx: ["--workloadid", ctx["workloadId"], "--toregion", "us-west-2"],
+        "scales": False,
+    },
+    {
+        "name": "exportImportWAFR-portfolio",
+        "script": os.path.join(CODE_DIR, "exportImportWAFR.py"),
+        "args": lambda ctx: ["--exportPortfolio", "-f", os.path.join(ctx["outputDir"], "portfolio")],
+    },
+    {
+        "name": "exportMilestoneTimeSeries",
+        "script": os.path.join(CODE_DIR, "exportMilestoneTimeSeries.py"),
+        "args": lambda ctx: ["--export", "-f", os.path.join(ctx["outputDir"], "milestones.json.gz")],
+    },
+    {
+        "name": "LabExample",
+        "script": os.path.join(WATOOL_DIR, "200_Using_AWSCLI_To_Manage_WA_Reviews", "Code", "LabExample.py"),
+        "args": lambda ctx: [],
+        "scales": False,
+    },
+    {
+        "name": "risk_tracking",
+        "script": os.path.join(WATOOL_DIR, "200_Manage_Workload_Risks_with_OpsCenter", "Code", "risk_tracking.py"),
+        "handler": "lambda_handler",
+        "environment": {"sns_topic_arn": "arn:aws:sns:us-east-1:%s:wa-risk-tracking" % localWAToolStandIn.ACCOUNT_ID},
+    },
+]
+
+PARSER = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description='''\
+Run each utility against a fresh synthetic portfolio for every size given with --sizes
+and print a table of API calls, throttled calls, page downloads, wall time and peak memory.
+
+Utilities that only work on a single workload (marked "single") are run once per size so
+the effect of the portfolio size on them can still be seen.
+    '''
+    )
+PARSER.add_argument('-s','--sizes', type=int, nargs='+', default=[1, 10, 50], help='Portfolio sizes (number of workloads) to benchmark')
+PARSER.add_argument('-u','--utility', action='append', default=[], choices=[scenario['name'] for scenario in SCENARIOS], help='Only run this utility. Can be used multiple times')
+PARSER.add_argument('-q','--questions', type=int, default=6, help='Questions per pillar in each synthetic lens')
+PARSER.add_argument('-m','--milestones', type=int, default=3, help='Milestones per synthetic workload')
+PARSER.add_argument('-l','--latency', type=float, default=0.0, help='Seconds added to every API call. Example: 0.05')
+PARSER.add_argument('-j','--jitter', type=float, default=0.0, help='Up to this many extra seconds added to every API call')
+PARSER.add_argument('-P','--pagelatency', type=float, default=0.0, help='Seconds added to every improvement plan page download')
+PARSER.add_argument('-t','--throttle', type=float, default=0.0, help='Fraction of API calls rejected with ThrottlingException. Example: 0.05')
+PARSER.add_argument('-w','--writethrottle', type=float, default=None, help='Fraction of write API calls rejected with ThrottlingException (defaults to --throttle)')
+PARSER.add_argument('--nomemory', action='store_true', help='Do not trace memory, tracing slows the utilities down')
+PARSER.add_argument('--json', default="", help='Also write the results to this JSON file')
+PARSER.add_argument('-v','--verbose', action='store_true', help='Show the output of the utilities')
+
+
+def runScenario(
+    scenario,
+    standIn,
+    outputDir,
+    traceMemory=True,
+    verbose=False
+    ):
+    """ Run one utility against the stand-in and return its measurements """
+    workloads = standIn.regions[standIn.config.region]["workloads"]
+    context = {
+        "workloadId": next(iter(workloads)),
+        "prefix": standIn.config.workloadPrefix,
+        "outputDir": outputDir,
+    }
+    argv = [scenario['script']] + scenario.get('args', lambda ctx: [])(context)
+    status = "ok"
+
+    output = io.StringIO()
+    quiet = contextlib.ExitStack()
+    if not verbose:
+        # The utilities configure DEBUG logging at import time, a handler on the root logger
+        # turns their logging.basicConfig into a no-op
+        quiet.enter_context(mock.patch.object(logging.getLogger(), "handlers", [logging.NullHandler()]))
+        quiet.enter_context(contextlib.redirect_stdout(output))
+
+    with quiet, \
+         localWAToolStandIn.patchBoto3(standIn), \
+         mock.patch.object(sys, "argv", argv), \
+         mock.patch.dict(os.environ, scenario.get('environment', {})), \
+         mock.patch.object(builtins, "input", lambda *args: ""), \
+         tempfile.TemporaryDirectory() as workDir:
+        # Some utilities write files into the current directory
+        cwd = os.getcwd()
+        os.chdir(workDir)
+        if traceMemory:
+            tracemalloc.start()
+        startTime = time.perf_counter()
+        try:
+            if 'handler' in scenario:
+                module = runpy.run_path(scenario['script'], run_name=os.path.splitext(os.path.basename(scenario['script']))[0])
+                module[scenario['handler']]({}, None)
+            else:
+                runpy.run_path(scenario['script'], run_name="__main__")
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                status = "exit %s" % e.code
+        except Exception as e:
+            status = "%s: %s" % (type(e).__name__, e)
+        wallTime = time.perf_counter() - startTime
+        peakMemory = None
+        if traceMemory:
+            peakMemory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        os.chdir(cwd)
+
+    apiCalls = {"%s.%s" % key: count for key, count in standIn.callCounts.items() if key[0] != "http"}
+    return {
+        "utility": scenario['name'],
+        "workloads": standIn.config.workloads,
+        "status": status,
+        "apiCalls": standIn.apiCallCount(),
+        "throttled": sum(standIn.throttleCounts.values()),
+        "pages": standIn.callCounts[("http", "GetImprovementPlanPage")],
+        "wallTime": round(wallTime, 3),
+        "peakMemory": peakMemory,
+        "callsByOperation": apiCalls,
+    }
+
+def printResults(
+    results
+    ):
+    print("%-28s %9s %9s %9s %7s %9s %11s  %s" % ("Utility", "Workloads", "API calls", "Throttled", "Pages", "Wall (s)", "Peak (MiB)", "Status"))
+    for result in results:
+        peakMemory = "%.1f" % (result['peakMemory'] / 1048576.0) if result['peakMemory'] is not None else "-"
+        print("%-28s %9d %9d %9d %7d %9.3f %11s  %s" % (
+            result['utility'],
+            result['workloads'],
+            result['apiCalls'],
+            result['throttled'],
+            result['pages'],
+            result['wallTime'],
+            peakMemory,
+            result['status']
+        ))
+
+def main():
+    """ Main program run """
+    arguments = PARSER.parse_args()
+    scenarios = [scenario for scenario in SCENARIOS if not arguments.utility or scenario['name'] in arguments.utility]
+
+    results = []
+    for size in arguments.sizes:
+        for scenario in scenarios:
+            config = localWAToolStandIn.StandInConfig(
+                workloads=size,
+                questionsPerPillar=arguments.questions,
+                milestonesPerWorkload=arguments.milestones,
+                latency=arguments.latency,
+                latencyJitter=arguments.jitter,
+                pageLatency=arguments.pagelatency,
+                throttleRate=arguments.throttle,
+                writeThrottleRate=arguments.writethrottle,
+            )
+            # A fresh portfolio for every run, so one utility's writes never change another's numbers
+            standIn = localWAToolStandIn.LocalWAToolStandIn(config).start()
+            try:
+                with tempfile.TemporaryDirectory() as outputDir:
+                    result = runScenario(scenario, standIn, outputDir, not arguments.nomemory, arguments.verbose)
+            finally:
+                standIn.stop()
+            if scenario.get('scales', True) is False:
+                result['utility'] += " (single)"
+            results.append(result)
+            print("Finished %s with %d workloads in %.3f seconds (%s)" % (scenario['name'], size, result['wallTime'], result['status']), file=sys.stderr)
+
+    printResults(results)
+    if arguments.json:
+        with open(arguments.json, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+
+if __name__ == "__main__":
+    main()
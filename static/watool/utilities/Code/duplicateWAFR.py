@@ -14,6 +14,7 @@
 # https://aws.amazon.com/apache2.0/
 
 import botocore
+import botocore.config
 import boto3
 import json
 import datetime
@@ -21,6 +22,7 @@ import logging
 import jmespath
 import base64
 import argparse
+import concurrent.futures
 from pkg_resources import packaging
 
 
@@ -53,6 +55,7 @@ PARSER.add_argument('--toaccount', required=False, default="", help='AWS CLI Pro
 PARSER.add_argument('--workloadid', required=True, help='WorkloadID. Example: 1e5d148ab9744e98343cc9c677a34682')
 PARSER.add_argument('--fromregion', required=False, default="us-east-1", help='From Region Name. Example: us-east-1')
 PARSER.add_argument('--toregion', required=False, default="us-east-1", help='To Region Name. Example: us-east-2')
+PARSER.add_argument('--concurrency', required=False, type=int, default=8, help='Number of answers to copy at the same time')
 ARGUMENTS = PARSER.parse_args()
 
 REGION_NAME = ARGUMENTS.fromregion
@@ -60,6 +63,7 @@ TO_REGION_NAME = ARGUMENTS.toregion
 FROM_ACCOUNT = ARGUMENTS.fromaccount
 TO_ACCOUNT = ARGUMENTS.toaccount
 FROM_WORKLOADID = ARGUMENTS.workloadid
+CONCURRENCY = max(1, ARGUMENTS.concurrency)
 
 # Helper class to convert a datetime item to JSON.
 class DateTimeEncoder(json.JSONEncoder):
@@ -398,6 +402,38 @@ def getNotesForQuestion(
     # print(answers)
     return answers
 
+def copyAnswer(
+    waclient,
+    workloadId,
+    waclientTo,
+    toWorkloadId,
+    lensAlias,
+    questionId
+    ):
+    # Copy a single answer, using the one get_answer response for both the
+    # selected choices and the notes
+    try:
+        response=waclient.get_answer(
+        WorkloadId=workloadId,
+        LensAlias=lensAlias,
+        QuestionId=questionId
+        )
+        answer = response['Answer']
+        waclientTo.update_answer(
+        WorkloadId=toWorkloadId,
+        LensAlias=lensAlias,
+        QuestionId=questionId,
+        SelectedChoices=answer['SelectedChoices'],
+        Notes=answer['Notes'] if "Notes" in answer else ""
+        )
+    except botocore.exceptions.ParamValidationError as e:
+        logger.error("ERROR - Parameter validation error: %s" % e)
+        return False
+    except botocore.exceptions.ClientError as e:
+        logger.error("ERROR - Unexpected error copying %s %s: %s" % (lensAlias, questionId, e))
+        return False
+    return True
+
 def updateAnswersForQuestion(
     waclient,
     workloadId,
@@ -622,14 +658,22 @@ def main():
     else:
         SESSION2 = boto3.session.Session()
     # Initiate the well-architected session using the region defined above
+    # The clients are shared by the copy worker threads, so size the connection pool to match.
+    # Adaptive retries back off and slow every thread down together when we are throttled
+    clientConfig = botocore.config.Config(
+        max_pool_connections=max(10, CONCURRENCY),
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
+    )
     WACLIENT = SESSION1.client(
         service_name='wellarchitected',
         region_name=REGION_NAME,
+        config=clientConfig
     )
 
     WACLIENT_TO = SESSION2.client(
         service_name='wellarchitected',
         region_name=TO_REGION_NAME,
+        config=clientConfig
     )
 
 
@@ -669,17 +713,22 @@ def main():
     )
     logger.info("New workload id: %s (%s)" % (toWorkloadId,toWorkloadARN))
 
-    # Iterate over each lens and copy all of the answers
-    for lens in workloadJson['Lenses']:
-        logger.info("Retrieving all answers for lens %s" % lens)
-        answers = listAllAnswers(WACLIENT,workloadId,lens)
-        # Ensure the lens is attached to the new workload
-        associateLens(WACLIENT_TO,toWorkloadId,[lens])
-        logger.info("Copying answers into new workload for lens %s" % lens)
-        for answerCopy in answers:
-            notesField = ''
-            notesField = getNotesForQuestion(WACLIENT,workloadId,lens,answerCopy['QuestionId'])
-            updateAnswersForQuestion(WACLIENT_TO,toWorkloadId,lens,answerCopy['QuestionId'],answerCopy['SelectedChoices'],notesField)
+    # Iterate over each lens and queue up every answer to be copied. The answers
+    # for all lenses are copied through the same bounded pool of workers.
+    copyFutures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        for lens in workloadJson['Lenses']:
+            logger.info("Retrieving all answers for lens %s" % lens)
+            answers = listAllAnswers(WACLIENT,workloadId,lens)
+            # Ensure the lens is attached to the new workload
+            associateLens(WACLIENT_TO,toWorkloadId,[lens])
+            logger.info("Copying %d answers into new workload for lens %s" % (len(answers), lens))
+            for answerCopy in answers:
+                copyFutures.append(executor.submit(copyAnswer,WACLIENT,workloadId,WACLIENT_TO,toWorkloadId,lens,answerCopy['QuestionId']))
+
+    failedCount = len([copyFuture for copyFuture in copyFutures if not copyFuture.result()])
+    if failedCount:
+        logger.error("ERROR - %d of %d answers could not be copied" % (failedCount, len(copyFutures)))
 
     logger.info("Copy complete - exiting")
 
@@ -13,6 +13,7 @@
 # https://aws.amazon.com/apache2.0/
 
 import botocore
+import botocore.config
 import boto3
 import json
 import datetime
@@ -20,6 +21,11 @@ import logging
 import jmespath
 import xlsxwriter
 import argparse
+import os
+import re
+import threading
+import concurrent.futures
+import itertools
 from pkg_resources import packaging
 import urllib.request
 from bs4 import BeautifulSoup, NavigableString, Tag
@@ -56,6 +62,12 @@ This utility has two options to run:
 ------------------------------------
 1) If you provide a workloadid, this will gather all of the answers across all Well-Architected Lenss and export them to a spreadsheet.
 2) If you do not provide a workloadid, the utility will generate a TEMP workload and auto-answer every question. It will then generate a spreadsheet with all of the questions, best practices, and even the improvement plan links for each.
+
+Batch mode:
+-----------
+If you provide a list of workloadids, a workload name prefix, and/or tags, every matching workload will be exported
+concurrently. By default all workloads are written to a single spreadsheet (one tab per workload and lens), or you can
+use --splitworkbooks to write one spreadsheet per workload.
     '''
     )
 
@@ -63,6 +75,12 @@ PARSER.add_argument('-p','--profile', required=False, default="default", help='A
 PARSER.add_argument('-r','--region', required=False, default="us-east-1", help='From Region Name. Example: us-east-1')
 PARSER.add_argument('-w','--workloadid', required=False, default="", help='Workload Id to use instead of creating a TEMP workload')
 PARSER.add_argument('-k','--keeptempworkload', action='store_true', help='If you want to keep the TEMP workload created at the end of the export')
+PARSER.add_argument('-W','--workloadids', required=False, nargs='+', default=[], help='Batch mode: list of Workload Ids to export')
+PARSER.add_argument('-n','--workloadprefix', required=False, default="", help='Batch mode: export every workload whose name starts with this prefix')
+PARSER.add_argument('-t','--tag', required=False, action='append', default=[], help='Batch mode: only export workloads with this tag (KEY=VALUE). Can be used multiple times')
+PARSER.add_argument('-s','--splitworkbooks', action='store_true', help='Batch mode: write one XLSX file per workload instead of a single file')
+PARSER.add_argument('-m','--constantmemory', action='store_true', help='Write the spreadsheet row by row using a small fixed amount of memory (useful with many lenses or workloads). Improvement plan text is written to its own column instead of as cell comments')
+PARSER.add_argument('-c','--concurrency', required=False, type=int, default=8, help='Batch mode: number of workloads to gather concurrently')
 
 PARSER.add_argument('-f','--fileName', required=True, default="./demo.xlsx", help='FileName to export XLSX')
 PARSER.add_argument('-v','--debug', action='store_true', help='print debug messages to stderr')
@@ -74,6 +92,16 @@ FILENAME = ARGUMENTS.fileName
 REGION_NAME = ARGUMENTS.region
 WORKLOADID = ARGUMENTS.workloadid
 KEEPTEMP = ARGUMENTS.keeptempworkload
+WORKLOADIDS = ARGUMENTS.workloadids
+WORKLOADPREFIX = ARGUMENTS.workloadprefix
+SPLITWORKBOOKS = ARGUMENTS.splitworkbooks
+CONCURRENCY = max(1, ARGUMENTS.concurrency)
+CONSTANTMEMORY = ARGUMENTS.constantmemory
+TAGFILTER = {}
+for tagString in ARGUMENTS.tag:
+    tagKey, _, tagValue = tagString.partition('=')
+    TAGFILTER[tagKey] = tagValue
+BATCHMODE = bool(WORKLOADIDS or WORKLOADPREFIX or TAGFILTER)
 
 if ARGUMENTS.debug:
     logger.setLevel(logging.DEBUG)
@@ -98,6 +126,15 @@ PILLAR_PROPER_NAME_MAP = {
                     "costOptimization": "Cost Optimization"
 }
 
+# Caches shared by every workload exported in a single run. The lens list and
+# the improvement plan pages are the same for every workload, so we only fetch
+# them once and re-use them across the worker threads.
+LENS_SUMMARY_CACHE = []
+IMPROVEMENT_PLAN_PAGE_CACHE = {}
+CACHE_LOCK = threading.Lock()
+# Cell formats for each workbook we write to
+WORKBOOK_FORMATS = {}
+
 # Helper class to convert a datetime item to JSON.
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, z):
@@ -172,6 +209,30 @@ def FindWorkload(
     # print("WorkloadId",workloadId)
     return workloadId, workloadArn
 
+def listAllWorkloads(
+    waclient,
+    workloadNamePrefix=""
+    ):
+    # List every workload (optionally filtered by name prefix), following the NextToken
+    workloads = []
+    kwargs = {}
+    if workloadNamePrefix:
+        kwargs['WorkloadNamePrefix'] = workloadNamePrefix
+    while True:
+        try:
+            response=waclient.list_workloads(**kwargs)
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            break
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            break
+        workloads.extend(response['WorkloadSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return workloads
+
 def DeleteWorkload(
     waclient,
     workloadId
@@ -208,19 +269,39 @@ def GetWorkload(
     # print("WorkloadId",workloadId)
     return workload
 
+def listLensSummaries(
+    waclient
+    ):
+    # List all lenses currently available, only calling the API once per run
+    with CACHE_LOCK:
+        if LENS_SUMMARY_CACHE:
+            return LENS_SUMMARY_CACHE
+        try:
+            response=waclient.list_lenses()
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            return []
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            return []
+        LENS_SUMMARY_CACHE.extend(response['LensSummaries'])
+        while "NextToken" in response:
+            try:
+                response=waclient.list_lenses(NextToken=response["NextToken"])
+            except botocore.exceptions.ClientError as e:
+                logger.error("ERROR - Unexpected error: %s" % e)
+                break
+            LENS_SUMMARY_CACHE.extend(response['LensSummaries'])
+    return LENS_SUMMARY_CACHE
+
 def listLens(
     waclient
     ):
     # List all lenses currently available
-    try:
-        response=waclient.list_lenses()
-    except botocore.exceptions.ParamValidationError as e:
-        logger.error("ERROR - Parameter validation error: %s" % e)
-    except botocore.exceptions.ClientError as e:
-        logger.error("ERROR - Unexpected error: %s" % e)
+    lensSummaries = listLensSummaries(waclient)
 
     # print(json.dumps(response))
-    lenses = jmespath.search("LensSummaries[*].LensAlias", response)
+    lenses = jmespath.search("[*].LensAlias", lensSummaries)
 
     return lenses
 
@@ -230,16 +311,11 @@ def getCurrentLensVersion(
     ):
 
     # List all lenses currently available
-    try:
-        response=waclient.list_lenses()
-    except botocore.exceptions.ParamValidationError as e:
-        logger.error("ERROR - Parameter validation error: %s" % e)
-    except botocore.exceptions.ClientError as e:
-        logger.error("ERROR - Unexpected error: %s" % e)
+    lensSummaries = listLensSummaries(waclient)
 
     # print(json.dumps(response))
-    searchString = "LensSummaries[?LensAlias==`"+lensAlias+"`].LensVersion"
-    lenses = jmespath.search(searchString, response)
+    searchString = "[?LensAlias==`"+lensAlias+"`].LensVersion"
+    lenses = jmespath.search(searchString, lensSummaries)
 
     return lenses[0]
 
@@ -333,6 +409,34 @@ def updateAnswersForQuestion(
     answers = jmespath.search(jmesquery, response)
     return answers
 
+def getImprovementPlanPage(
+    ImprovementPlanUrl
+    ):
+    # The improvement plan pages are the same for every workload and every choice
+    # in a question only changes the #anchor, so we download each page once
+    pageUrl = ImprovementPlanUrl.split('#')[0]
+    # The first thread to ask for a page stores a Future for it and downloads it. Any
+    # other thread asking for the same page waits on that Future instead of downloading
+    # the page again.
+    with CACHE_LOCK:
+        pageFuture = IMPROVEMENT_PLAN_PAGE_CACHE.get(pageUrl)
+        downloadPage = pageFuture is None
+        if downloadPage:
+            pageFuture = concurrent.futures.Future()
+            IMPROVEMENT_PLAN_PAGE_CACHE[pageUrl] = pageFuture
+    if downloadPage:
+        try:
+            urlresponse = urllib.request.urlopen(pageUrl)
+            htmlBytes = urlresponse.read()
+            htmlStr = htmlBytes.decode("utf8")
+            pageFuture.set_result(htmlStr.split('\n'))
+        except Exception as e:
+            # Do not keep the failure, the next caller will try the download again
+            with CACHE_LOCK:
+                del IMPROVEMENT_PLAN_PAGE_CACHE[pageUrl]
+            pageFuture.set_exception(e)
+    return pageFuture.result()
+
 def getImprovementPlanItems(
     waclient,
     workloadId,
@@ -346,10 +450,7 @@ def getImprovementPlanItems(
     response = {}
     htmlString = ""
     # unanswered = getUnansweredForQuestion(waclient,workloadId,'wellarchitected',QuestionId)
-    urlresponse = urllib.request.urlopen(ImprovementPlanUrl)
-    htmlBytes = urlresponse.read()
-    htmlStr = htmlBytes.decode("utf8")
-    htmlSplit = htmlStr.split('\n')
+    htmlSplit = getImprovementPlanPage(ImprovementPlanUrl)
     ipHTMLList = {}
     for line in htmlSplit:
         for uq in ChoiceList:
@@ -377,10 +478,7 @@ def getImprovementPlanHTMLDescription(
     firstItem = "step"+stepNumber
     secondItem = ("step"+str((int(stepNumber)+1)))
     logger.debug ("Going from %s to %s" % (firstItem, secondItem))
-    urlresponse = urllib.request.urlopen(ImprovementPlanUrl)
-    htmlBytes = urlresponse.read()
-    htmlStr = htmlBytes.decode("utf8")
-    htmlSplit = htmlStr.split('\n')
+    htmlSplit = getImprovementPlanPage(ImprovementPlanUrl)
 
     foundit = 0
     ipString = ""
@@ -404,25 +502,21 @@ def getImprovementPlanHTMLDescription(
 
     return prettyHTML, questionIdText
 
-def lensTabCreation(
-    WACLIENT,
-    workloadId,
-    lens,
-    workbook,
-    allQuestionsForLens,
-    workloadName="",
-    AWSAccountId="",
-    workloadDescription=""
+def getWorkbookFormats(
+    workbook
     ):
+    # Formats are created once per workbook and shared by every lens tab
+    if workbook in WORKBOOK_FORMATS:
+        return WORKBOOK_FORMATS[workbook]
 
-    # Setup some formatting for the workbook
-    bold = workbook.add_format({'bold': True})
-    bold_border = workbook.add_format({
+    formats = {}
+    formats['bold'] = workbook.add_format({'bold': True})
+    formats['bold_border'] = workbook.add_format({
     'border': 1,
     'border_color': 'black',
     'text_wrap': True
     })
-    bold_border_bold = workbook.add_format({
+    formats['bold_border_bold'] = workbook.add_format({
     'border': 1,
     'border_color': 'black',
     'text_wrap': True,
@@ -430,12 +524,12 @@ def lensTabCreation(
     'bold': True
     })
 
-    heading = workbook.add_format({
+    formats['heading'] = workbook.add_format({
     'font_size': 24,
     'bold': True
     })
 
-    lineA = workbook.add_format({
+    formats['lineA'] = workbook.add_format({
     'border': 1,
     'border_color': 'black',
     'bg_color': '#E0EBF6',
@@ -443,7 +537,7 @@ def lensTabCreation(
     'text_wrap': True
     })
 
-    lineB = workbook.add_format({
+    formats['lineB'] = workbook.add_format({
     'border': 1,
     'border_color': 'black',
     'bg_color': '#E4EFDC',
@@ -451,7 +545,7 @@ def lensTabCreation(
     'text_wrap': True
     })
 
-    lineAnoborder = workbook.add_format({
+    formats['lineAnoborder'] = workbook.add_format({
     'border': 0,
     'top': 1,
     'left': 1,
@@ -462,7 +556,7 @@ def lensTabCreation(
     'text_wrap': True
     })
 
-    lineBnoborder = workbook.add_format({
+    formats['lineBnoborder'] = workbook.add_format({
     'border': 0,
     'top': 1,
     'left': 1,
@@ -474,7 +568,7 @@ def lensTabCreation(
     })
 
 
-    lineAhidden = workbook.add_format({
+    formats['lineAhidden'] = workbook.add_format({
     'border': 0,
     'left': 1,
     'right': 1,
@@ -485,7 +579,7 @@ def lensTabCreation(
     'indent': 100
     })
 
-    lineBhidden = workbook.add_format({
+    formats['lineBhidden'] = workbook.add_format({
     'border': 0,
     'left': 1,
     'right': 1,
@@ -499,16 +593,140 @@ def lensTabCreation(
     sub_heading = workbook.add_format()
     sub_heading.set_font_size(20)
     sub_heading.set_bold(True)
+    formats['sub_heading'] = sub_heading
 
     small_font = workbook.add_format()
     small_font.set_font_size(9)
+    formats['small_font'] = small_font
+
+    WORKBOOK_FORMATS[workbook] = formats
+    return formats
+
+def createWorkbook(
+    fileName
+    ):
+    # In constant memory mode xlsxwriter flushes each row to disk as soon as we
+    # move on to the next one, so every tab must be written in row order.
+    workbook = xlsxwriter.Workbook(fileName, {'constant_memory': CONSTANTMEMORY})
+    workbook.set_size(2800, 1600)
+    return workbook
+
+def buildLensRows(
+    WACLIENT,
+    workloadId,
+    lens,
+    allQuestionsForLens
+    ):
+    # Precompute every question block for a lens tab before anything is written,
+    # so the rows can be flushed to the worksheet sequentially.
+    questionBlocks = []
+    for pillar in PILLAR_PARSE_MAP:
+        # This is the question number for each pillar (ex: OPS1, OPS2, etc)
+        qNum = 1
+
+        # The query will return all questions for a lens and pillar
+        jmesquery = "[?PillarId=='"+pillar+"']"
+        allQuestionsForPillar = jmespath.search(jmesquery, allQuestionsForLens)
+
+        # For each of the possible answers, parse them and put into the Worksheet
+        for answers in allQuestionsForPillar:
+            # List all best practices
+            questionTitle = PILLAR_PARSE_MAP[answers['PillarId']]+str(qNum)+" - "+answers['QuestionTitle']
+            qDescription, qImprovementPlanUrl, qHelpfulResourceUrl, qNotes = getQuestionDetails(WACLIENT,workloadId,lens,answers['QuestionId'])
+            # Some of the questions have extra whitespaces and I need to remove those to fit into the cell
+            qDescription = qDescription.replace('\n         ','').replace('  ','').replace('\t', '').replace('\n', '')
+            qDescription = qDescription.rstrip()
+            qDescription = qDescription.strip()
+
+            logger.debug("Working on '"+questionTitle+"'")
+            logger.debug("It has answers of: "+json.dumps(answers['SelectedChoices']))
+
+            # If the question has been answered (which we do for the TEMP workload) we grab the URL and parse for the HTML content
+            if qImprovementPlanUrl:
+                jmesquery = "[?QuestionId=='"+answers['QuestionId']+"'].Choices[].ChoiceId"
+                choiceList = jmespath.search(jmesquery, allQuestionsForLens)
+                ipList = getImprovementPlanItems(WACLIENT,workloadId,lens,answers['QuestionId'],answers['PillarId'],qImprovementPlanUrl,choiceList)
+            else:
+                ipList = []
+
+            choiceRows = []
+            for choices in answers['Choices']:
+                Title = choices['Title'].replace('  ','').replace('\t', '').replace('\n', '')
+                ipUrl = ""
+                ipComment = ""
+                if any(choices['ChoiceId'] in d for d in ipList):
+                    ipUrl = ipList[choices['ChoiceId']]
+                    ipItemHTML, questionIdText = getImprovementPlanHTMLDescription(ipUrl,answers['PillarId'])
+                    htmlString = ipItemHTML.text
+                    ipComment = htmlString.replace('\n         ','').replace('  ','').replace('\t', '').strip().rstrip()
+
+                # Remove all of the extra spaces in the description field
+                Description = choices['Description'].replace('\n               ','')
+                Description = Description.replace('\n         ','')
+                Description = Description.replace('  ','').replace('\t', '').replace('\n', '')
+                Description = Description.rstrip()
+                Description = Description.strip()
+
+                # If this is an existing workload, we will show SELECTED if the have it checked
+                # I would love to use a XLSX checkbox, but this library doesn't support it
+                if choices['ChoiceId'] in answers['SelectedChoices']:
+                    responseText = "SELECTED"
+                else:
+                    responseText = ""
+                choiceRows.append({
+                    'Title': Title,
+                    'ImprovementPlanUrl': ipUrl,
+                    'ImprovementPlanText': ipComment,
+                    'Description': Description,
+                    'Response': responseText
+                    })
+
+            questionBlocks.append({
+                'Pillar': PILLAR_PROPER_NAME_MAP[pillar],
+                'QuestionTitle': questionTitle,
+                'Description': qDescription,
+                'Notes': qNotes,
+                'Choices': choiceRows
+                })
+            # Increase the question number
+            qNum += 1
+    return questionBlocks
+
+def lensTabCreation(
+    WACLIENT,
+    workloadId,
+    lens,
+    workbook,
+    allQuestionsForLens,
+    workloadName="",
+    AWSAccountId="",
+    workloadDescription="",
+    existingWorkload=bool(WORKLOADID),
+    sheetPrefix="",
+    questionBlocks=None
+    ):
+
+    # Setup some formatting for the workbook
+    formats = getWorkbookFormats(workbook)
+    bold_border = formats['bold_border']
+    bold_border_bold = formats['bold_border_bold']
+    heading = formats['heading']
+    sub_heading = formats['sub_heading']
+    small_font = formats['small_font']
+    lineA = formats['lineA']
+    lineB = formats['lineB']
+
+    # Gather all of the rows first, the worksheet is then written strictly top to bottom
+    # (batch mode has already built them in a worker thread)
+    if questionBlocks is None:
+        questionBlocks = buildLensRows(WACLIENT,workloadId,lens,allQuestionsForLens)
 
     # Get the current version of Lens
     logger.debug("Getting lens version for '"+lens+"'")
     versionString = getCurrentLensVersion(WACLIENT,lens)
     logger.debug("Adding worksheet using version "+versionString)
     lensName = lens[0:18]
-    worksheet = workbook.add_worksheet((lensName+' v'+versionString))
+    worksheet = workbook.add_worksheet(uniqueWorksheetName(workbook,sheetPrefix+lensName+' v'+versionString))
     # Print in landscape
     worksheet.set_landscape()
     # Set to 8.5x11 paper size
@@ -522,26 +740,27 @@ def lensTabCreation(
     worksheet.set_column('E:E', 57)
     worksheet.set_column('F:F', 18)
     worksheet.set_column('G:G', 70)
+    # Cell comments are kept in memory until the workbook is closed, even in constant
+    # memory mode, so the improvement plan text goes into its own column instead
+    if CONSTANTMEMORY:
+        worksheet.set_column('H:H', 70)
 
     # Top of sheet
-    worksheet.merge_range('A1:G1', 'Workload Overview', heading)
-    worksheet.merge_range('A3:B3', 'Workload Name', bold_border_bold)
-    worksheet.merge_range('A4:B4', 'AWS Account ID', bold_border_bold)
-    worksheet.merge_range('A5:B5', 'Workload Description', bold_border_bold)
-
     # If we are using an existing workload, then display the Name, ID, and Description at the top
     #  or else just make it blank
-    if WORKLOADID:
-        worksheet.write('C3', workloadName, bold_border)
-        accountIdParsed = AWSAccountId.split(':')[4]
-        worksheet.write('C4', accountIdParsed, bold_border)
-        worksheet.write('C5', workloadDescription, bold_border)
+    if existingWorkload:
+        headerValues = [workloadName, AWSAccountId.split(':')[4], workloadDescription]
     else:
-        worksheet.write('C3', '', bold_border)
-        worksheet.write('C4', '', bold_border)
-        worksheet.write('C5', '', bold_border)
+        headerValues = ['', '', '']
+    worksheet.merge_range('A1:G1', 'Workload Overview', heading)
+    worksheet.merge_range('A3:B3', 'Workload Name', bold_border_bold)
+    worksheet.write('C3', headerValues[0], bold_border)
     worksheet.write('D3', 'Enter the name of system', small_font)
+    worksheet.merge_range('A4:B4', 'AWS Account ID', bold_border_bold)
+    worksheet.write('C4', headerValues[1], bold_border)
     worksheet.write('D4', 'Enter 12-degit AWS account ID', small_font)
+    worksheet.merge_range('A5:B5', 'Workload Description', bold_border_bold)
+    worksheet.write('C5', headerValues[2], bold_border)
     worksheet.write('D5', 'Briefly describe system architecture and workload, flow etc.', small_font)
 
     # Subheadings for columns
@@ -552,6 +771,8 @@ def lensTabCreation(
     worksheet.write('E8', 'Detail', sub_heading)
     worksheet.write('F8', 'Response', sub_heading)
     worksheet.write('G8', 'Notes (optional)', sub_heading)
+    if CONSTANTMEMORY:
+        worksheet.write('H8', 'Improvement Plan', sub_heading)
 
     # Freeze the top of the sheet
     worksheet.freeze_panes(8,0)
@@ -567,124 +788,196 @@ def lensTabCreation(
     cellPosition = 8
 
     # Starting cell look with lineA. Will switch back and forth
-    myCell = lineA
-    myCellhidden = lineAhidden
-    myCellnoborder = lineAnoborder
-
-    for pillar in PILLAR_PARSE_MAP:
-        # This is the question number for each pillar (ex: OPS1, OPS2, etc)
-        qNum = 1
-
-        # The query will return all questions for a lens and pillar
-        jmesquery = "[?PillarId=='"+pillar+"']"
-        allQuestionsForPillar = jmespath.search(jmesquery, allQuestionsForLens)
-
-        # For each of the possible answers, parse them and put into the Worksheet
-        for answers in allQuestionsForPillar:
-            # List all best practices
-            questionTitle = PILLAR_PARSE_MAP[answers['PillarId']]+str(qNum)+" - "+answers['QuestionTitle']
-            qDescription, qImprovementPlanUrl, qHelpfulResourceUrl, qNotes = getQuestionDetails(WACLIENT,workloadId,lens,answers['QuestionId'])
-            # Some of the questions have extra whitespaces and I need to remove those to fit into the cell
-            qDescription = qDescription.replace('\n         ','').replace('  ','').replace('\t', '').replace('\n', '')
-            qDescription = qDescription.rstrip()
-            qDescription = qDescription.strip()
-
-            logger.debug("Working on '"+questionTitle+"'")
-            logger.debug("It has answers of: "+json.dumps(answers['SelectedChoices']))
+    lineSuffix = 'A'
 
-            cellID = cellPosition + 1
+    for question in questionBlocks:
+        myCell = formats['line'+lineSuffix]
+        myCellhidden = formats['line'+lineSuffix+'hidden']
+        myCellnoborder = formats['line'+lineSuffix+'noborder']
 
-            # If the question has been answered (which we do for the TEMP workload) we grab the URL and parse for the HTML content
-            if qImprovementPlanUrl:
-                jmesquery = "[?QuestionId=='"+answers['QuestionId']+"'].Choices[].ChoiceId"
-                choiceList = jmespath.search(jmesquery, allQuestionsForLens)
-                ipList = getImprovementPlanItems(WACLIENT,workloadId,lens,answers['QuestionId'],answers['PillarId'],qImprovementPlanUrl,choiceList)
+        if existingWorkload:
+            notesText = question['Notes']
+        else:
+            notesText = ""
+
+        cellID = cellPosition + 1
+        startingCellID=cellID
+        # If its the first time through this particular pillar question:
+        #   I want to only write the name once, but I need to fill in
+        #   each cell with the same data so the autosort works properly
+        #   (else it will only show the first best practice)
+        firstTimePillar=True
+
+        for choices in question['Choices']:
+            row = str(cellID)
+            # Write the pillar name and question in every cell for autosort, but only show the first one
+            if firstTimePillar:
+                worksheet.write('A'+row, question['Pillar'], myCellnoborder)
+                worksheet.write('B'+row, question['QuestionTitle'], myCellnoborder)
+                # The explanation and notes only live in the first row, the rest are merged below
+                worksheet.write('C'+row, question['Description'], myCell)
+                worksheet.write('G'+row, notesText, myCell)
+                firstTimePillar=False
             else:
-                ipList = []
-
-            startingCellID=cellID
-            # If its the first time through this particular pillar question:
-            #   I want to only write the name once, but I need to fill in
-            #   each cell with the same data so the autosort works properly
-            #   (else it will only show the first best practice)
-            firstTimePillar=True
-
-            for choices in answers['Choices']:
-
-                # Write the pillar name and question in every cell for autosort, but only show the first one
-                cell = 'A'+str(cellID)
-                if firstTimePillar:
-                    worksheet.write(cell, PILLAR_PROPER_NAME_MAP[pillar], myCellnoborder)
-                    cell = 'B'+str(cellID)
-                    worksheet.write(cell, questionTitle, myCellnoborder)
-                    firstTimePillar=False
-                else:
-                    worksheet.write(cell, PILLAR_PROPER_NAME_MAP[pillar], myCellhidden)
-                    cell = 'B'+str(cellID)
-                    worksheet.write(cell, questionTitle, myCellhidden)
-
-                # Start writing each of the BP's, details, etc
-                cell = 'D'+str(cellID)
-                Title = choices['Title'].replace('  ','').replace('\t', '').replace('\n', '')
-                if any(choices['ChoiceId'] in d for d in ipList):
-                    worksheet.write_url(cell, ipList[choices['ChoiceId']], myCell, string=Title)
-                    ipItemHTML, questionIdText = getImprovementPlanHTMLDescription(ipList[choices['ChoiceId']],answers['PillarId'])
-                    htmlString = ipItemHTML.text
-                    htmlString = htmlString.replace('\n         ','').replace('  ','').replace('\t', '').strip().rstrip()
-                    # print(htmlString)
-                    worksheet.write_comment(cell, htmlString, {'author': 'Improvement Plan'})
-                else:
-                    worksheet.write(cell,Title,myCell)
+                worksheet.write('A'+row, question['Pillar'], myCellhidden)
+                worksheet.write('B'+row, question['QuestionTitle'], myCellhidden)
+                worksheet.write_blank('C'+row, None, myCell)
+                worksheet.write_blank('G'+row, None, myCell)
+
+            # Start writing each of the BP's, details, etc
+            cell = 'D'+row
+            if choices['ImprovementPlanUrl']:
+                worksheet.write_url(cell, choices['ImprovementPlanUrl'], myCell, string=choices['Title'])
+                if not CONSTANTMEMORY:
+                    worksheet.write_comment(cell, choices['ImprovementPlanText'], {'author': 'Improvement Plan'})
+            else:
+                worksheet.write(cell,choices['Title'],myCell)
+
+            # Add all Details for each best practice/choice
+            worksheet.write('E'+row, choices['Description'] ,myCell)
+            worksheet.write('F'+row, choices['Response'] ,myCell)
+            if CONSTANTMEMORY:
+                worksheet.write('H'+row, choices['ImprovementPlanText'] ,myCell)
+            cellID+=1
+
+        # We are out of the choice/detail/response loop, so know how many rows were consumed
+        # and we can merge the explanation and notes field to span all of them.
+        # Every cell in the range has already been written, so in constant memory mode
+        # this only records the merge for the rows that were flushed.
+        if cellID-1 > startingCellID:
+            worksheet.merge_range('C'+str(startingCellID)+':C'+str(cellID-1), question['Description'], myCell)
+            worksheet.merge_range('G'+str(startingCellID)+':G'+str(cellID-1), notesText, myCell)
+
+        # Reset the starting cellPosition to the last cellID
+        cellPosition = cellID-1
+
+        # Reset the cell formatting to alternate between the two colors
+        if lineSuffix == 'A':
+            lineSuffix = 'B'
+        else:
+            lineSuffix = 'A'
 
-                # Add all Details for each best practice/choice
-                cell = 'E'+str(cellID)
-                # Remove all of the extra spaces in the description field
-                Description = choices['Description'].replace('\n               ','')
-                Description = Description.replace('\n         ','')
-                Description = Description.replace('  ','').replace('\t', '').replace('\n', '')
-                Description = Description.rstrip()
-                Description = Description.strip()
-                worksheet.write(cell, Description ,myCell)
+def uniqueWorksheetName(
+    workbook,
+    sheetName
+    ):
+    # Excel limits tab names to 31 characters, does not allow some characters,
+    # and every name must be unique within the workbook
+    sheetName = re.sub(r'[\[\]:*?/\\]', '', sheetName)[0:31]
+    existingNames = [ws.get_name().lower() for ws in workbook.worksheets()]
+    uniqueName = sheetName
+    counter = 2
+    while uniqueName.lower() in existingNames:
+        suffix = "~"+str(counter)
+        uniqueName = sheetName[0:31-len(suffix)]+suffix
+        counter += 1
+    return uniqueName
+
+def workloadMatchesTags(
+    workload
+    ):
+    # All tags given on the command line must be present with the same value
+    workloadTags = workload.get('Tags', {})
+    for tagKey, tagValue in TAGFILTER.items():
+        if workloadTags.get(tagKey) != tagValue:
+            return False
+    return True
+
+def gatherWorkloadAnswers(
+    waclient,
+    workloadId
+    ):
+    # Gather everything we need to build the tabs for a single workload. This runs
+    # in a worker thread, so we do not touch the workbook here.
+    # (GetWorkload exits on error, which we do not want for a single bad workload)
+    try:
+        workloadJson = waclient.get_workload(WorkloadId=workloadId)['Workload']
+    except botocore.exceptions.ClientError as e:
+        logger.error("ERROR - Unable to get workload %s: %s" % (workloadId, e))
+        return None
+    if TAGFILTER and not workloadMatchesTags(workloadJson):
+        logger.debug("Skipping workload %s since it does not match the tag filter" % workloadId)
+        return None
+    lenses = sorted(workloadJson['Lenses'], reverse=True)
+    lensAnswers = {}
+    for lens in lenses:
+        # Make sure the lens version is in the shared cache before we write the tab
+        getCurrentLensVersion(waclient,lens)
+        allQuestions = findAllQuestionId(waclient,workloadId,lens)
+        # Build the rows here as well, so the improvement plan parsing runs in the
+        # worker and only the finished rows are handed to the writer
+        lensAnswers[lens] = buildLensRows(waclient,workloadId,lens,allQuestions)
+    logger.info("Gathered %d lenses for workload '%s' (%s)" % (len(lenses), workloadJson['WorkloadName'], workloadId))
+    return {'Workload': workloadJson, 'Lenses': lenses, 'Answers': lensAnswers}
+
+def writeWorkloadTabs(
+    waclient,
+    workbook,
+    workloadData,
+    sheetPrefix=""
+    ):
+    # Write one tab per lens for a workload we have already gathered
+    workloadJson = workloadData['Workload']
+    for lens in workloadData['Lenses']:
+        questionBlocks = workloadData['Answers'][lens]
+        lensTabCreation(waclient,workloadJson['WorkloadId'],lens,workbook,None,workloadJson['WorkloadName'],workloadJson['WorkloadArn'],workloadJson['Description'],True,sheetPrefix,questionBlocks)
 
-                # If this is an existing workload, we will show SELECTED if the have it checked
-                # I would love to use a XLSX checkbox, but this library doesn't support it
-                cell = 'F'+str(cellID)
-                responseText = ""
-                if choices['ChoiceId'] in answers['SelectedChoices']:
-                    responseText = "SELECTED"
+def batchExport(
+    waclient
+    ):
+    # Build the list of workloads to export from the ids, name prefix, and tags given
+    workloadIdList = list(WORKLOADIDS)
+    if WORKLOADPREFIX or (TAGFILTER and not WORKLOADIDS):
+        for workload in listAllWorkloads(waclient,WORKLOADPREFIX):
+            if workload['WorkloadId'] not in workloadIdList:
+                workloadIdList.append(workload['WorkloadId'])
+    logger.info("Batch exporting up to %d workloads using %d workers" % (len(workloadIdList), CONCURRENCY))
+
+    if not SPLITWORKBOOKS:
+        logger.info("Creating xlsx file '"+FILENAME+"'")
+        workbook = createWorkbook(FILENAME)
+
+    # Gather the answers concurrently, but write the workbooks from this thread only
+    # since xlsxwriter is not thread safe. Only CONCURRENCY workloads are in flight
+    # at a time and each one is written (and released) as soon as it completes, so
+    # memory does not grow with the number of workloads. Tabs are added in the
+    # order the workloads finish.
+    exported = 0
+    pendingIds = iter(workloadIdList)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        inFlight = set()
+        for workloadId in itertools.islice(pendingIds, CONCURRENCY):
+            inFlight.add(executor.submit(gatherWorkloadAnswers,waclient,workloadId))
+        while inFlight:
+            done, inFlight = concurrent.futures.wait(inFlight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                # Keep the pool busy while we write this workload
+                for workloadId in itertools.islice(pendingIds, 1):
+                    inFlight.add(executor.submit(gatherWorkloadAnswers,waclient,workloadId))
+                try:
+                    workloadData = future.result()
+                except Exception as e:
+                    logger.error("ERROR - Unable to gather workload: %s" % e)
+                    continue
+                if workloadData is None:
+                    continue
+                workloadJson = workloadData['Workload']
+                if SPLITWORKBOOKS:
+                    fileRoot, fileExt = os.path.splitext(FILENAME)
+                    workloadFileName = fileRoot+"_"+re.sub(r'[^A-Za-z0-9_.-]', '_', workloadJson['WorkloadName'])+"_"+workloadJson['WorkloadId']+(fileExt or ".xlsx")
+                    logger.info("Creating xlsx file '"+workloadFileName+"'")
+                    workloadWorkbook = createWorkbook(workloadFileName)
+                    writeWorkloadTabs(waclient,workloadWorkbook,workloadData)
+                    workloadWorkbook.close()
+                    WORKBOOK_FORMATS.pop(workloadWorkbook, None)
                 else:
-                    responseText = ""
-                worksheet.write(cell, responseText ,myCell)
-                cellID+=1
-
-            # We are out of the choice/detail/response loop, so know how many rows were consumed
-            # and we can create the explanation and notes field to span all of them
-            # Explanantion field
-            cellMerge = 'C'+str(startingCellID)+':C'+str(cellID-1)
-            worksheet.merge_range(cellMerge, qDescription,myCell)
-
-            # Notes field
-            cellMerge = 'G'+str(startingCellID)+':G'+str(cellID-1)
-            if WORKLOADID:
-                worksheet.merge_range(cellMerge, qNotes, myCell)
-            else:
-                worksheet.merge_range(cellMerge, "", myCell)
+                    writeWorkloadTabs(waclient,workbook,workloadData,workloadJson['WorkloadName'][0:10]+' ')
+                exported += 1
 
-            cellID-=1
-            # Increase the question number
-            qNum += 1
-            # Reset the starting cellPosition to the last cellID
-            cellPosition = cellID
-
-            # Reset the cell formatting to alternate between the two colors
-            if myCell == lineA:
-                myCell = lineB
-                myCellhidden = lineBhidden
-                myCellnoborder = lineBnoborder
-            else:
-                myCell = lineA
-                myCellhidden = lineAhidden
-                myCellnoborder = lineAnoborder
+    if not SPLITWORKBOOKS:
+        logger.info("Closing Workbook File")
+        workbook.close()
+    logger.info("Exported %d workloads" % exported)
 
 def main():
     boto3_min_version = "1.16.38"
@@ -701,8 +994,19 @@ def main():
     WACLIENT = SESSION1.client(
         service_name='wellarchitected',
         region_name=REGION_NAME,
+        config=botocore.config.Config(
+            max_pool_connections=max(10, CONCURRENCY),
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
     )
 
+    if BATCHMODE:
+        if WORKLOADID:
+            WORKLOADIDS.insert(0, WORKLOADID)
+        batchExport(WACLIENT)
+        logger.info("Done")
+        return
+
     # If this is an existing workload, we need to query for the various workload properties
     if WORKLOADID:
         logger.info("User specified workload id of %s" % WORKLOADID)
@@ -736,8 +1040,7 @@ def main():
 
     # Create an new xlsx file and add a worksheet.
     logger.info("Creating xlsx file '"+FILENAME+"'")
-    workbook = xlsxwriter.Workbook(FILENAME)
-    workbook.set_size(2800, 1600)
+    workbook = createWorkbook(FILENAME)
 
     # Simple hack to get Wellarchitected base framework first (reverse sort)
     # This will no longer work if we ever have a lens that starts with WB*, X, Y, or Z :)
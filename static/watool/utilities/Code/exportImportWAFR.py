@@ -16,11 +16,17 @@ A copy of the License is located at https://aws.amazon.com/apache2.0/
 
 import json
 import datetime
+import gzip
+import itertools
 import logging
+import os
 import sys
+import threading
+import concurrent.futures
 
 import argparse
 import botocore
+import botocore.config
 import boto3
 import jmespath
 from pkg_resources import packaging
@@ -56,6 +62,19 @@ This utility has two options to run:
 ------------------------------------
 1) Export - Export the contents of a workload from the Well-Architected tool
 2) Import - Create a new workload from the JSON export file generated in export
+3) Export Portfolio - Back up every workload in the account and region (or those matching --tag)
+   into the directory given by --fileName, with a manifest.json. Re-running resumes and only
+   exports workloads that have changed since the last run. Workloads deleted from the account
+   are removed from the directory.
+4) Import Portfolio - Restore every workload in a portfolio directory. Workloads that already
+   exist (by name) are re-used and their answers are overwritten, so it is safe to re-run.
+
+Export formats:
+---------------
+json   - A single JSON document (default)
+jsonl  - Compact newline-delimited records (one per lens review and answer) that are written
+         as they are fetched and applied as they are read on import. If the file name ends
+         in .gz it will be gzip compressed. Import detects the format automatically.
     '''
     )
 
@@ -63,11 +82,16 @@ This utility has two options to run:
 GROUP = PARSER.add_mutually_exclusive_group(required=True)
 GROUP.add_argument('--exportWorkload', action='store_true', help='export the workload to a file')
 GROUP.add_argument('--importWorkload', action='store_true', help='import the workload from a file')
+GROUP.add_argument('--exportPortfolio', action='store_true', help='export every workload to a portfolio directory')
+GROUP.add_argument('--importPortfolio', action='store_true', help='import every workload from a portfolio directory')
 
 PARSER.add_argument('-p','--profile', required=False, default="default", help='AWS CLI Profile Name')
 PARSER.add_argument('-r','--region', required=False, default="us-east-1", help='From Region Name. Example: us-east-1')
 PARSER.add_argument('-w','--workloadid', required=False, default="", help='Workload Id to use instead of creating a TEMP workload')
 PARSER.add_argument('-f','--fileName', required=True, default="./demo.xlsx", help='FileName to export JSON file to')
+PARSER.add_argument('-t','--tag', required=False, action='append', default=[], help='Portfolio export: only export workloads with this tag (KEY=VALUE). Can be used multiple times')
+PARSER.add_argument('-c','--concurrency', required=False, type=int, default=8, help='Portfolio mode: number of workloads to process at the same time')
+PARSER.add_argument('--format', required=False, default="json", choices=["json", "jsonl"], help='Export file format (import detects it automatically)')
 PARSER.add_argument('-v','--debug', action='store_true', help='print debug messages to stderr')
 
 ARGUMENTS = PARSER.parse_args()
@@ -75,14 +99,36 @@ PROFILE = ARGUMENTS.profile
 FILENAME = ARGUMENTS.fileName
 REGION_NAME = ARGUMENTS.region
 WORKLOADID = ARGUMENTS.workloadid
+EXPORT_FORMAT = ARGUMENTS.format
+CONCURRENCY = max(1, ARGUMENTS.concurrency)
+TAGFILTER = {}
+for tagString in ARGUMENTS.tag:
+    tagKey, _, tagValue = tagString.partition('=')
+    TAGFILTER[tagKey] = tagValue
+
+# Version of the newline-delimited export format. The legacy single JSON document is version 1.
+STREAM_FORMAT_NAME = "wafr-export"
+STREAM_FORMAT_VERSION = 2
+
+# Portfolio archives are a directory with one export file per workload plus these files
+PORTFOLIO_FORMAT_NAME = "wafr-portfolio"
+PORTFOLIO_FORMAT_VERSION = 1
+PORTFOLIO_MANIFEST = "manifest.json"
+PORTFOLIO_RESTORE_STATE = "restore-state.json"
 
 exportWorkload=False
 importWorkload=False
+exportPortfolio=False
+importPortfolio=False
 
 if ARGUMENTS.exportWorkload:
     exportWorkload=True
 elif ARGUMENTS.importWorkload:
     importWorkload=True
+elif ARGUMENTS.exportPortfolio:
+    exportPortfolio=True
+elif ARGUMENTS.importPortfolio:
+    importPortfolio=True
 else:
     logger.error("--exportWorkload or --importWorkload is required")
     sys.exit()
@@ -364,22 +410,26 @@ def updateAnswersForQuestion(
     answers = jmespath.search(jmesquery, response)
     return answers
 
-def listAllAnswers(
+def iterAllAnswers(
     waclient,
     workloadId,
     lensAlias
     ):
-    """ Get a list of all answers"""
-    answers = []
-
+    """ Yield the full answer for every question, one at a time """
     allQuestionsForLens = findAllQuestionId(waclient,workloadId,lensAlias)
     for pillar in PILLAR_PARSE_MAP:
         jmesquery = "[?PillarId=='"+pillar+"']"
         allQuestionsForPillar = jmespath.search(jmesquery, allQuestionsForLens)
         for answersLoop in allQuestionsForPillar:
-            fullAnswerForQuestion = getAnswerForQuestion(waclient, workloadId, lensAlias, answersLoop['QuestionId'])
-            answers.append(fullAnswerForQuestion)
-    return answers
+            yield getAnswerForQuestion(waclient, workloadId, lensAlias, answersLoop['QuestionId'])
+
+def listAllAnswers(
+    waclient,
+    workloadId,
+    lensAlias
+    ):
+    """ Get a list of all answers"""
+    return list(iterAllAnswers(waclient, workloadId, lensAlias))
 
 
 def getWorkloadLensReview(
@@ -400,6 +450,340 @@ def getWorkloadLensReview(
 
     return response['LensReview']
 
+def openExportFile(
+    fileName,
+    mode
+    ):
+    """ Open an export file, using gzip if the name ends in .gz or the file is gzip compressed """
+    if mode == 'r':
+        with open(fileName, 'rb') as rawFile:
+            isGzip = rawFile.read(2) == b'\x1f\x8b'
+    else:
+        isGzip = fileName.endswith('.gz')
+    if isGzip:
+        return gzip.open(fileName, mode+'t', encoding='utf-8')
+    return open(fileName, mode, encoding='utf-8')
+
+def writeRecord(
+    outfile,
+    recordType,
+    data,
+    lens=None
+    ):
+    """ Write a single compact record to a newline-delimited export file """
+    record = {"record": recordType, "data": data}
+    if lens is not None:
+        record["lens"] = lens
+    outfile.write(json.dumps(record, separators=(',', ':'), cls=DateTimeEncoder))
+    outfile.write("\n")
+
+def readRecords(
+    infile
+    ):
+    """ Yield each record from a newline-delimited export file """
+    for line in infile:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def createWorkloadFromExport(
+    waclient,
+    workloadJson
+    ):
+    """ Create a new workload using the workload properties from an export """
+    # For each of the optional variables, lets check and see if we have them first:
+    Notes = workloadJson['Notes'] if "Notes" in workloadJson else ""
+    nonAwsRegions = workloadJson['NonAwsRegions'] if "NonAwsRegions" in workloadJson else []
+    architecturalDesign = workloadJson['ArchitecturalDesign'] if "ArchitecturalDesign" in workloadJson else ""
+    industryType = workloadJson['IndustryType'] if "IndustryType" in workloadJson else ""
+    industry = workloadJson['Industry'] if "Industry" in workloadJson else ""
+    accountIds = workloadJson['AccountIds'] if "AccountIds" in workloadJson else []
+    tags = workloadJson['Tags'] if "Tags" in workloadJson else []
+    # Create the new workload to copy into
+    toWorkloadId,toWorkloadARN = CreateNewWorkload(waclient,
+                                                (workloadJson['WorkloadName']),
+                                                workloadJson['Description'],
+                                                workloadJson['ReviewOwner'],
+                                                workloadJson['Environment'],
+                                                workloadJson['AwsRegions'],
+                                                workloadJson['Lenses'],
+                                                tags,
+                                                workloadJson['PillarPriorities'],
+                                                Notes,
+                                                nonAwsRegions,
+                                                architecturalDesign,
+                                                industryType,
+                                                industry,
+                                                accountIds
+                                                )
+    logger.info("New workload id: %s (%s)" % (toWorkloadId,toWorkloadARN))
+    return toWorkloadId
+
+def verifyLensVersion(
+    waclient,
+    toWorkloadId,
+    lens,
+    importLensVersion
+    ):
+    """ Make sure the lens version in the new workload matches the exported one """
+    logger.info("Verifying lens version before restoring answers")
+    lensReview = getWorkloadLensReview(waclient,toWorkloadId,lens)
+    # ************************************************************************
+    #  There is no ability to restore to a specific lens version
+    #  in the API at this time, so we just have to error out if
+    #  the version has changed.
+    # ************************************************************************
+    if lensReview['LensVersion'] != importLensVersion:
+        logger.error("Version of the lens %s does not match the new workload" % lens)
+        logger.error("Import Version: %s" % importLensVersion)
+        logger.error("New Workload Version: %s" % lensReview['LensVersion'])
+        logger.error("You may need to delete the workload %s" % toWorkloadId)
+        return False
+    logger.info("Versions match (%s)" % importLensVersion)
+    return True
+
+def exportWorkloadStream(
+    waclient,
+    workloadId,
+    fileName,
+    workloadJson=None
+    ):
+    """ Export a workload as newline-delimited records, writing each answer as it is fetched """
+    answerCount = 0
+    with openExportFile(fileName, 'w') as outfile:
+        writeRecord(outfile, "header", {"format": STREAM_FORMAT_NAME, "version": STREAM_FORMAT_VERSION, "script_version": __version__})
+        if workloadJson is None:
+            workloadJson = GetWorkload(waclient,workloadId)
+        writeRecord(outfile, "workload", workloadJson)
+
+        for lens in workloadJson['Lenses']:
+            logger.info("Gathering overall review for lens %s" % lens)
+            lensReview = getWorkloadLensReview(waclient,workloadId,lens)
+            writeRecord(outfile, "lens_review", lensReview, lens)
+            logger.info("Retrieving all answers for lens %s" % lens)
+            for answer in iterAllAnswers(waclient,workloadId,lens):
+                writeRecord(outfile, "answer", answer, lens)
+                answerCount += 1
+        writeRecord(outfile, "end", {"answers": answerCount})
+    return answerCount
+
+def importWorkloadStream(
+    waclient,
+    records,
+    existingWorkloads=None
+    ):
+    """
+    Create a new workload from newline-delimited records, applying each answer as it is read.
+    If existingWorkloads (a dict of WorkloadName to WorkloadId) is given, a workload with the
+    same name is re-used and every answer is written again. list_answers does not return
+    the notes, so checking whether an answer already matches would cost a get_answer call,
+    which is as expensive as the update itself.
+    """
+    toWorkloadId = ""
+    answerCount = 0
+    for record in records:
+        if record['record'] == "header":
+            if record['data']['version'] > STREAM_FORMAT_VERSION:
+                logger.error("Export format version %s is newer than this script supports (%s)" % (record['data']['version'], STREAM_FORMAT_VERSION))
+                sys.exit()
+        elif record['record'] == "workload":
+            workloadName = record['data']['WorkloadName']
+            if existingWorkloads is not None and workloadName in existingWorkloads:
+                toWorkloadId = existingWorkloads[workloadName]
+                logger.info("Re-using existing workload %s for '%s'" % (toWorkloadId, workloadName))
+            else:
+                toWorkloadId = createWorkloadFromExport(waclient, record['data'])
+        elif record['record'] == "lens_review":
+            lens = record['lens']
+            associateLens(waclient,toWorkloadId,[lens])
+            if not verifyLensVersion(waclient, toWorkloadId, lens, record['data']['LensVersion']):
+                raise ValueError("Lens %s version mismatch for workload %s" % (lens, toWorkloadId))
+            logger.info("Copying answers into new workload for lens %s" % lens)
+        elif record['record'] == "answer":
+            answerCopy = record['data']
+            notesField = answerCopy['Notes'] if "Notes" in answerCopy else ""
+            answerCount += 1
+            updateAnswersForQuestion(waclient,toWorkloadId,record['lens'],answerCopy['QuestionId'],answerCopy['SelectedChoices'],notesField)
+        elif record['record'] == "end":
+            if record['data']['answers'] != answerCount:
+                logger.error("Expected %s answers but imported %s" % (record['data']['answers'], answerCount))
+    return toWorkloadId, answerCount
+
+def listAllWorkloads(
+    waclient
+    ):
+    """ List every workload summary in the account and region, errors are re-raised so a partial list is never used """
+    workloads = []
+    kwargs = {}
+    while True:
+        try:
+            response=waclient.list_workloads(**kwargs)
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            raise
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            raise
+        workloads.extend(response['WorkloadSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return workloads
+
+def loadPortfolioFile(
+    fileName,
+    default
+    ):
+    """ Load a manifest or restore state file, or return the default if it does not exist yet """
+    if not os.path.exists(fileName):
+        return default
+    with open(fileName) as json_file:
+        return json.load(json_file)
+
+def savePortfolioFile(
+    fileName,
+    content
+    ):
+    """ Atomically write a manifest or restore state file so an interrupted run can resume """
+    tmpFileName = fileName + ".tmp"
+    with open(tmpFileName, 'w') as outfile:
+        json.dump(content, outfile, indent=4, cls=DateTimeEncoder)
+    os.replace(tmpFileName, fileName)
+
+def backupWorkload(
+    waclient,
+    workloadSummary,
+    archiveDir
+    ):
+    """ Export a single workload into the portfolio directory, returns the manifest entry """
+    workloadId = workloadSummary['WorkloadId']
+    workloadJson = GetWorkload(waclient,workloadId)
+    workloadTags = workloadJson['Tags'] if "Tags" in workloadJson else {}
+    for tagKey, tagValue in TAGFILTER.items():
+        if workloadTags.get(tagKey) != tagValue:
+            logger.debug("Skipping workload %s since it does not match the tag filter" % workloadId)
+            return None
+    exportFileName = workloadId + ".jsonl.gz"
+    # Write to a temporary file first so a partial export is never mistaken for a complete one
+    tmpFileName = os.path.join(archiveDir, workloadId + ".tmp.jsonl.gz")
+    answerCount = exportWorkloadStream(waclient,workloadId,tmpFileName,workloadJson)
+    os.replace(tmpFileName, os.path.join(archiveDir, exportFileName))
+    logger.info("Exported workload '%s' (%s) with %d answers" % (workloadJson['WorkloadName'], workloadId, answerCount))
+    return {
+        "WorkloadName": workloadJson['WorkloadName'],
+        "UpdatedAt": str(workloadSummary['UpdatedAt']),
+        "File": exportFileName,
+        "Answers": answerCount
+    }
+
+def exportPortfolioArchive(
+    waclient,
+    archiveDir
+    ):
+    """ Export every workload into archiveDir concurrently, skipping ones unchanged since the last run and removing deleted ones """
+    os.makedirs(archiveDir, exist_ok=True)
+    manifestFileName = os.path.join(archiveDir, PORTFOLIO_MANIFEST)
+    manifest = loadPortfolioFile(manifestFileName, {"format": PORTFOLIO_FORMAT_NAME, "version": PORTFOLIO_FORMAT_VERSION, "workloads": {}})
+    manifest['region'] = REGION_NAME
+    manifestLock = threading.Lock()
+
+    workloadSummaries = listAllWorkloads(waclient)
+
+    # Workloads deleted since the last run are dropped, so a restore does not bring them back
+    currentWorkloadIds = set(workloadSummary['WorkloadId'] for workloadSummary in workloadSummaries)
+    for workloadId in list(manifest['workloads']):
+        if workloadId not in currentWorkloadIds:
+            entry = manifest['workloads'].pop(workloadId)
+            exportFileName = os.path.join(archiveDir, entry['File'])
+            if os.path.exists(exportFileName):
+                os.remove(exportFileName)
+            logger.info("Removed workload '%s' (%s) since it no longer exists" % (entry['WorkloadName'], workloadId))
+
+    pending = []
+    for workloadSummary in workloadSummaries:
+        entry = manifest['workloads'].get(workloadSummary['WorkloadId'])
+        if entry and entry['UpdatedAt'] == str(workloadSummary['UpdatedAt']) and os.path.exists(os.path.join(archiveDir, entry['File'])):
+            logger.debug("Workload %s has not changed since the last export" % workloadSummary['WorkloadId'])
+            continue
+        pending.append(workloadSummary)
+    logger.info("Exporting %d changed workloads to %s" % (len(pending), archiveDir))
+
+    def backupAndCheckpoint(workloadSummary):
+        entry = backupWorkload(waclient,workloadSummary,archiveDir)
+        if entry is not None:
+            with manifestLock:
+                manifest['workloads'][workloadSummary['WorkloadId']] = entry
+                savePortfolioFile(manifestFileName, manifest)
+        return entry
+
+    failedCount = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        for future in [executor.submit(backupAndCheckpoint, workloadSummary) for workloadSummary in pending]:
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                logger.error("ERROR - Unable to export workload: %s" % e)
+                failedCount += 1
+    savePortfolioFile(manifestFileName, manifest)
+    return len(pending) - failedCount, failedCount
+
+def restoreWorkload(
+    waclient,
+    sourceWorkloadId,
+    entry,
+    archiveDir,
+    existingWorkloads
+    ):
+    """ Restore a single workload from the portfolio directory, returns the target workload id """
+    with openExportFile(os.path.join(archiveDir, entry['File']), 'r') as json_file:
+        toWorkloadId, answerCount = importWorkloadStream(waclient, readRecords(json_file), existingWorkloads)
+    logger.info("Restored workload '%s' (%s) as %s" % (entry['WorkloadName'], sourceWorkloadId, toWorkloadId))
+    return toWorkloadId
+
+def importPortfolioArchive(
+    waclient,
+    archiveDir
+    ):
+    """ Restore every workload in archiveDir concurrently, skipping ones already restored """
+    manifest = loadPortfolioFile(os.path.join(archiveDir, PORTFOLIO_MANIFEST), None)
+    if manifest is None or manifest.get('format') != PORTFOLIO_FORMAT_NAME:
+        logger.error("%s is not a portfolio directory" % archiveDir)
+        sys.exit()
+    stateFileName = os.path.join(archiveDir, PORTFOLIO_RESTORE_STATE)
+    restoreState = loadPortfolioFile(stateFileName, {})
+    stateLock = threading.Lock()
+
+    # Workloads are matched by name so re-running the restore never creates duplicates
+    existingWorkloads = {}
+    for workloadSummary in listAllWorkloads(waclient):
+        existingWorkloads[workloadSummary['WorkloadName']] = workloadSummary['WorkloadId']
+
+    pending = {}
+    for sourceWorkloadId, entry in manifest['workloads'].items():
+        restored = restoreState.get(sourceWorkloadId)
+        if restored and restored['UpdatedAt'] == entry['UpdatedAt'] and restored['WorkloadId'] in existingWorkloads.values():
+            logger.debug("Workload %s has already been restored" % sourceWorkloadId)
+            continue
+        pending[sourceWorkloadId] = entry
+    logger.info("Restoring %d workloads from %s" % (len(pending), archiveDir))
+
+    def restoreAndCheckpoint(sourceWorkloadId, entry):
+        toWorkloadId = restoreWorkload(waclient,sourceWorkloadId,entry,archiveDir,existingWorkloads)
+        with stateLock:
+            restoreState[sourceWorkloadId] = {"WorkloadId": toWorkloadId, "UpdatedAt": entry['UpdatedAt']}
+            savePortfolioFile(stateFileName, restoreState)
+
+    failedCount = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        futures = [executor.submit(restoreAndCheckpoint, sourceWorkloadId, entry) for sourceWorkloadId, entry in pending.items()]
+        for future in futures:
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                logger.error("ERROR - Unable to restore workload: %s" % e)
+                failedCount += 1
+    return len(pending) - failedCount, failedCount
+
 def main():
     """ Main program run """
 
@@ -417,8 +801,24 @@ def main():
     WACLIENT = SESSION1.client(
         service_name='wellarchitected',
         region_name=REGION_NAME,
+        config=botocore.config.Config(
+            max_pool_connections=max(10, CONCURRENCY),
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
     )
 
+    if exportPortfolio:
+        logger.info("Exporting portfolio to %s" % FILENAME)
+        exportedCount, failedCount = exportPortfolioArchive(WACLIENT,FILENAME)
+        logger.info("Portfolio export complete: %d exported, %d failed" % (exportedCount, failedCount))
+        return
+
+    if importPortfolio:
+        logger.info("Restoring portfolio from %s" % FILENAME)
+        restoredCount, failedCount = importPortfolioArchive(WACLIENT,FILENAME)
+        logger.info("Portfolio restore complete: %d restored, %d failed" % (restoredCount, failedCount))
+        return
+
     # This will setup a blank dict we can use to export to a JSON file
     exportObject = {
         "workload": [],
@@ -427,7 +827,12 @@ def main():
     }
 
 
-    if exportWorkload:
+    if exportWorkload and EXPORT_FORMAT == "jsonl":
+        logger.info("Exporting workload '%s' to file %s" % (WORKLOADID, FILENAME))
+        answerCount = exportWorkloadStream(WACLIENT,WORKLOADID,FILENAME)
+        logger.info("Export of %d answers completed to file %s" % (answerCount, FILENAME))
+
+    elif exportWorkload:
         logger.info("Exporting workload '%s' to file %s" % (WORKLOADID, FILENAME))
         workloadJson = GetWorkload(WACLIENT,WORKLOADID)
         exportObject['workload'].append(workloadJson)
@@ -446,56 +851,31 @@ def main():
 
     if importWorkload:
         logger.info("Creating a new workload from file %s" % FILENAME)
-        with open(FILENAME) as json_file:
+        with openExportFile(FILENAME, 'r') as json_file:
+            # The newline-delimited format always starts with a compact header record,
+            # while the legacy format is a single indented JSON document
+            firstLine = json_file.readline()
+            try:
+                firstRecord = json.loads(firstLine)
+            except ValueError:
+                firstRecord = {}
+            if isinstance(firstRecord, dict) and firstRecord.get('record') == "header":
+                logger.info("Importing %s version %s file" % (STREAM_FORMAT_NAME, firstRecord['data']['version']))
+                importWorkloadStream(WACLIENT, itertools.chain([firstRecord], readRecords(json_file)))
+                logger.info("Copy complete - exiting")
+                return
+            json_file.seek(0)
             importObject = json.load(json_file)
         workloadJson = importObject['workload'][0]
 
-        # For each of the optional variables, lets check and see if we have them first:
-        Notes = workloadJson['Notes'] if "Notes" in workloadJson else ""
-        nonAwsRegions = workloadJson['NonAwsRegions'] if "NonAwsRegions" in workloadJson else []
-        architecturalDesign = workloadJson['ArchitecturalDesign'] if "ArchitecturalDesign" in workloadJson else ""
-        industryType = workloadJson['IndustryType'] if "IndustryType" in workloadJson else ""
-        industry = workloadJson['Industry'] if "Industry" in workloadJson else ""
-        accountIds = workloadJson['AccountIds'] if "AccountIds" in workloadJson else []
-        tags = workloadJson['Tags'] if "Tags" in workloadJson else []
-        # Create the new workload to copy into
-        toWorkloadId,toWorkloadARN = CreateNewWorkload(WACLIENT,
-                                                    (workloadJson['WorkloadName']),
-                                                    workloadJson['Description'],
-                                                    workloadJson['ReviewOwner'],
-                                                    workloadJson['Environment'],
-                                                    workloadJson['AwsRegions'],
-                                                    workloadJson['Lenses'],
-                                                    tags,
-                                                    workloadJson['PillarPriorities'],
-                                                    Notes,
-                                                    nonAwsRegions,
-                                                    architecturalDesign,
-                                                    industryType,
-                                                    industry,
-                                                    accountIds
-                                                    )
-        logger.info("New workload id: %s (%s)" % (toWorkloadId,toWorkloadARN))
+        toWorkloadId = createWorkloadFromExport(WACLIENT, workloadJson)
 
         # Iterate over each lens and copy all of the answers
         for lens in workloadJson['Lenses']:
             # We need to verify the lens version first
-            logger.info("Verifying lens version before restoring answers")
-            lensReview = getWorkloadLensReview(WACLIENT,toWorkloadId,lens)
             importLensVersion = jmespath.search("[*]."+lens+".LensVersion", importObject['lens_review'])[0]
-            # ************************************************************************
-            #  There is no ability to restore to a specific lens version
-            #  in the API at this time, so we just have to error out if
-            #  the version has changed.
-            # ************************************************************************
-            if lensReview['LensVersion'] != importLensVersion:
-                logger.error("Version of the lens %s does not match the new workload" % lens)
-                logger.error("Import Version: %s" % importLensVersion)
-                logger.error("New Workload Version: %s" % lensReview['LensVersion'])
-                logger.error("You may need to delete the workload %s" % toWorkloadId)
+            if not verifyLensVersion(WACLIENT, toWorkloadId, lens, importLensVersion):
                 sys.exit()
-            else:
-                logger.info("Versions match (%s)" % importLensVersion)
 
             logger.info("Retrieving all answers for lens %s" % lens)
 
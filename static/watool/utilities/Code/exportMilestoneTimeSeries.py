@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+This is a tool to export the risk counts of every milestone of every workload into a
+columnar time series file, and to report risk trends (such as HRI burn-down) from it
+
+This code is only for use in Well-Architected labs
+*** NOT FOR PRODUCTION USE ***
+
+Licensed under the Apache 2.0 and MITnoAttr License.
+
+Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at https://aws.amazon.com/apache2.0/
+"""
+
+import csv
+import json
+import datetime
+import gzip
+import logging
+import os
+import sys
+import concurrent.futures
+
+import argparse
+import botocore
+import botocore.config
+import boto3
+from pkg_resources import packaging
+
+
+__author__    = "Eric Pullen"
+__email__     = "eppullen@amazon.com"
+__copyright__ = "Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved."
+__credits__   = ["Eric Pullen"]
+__version__   = "0.1"
+
+# Default region listed here
+REGION_NAME = "us-east-1"
+
+# Setup Logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+)
+
+logger = logging.getLogger()
+logging.getLogger('boto3').setLevel(logging.CRITICAL)
+logging.getLogger('botocore').setLevel(logging.CRITICAL)
+logging.getLogger('s3transfer').setLevel(logging.CRITICAL)
+logging.getLogger('urllib3').setLevel(logging.CRITICAL)
+PARSER = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description='''\
+This utility has two options to run:
+------------------------------------
+1) Export - Read every milestone of every workload (or those matching --workloadprefix / --tag)
+   and write one row per workload, milestone, lens and pillar with the risk counts, the number
+   of answered questions and the change since the previous milestone. Milestones never change,
+   so re-running against an existing file only fetches milestones that are not in it yet
+   (if the region, --workloadprefix, --tag or --lens changed, every milestone is fetched again).
+2) Report - Read a previously exported file and print a portfolio risk trend without calling
+   any AWS APIs, for example the HRI burn-down across every workload.
+
+File formats:
+-------------
+json - Columnar JSON (one list per column), gzip compressed if the file name ends in .gz
+csv  - One row per record, for use in a spreadsheet. Can not be used with --report
+    '''
+    )
+
+GROUP = PARSER.add_mutually_exclusive_group(required=True)
+GROUP.add_argument('--export', action='store_true', help='export the milestone time series to a file')
+GROUP.add_argument('--report', choices=["HIGH", "MEDIUM", "UNANSWERED"], help='print the portfolio trend for this risk from a file')
+
+PARSER.add_argument('-p','--profile', required=False, default="default", help='AWS CLI Profile Name')
+PARSER.add_argument('-r','--region', required=False, default="us-east-1", help='From Region Name. Example: us-east-1')
+PARSER.add_argument('-f','--fileName', required=True, help='Time series file to write to or report from. Example: milestones.json.gz')
+PARSER.add_argument('-n','--workloadprefix', required=False, default="", help='Only export workloads whose name starts with this prefix')
+PARSER.add_argument('-t','--tag', required=False, action='append', default=[], help='Only export workloads with this tag (KEY=VALUE). Can be used multiple times')
+PARSER.add_argument('-l','--lens', required=False, default="", help='Only export or report on this lens alias. Example: wellarchitected')
+PARSER.add_argument('-i','--includecurrent', action='store_true', help='Also export the current state of each workload as milestone 0')
+PARSER.add_argument('-c','--concurrency', required=False, type=int, default=8, help='Number of milestones to read at the same time')
+PARSER.add_argument('--format', required=False, default="json", choices=["json", "csv"], help='Export file format')
+PARSER.add_argument('-v','--debug', action='store_true', help='print debug messages to stderr')
+
+ARGUMENTS = PARSER.parse_args()
+PROFILE = ARGUMENTS.profile
+FILENAME = ARGUMENTS.fileName
+REGION_NAME = ARGUMENTS.region
+WORKLOADPREFIX = ARGUMENTS.workloadprefix
+LENSFILTER = ARGUMENTS.lens
+INCLUDECURRENT = ARGUMENTS.includecurrent
+EXPORT_FORMAT = ARGUMENTS.format
+CONCURRENCY = max(1, ARGUMENTS.concurrency)
+TAGFILTER = {}
+for tagString in ARGUMENTS.tag:
+    tagKey, _, tagValue = tagString.partition('=')
+    TAGFILTER[tagKey] = tagValue
+
+if ARGUMENTS.report and EXPORT_FORMAT == "csv":
+    PARSER.error("--report reads the columnar json format, --format csv can only be used with --export")
+
+if ARGUMENTS.debug:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+
+TIMESERIES_FORMAT_NAME = "wafr-milestone-timeseries"
+TIMESERIES_FORMAT_VERSION = 1
+
+# Risk levels returned by the API for each pillar
+RISK_LEVELS = ["HIGH", "MEDIUM", "NONE", "NOT_APPLICABLE", "UNANSWERED"]
+
+# Column order of the time series. Deltas are against the previous milestone of the same workload, lens and pillar
+COLUMNS = [
+    "WorkloadId",
+    "WorkloadName",
+    "MilestoneNumber",
+    "MilestoneName",
+    "RecordedAt",
+    "LensAlias",
+    "PillarId",
+] + RISK_LEVELS + [
+    "Answered",
+    "DeltaHIGH",
+    "DeltaMEDIUM",
+    "DeltaAnswered",
+]
+
+def listAllWorkloads(
+    waclient
+    ):
+    """ List every workload summary in the account and region """
+    workloads = []
+    kwargs = {}
+    if WORKLOADPREFIX:
+        kwargs['WorkloadNamePrefix'] = WORKLOADPREFIX
+    while True:
+        try:
+            response=waclient.list_workloads(**kwargs)
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            break
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            break
+        workloads.extend(response['WorkloadSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return workloads
+
+def workloadMatchesTags(
+    waclient,
+    workloadSummary
+    ):
+    """ Returns True if the workload has every tag in TAGFILTER """
+    if not TAGFILTER:
+        return True
+    try:
+        response=waclient.list_tags_for_resource(WorkloadArn=workloadSummary['WorkloadArn'])
+    except botocore.exceptions.ClientError as e:
+        logger.error("ERROR - Unexpected error: %s" % e)
+        return False
+    workloadTags = response.get('Tags', {})
+    return all(workloadTags.get(tagKey) == tagValue for tagKey, tagValue in TAGFILTER.items())
+
+def listAllMilestones(
+    waclient,
+    workloadId
+    ):
+    """ List every milestone summary for a workload, following NextToken """
+    milestones = []
+    kwargs = {'WorkloadId': workloadId, 'MaxResults': 50}
+    while True:
+        try:
+            response=waclient.list_milestones(**kwargs)
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            break
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            break
+        milestones.extend(response['MilestoneSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return milestones
+
+def listLensReviewSummaries(
+    waclient,
+    workloadId,
+    milestoneNumber=0
+    ):
+    """ List the lens reviews for a workload, or for one of its milestones """
+    lensReviews = []
+    kwargs = {'WorkloadId': workloadId}
+    if milestoneNumber:
+        kwargs['MilestoneNumber'] = milestoneNumber
+    while True:
+        response=waclient.list_lens_reviews(**kwargs)
+        lensReviews.extend(response['LensReviewSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return lensReviews
+
+def getMilestoneRows(
+    waclient,
+    workloadSummary,
+    milestoneSummary
+    ):
+    """ Return one row per lens and pillar for a milestone, without the delta columns """
+    milestoneNumber = milestoneSummary['MilestoneNumber']
+    rows = []
+    for lensReviewSummary in listLensReviewSummaries(waclient,workloadSummary['WorkloadId'],milestoneNumber):
+        lensAlias = lensReviewSummary['LensAlias']
+        if LENSFILTER and lensAlias != LENSFILTER:
+            continue
+        kwargs = {'WorkloadId': workloadSummary['WorkloadId'], 'LensAlias': lensAlias}
+        if milestoneNumber:
+            kwargs['MilestoneNumber'] = milestoneNumber
+        lensReview = waclient.get_lens_review(**kwargs)['LensReview']
+        for pillarSummary in lensReview['PillarReviewSummaries']:
+            riskCounts = pillarSummary.get('RiskCounts', {})
+            row = {
+                "WorkloadId": workloadSummary['WorkloadId'],
+                "WorkloadName": workloadSummary['WorkloadName'],
+                "MilestoneNumber": milestoneNumber,
+                "MilestoneName": milestoneSummary['MilestoneName'],
+                "RecordedAt": str(milestoneSummary['RecordedAt']),
+                "LensAlias": lensAlias,
+                "PillarId": pillarSummary['PillarId'],
+            }
+            for riskLevel in RISK_LEVELS:
+                row[riskLevel] = riskCounts.get(riskLevel, 0)
+            row['Answered'] = sum(riskCounts.get(riskLevel, 0) for riskLevel in RISK_LEVELS if riskLevel != "UNANSWERED")
+            rows.append(row)
+    return rows
+
+def milestoneOrder(
+    milestoneNumber
+    ):
+    """ Sort key that puts the CURRENT state (milestone 0) after every real milestone """
+    return (milestoneNumber == 0, milestoneNumber)
+
+def exportFilters():
+    """ The options that decide which rows are exported, stored in the file to detect changes """
+    return {
+        "region": REGION_NAME,
+        "workloadprefix": WORKLOADPREFIX,
+        "tags": TAGFILTER,
+        "lens": LENSFILTER
+    }
+
+def addDeltas(
+    rows
+    ):
+    """ Sort the rows and fill in the change since the previous milestone of the same workload, lens and pillar """
+    rows.sort(key=lambda row: (row['WorkloadId'], row['LensAlias'], row['PillarId'], row['RecordedAt'], milestoneOrder(row['MilestoneNumber'])))
+    previous = {}
+    for row in rows:
+        key = (row['WorkloadId'], row['LensAlias'], row['PillarId'])
+        last = previous.get(key)
+        for column in ["HIGH", "MEDIUM", "Answered"]:
+            row['Delta' + column] = row[column] - last[column] if last else 0
+        previous[key] = row
+    return rows
+
+def openTimeSeriesFile(
+    fileName,
+    mode
+    ):
+    """ Open the time series file, gzip compressed if the file name ends in .gz """
+    if fileName.endswith(".gz"):
+        return gzip.open(fileName, mode + "t", encoding="utf-8", newline="")
+    return open(fileName, mode, encoding="utf-8", newline="")
+
+def loadTimeSeries(
+    fileName
+    ):
+    """ Load a columnar time series file and return it as a list of rows and the filters it was exported with """
+    with openTimeSeriesFile(fileName, "r") as inFile:
+        timeSeries = json.load(inFile)
+    if timeSeries.get('format') != TIMESERIES_FORMAT_NAME:
+        logger.error("ERROR - %s is not a milestone time series file" % fileName)
+        sys.exit()
+    columns = timeSeries['columns']
+    rows = [dict(zip(columns, values)) for values in zip(*(timeSeries['data'][column] for column in columns))]
+    return rows, timeSeries.get('filters')
+
+def saveTimeSeries(
+    fileName,
+    rows
+    ):
+    """ Write the rows to fileName in EXPORT_FORMAT, replacing the file only once it is complete """
+    # Keep the suffix so the temporary file is compressed the same way
+    tmpFileName = os.path.join(os.path.dirname(fileName), ".tmp-" + os.path.basename(fileName))
+    with openTimeSeriesFile(tmpFileName, "w") as outFile:
+        if EXPORT_FORMAT == "csv":
+            writer = csv.DictWriter(outFile, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump({
+                "format": TIMESERIES_FORMAT_NAME,
+                "version": TIMESERIES_FORMAT_VERSION,
+                "region": REGION_NAME,
+                "filters": exportFilters(),
+                "generated": str(datetime.datetime.now(datetime.timezone.utc)),
+                "columns": COLUMNS,
+                "data": {column: [row[column] for row in rows] for column in COLUMNS}
+            }, outFile, separators=(',', ':'))
+    os.replace(tmpFileName, fileName)
+
+def exportTimeSeries(
+    waclient,
+    fileName
+    ):
+    """ Export every milestone of every matching workload concurrently, returns the number of rows """
+    # Milestones are immutable, so keep any rows we already have and only fetch new milestones
+    # (the rows only cover the workloads and lenses selected when they were exported)
+    existingRows = []
+    if EXPORT_FORMAT == "json" and os.path.exists(fileName):
+        loadedRows, filters = loadTimeSeries(fileName)
+        if filters == exportFilters():
+            existingRows = [row for row in loadedRows if row['MilestoneNumber']]
+            logger.info("Loaded %d existing rows from %s" % (len(existingRows), fileName))
+        else:
+            logger.info("The filters changed since %s was exported, exporting every milestone again" % fileName)
+    exported = {(row['WorkloadId'], row['MilestoneNumber']) for row in existingRows}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        workloads = listAllWorkloads(waclient)
+        if TAGFILTER:
+            tagMatches = list(executor.map(lambda summary: workloadMatchesTags(waclient, summary), workloads))
+            workloads = [workloadSummary for workloadSummary, matches in zip(workloads, tagMatches) if matches]
+        logger.info("Found %d workloads" % len(workloads))
+
+        milestoneLists = executor.map(lambda summary: listAllMilestones(waclient, summary['WorkloadId']), workloads)
+        futures = {}
+        for workloadSummary, milestones in zip(workloads, milestoneLists):
+            if INCLUDECURRENT:
+                milestones = milestones + [{"MilestoneNumber": 0, "MilestoneName": "CURRENT", "RecordedAt": workloadSummary['UpdatedAt']}]
+            for milestoneSummary in milestones:
+                if (workloadSummary['WorkloadId'], milestoneSummary['MilestoneNumber']) in exported:
+                    continue
+                future = executor.submit(getMilestoneRows, waclient, workloadSummary, milestoneSummary)
+                futures[future] = "%s milestone %s" % (workloadSummary['WorkloadName'], milestoneSummary['MilestoneNumber'])
+
+        rows = list(existingRows)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                rows.extend(future.result())
+            except botocore.exceptions.ClientError as e:
+                logger.error("ERROR - Unable to export %s: %s" % (futures[future], e))
+        logger.info("Fetched %d new milestones" % len(futures))
+
+    saveTimeSeries(fileName, addDeltas(rows))
+    return len(rows)
+
+def reportTrend(
+    rows,
+    riskLevel
+    ):
+    """ Print the portfolio total for riskLevel on each day a milestone was recorded """
+    if LENSFILTER:
+        rows = [row for row in rows if row['LensAlias'] == LENSFILTER]
+    # Total each workload per milestone, then carry each workload's latest total forward day by day
+    milestoneTotals = {}
+    for row in rows:
+        key = (row['RecordedAt'][:10], row['WorkloadId'], row['MilestoneNumber'])
+        milestoneTotals[key] = milestoneTotals.get(key, 0) + row[riskLevel]
+
+    latestByWorkload = {}
+    print("%-12s %10s %10s %10s" % ("Date", riskLevel, "Change", "Workloads"))
+    lastTotal = None
+    for day in sorted({key[0] for key in milestoneTotals}):
+        for key in sorted((key for key in milestoneTotals if key[0] == day), key=lambda key: (key[1], milestoneOrder(key[2]))):
+            latestByWorkload[key[1]] = milestoneTotals[key]
+        total = sum(latestByWorkload.values())
+        change = total - lastTotal if lastTotal is not None else 0
+        print("%-12s %10d %+10d %10d" % (day, total, change, len(latestByWorkload)))
+        lastTotal = total
+
+def main():
+    """ Main program run """
+
+    if ARGUMENTS.report:
+        rows, filters = loadTimeSeries(FILENAME)
+        reportTrend(rows, ARGUMENTS.report)
+        return
+
+    boto3_min_version = "1.16.38"
+    # Verify if the version of Boto3 we are running has the wellarchitected APIs included
+    if packaging.version.parse(boto3.__version__) < packaging.version.parse(boto3_min_version):
+        logger.error("Your Boto3 version (%s) is less than %s. You must ugprade to run this script (pip3 upgrade boto3)" % (boto3.__version__, boto3_min_version))
+        sys.exit()
+
+    logger.info("Script version %s" % __version__)
+    logger.info("Starting Boto %s Session" % boto3.__version__)
+    # Create a new boto3 session
+    SESSION1 = boto3.session.Session(profile_name=PROFILE)
+    # Initiate the well-architected session using the region defined above
+    WACLIENT = SESSION1.client(
+        service_name='wellarchitected',
+        region_name=REGION_NAME,
+        config=botocore.config.Config(
+            max_pool_connections=max(10, CONCURRENCY),
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
+    )
+
+    logger.info("Exporting milestone time series to %s" % FILENAME)
+    rowCount = exportTimeSeries(WACLIENT,FILENAME)
+    logger.info("Export of %d rows completed to file %s" % (rowCount, FILENAME))
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@
 
 
 import botocore
+import botocore.config
 import boto3
 import json
 import datetime
@@ -25,6 +26,8 @@ import base64
 import argparse
 import webbrowser
 import tempfile
+import threading
+import concurrent.futures
 import urllib.request
 from pkg_resources import packaging
 from pathlib import Path
@@ -56,7 +59,10 @@ logging.getLogger('urllib3').setLevel(logging.CRITICAL)
 
 PARSER = argparse.ArgumentParser()
 PARSER.add_argument('--profile', required=False, default="default", help='AWS CLI Profile Name')
-PARSER.add_argument('--workloadid', required=True, help='WorkloadID. Example: 1e5d148ab9744e98343cc9c677a34682')
+PARSER.add_argument('--workloadid', required=False, nargs='+', default=[], help='One or more WorkloadIDs. Example: 1e5d148ab9744e98343cc9c677a34682')
+PARSER.add_argument('--workloadprefix', required=False, default="", help='Report on every workload whose name starts with this prefix')
+PARSER.add_argument('--outputdir', required=False, default="", help='Directory to write a multi-page report (index.html plus one page per workload)')
+PARSER.add_argument('--concurrency', required=False, type=int, default=8, help='Number of pillars to gather concurrently')
 PARSER.add_argument('--region', required=False, default="us-east-1", help='From Region Name. Example: us-east-1')
 PARSER.add_argument('--debug', action='store_true', help='print debug messages to stderr')
 
@@ -64,7 +70,13 @@ ARGUMENTS = PARSER.parse_args()
 
 REGION_NAME = ARGUMENTS.region
 PROFILE = ARGUMENTS.profile
-WORKLOADID = ARGUMENTS.workloadid
+WORKLOADIDS = ARGUMENTS.workloadid
+WORKLOADPREFIX = ARGUMENTS.workloadprefix
+OUTPUTDIR = ARGUMENTS.outputdir
+CONCURRENCY = max(1, ARGUMENTS.concurrency)
+
+if not WORKLOADIDS and not WORKLOADPREFIX:
+    PARSER.error("one of --workloadid or --workloadprefix is required")
 
 if ARGUMENTS.debug:
     logger.setLevel(logging.DEBUG)
@@ -89,6 +101,14 @@ PILLAR_PROPER_NAME_MAP = {
                     "costOptimization": "Cost Optimization"
 }
 
+# The improvement plan pages, the parsed improvement plan items, and the lens
+# structure are the same for every workload, so we only gather each one once
+# per run and share it between the worker threads
+IMPROVEMENT_PLAN_PAGE_CACHE = {}
+IMPROVEMENT_PLAN_FRAGMENT_CACHE = {}
+LENS_STRUCTURE_CACHE = {}
+CACHE_LOCK = threading.Lock()
+
 # Helper class to convert a datetime item to JSON.
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, z):
@@ -201,12 +221,48 @@ def updateAnswersForQuestion(
     return answers
 
 
+def getCachedItem(
+    cache,
+    cacheKey,
+    fetchItem
+    ):
+    # The first thread to ask for an item stores a Future for it and fetches it. Any
+    # other thread asking for the same item waits on that Future instead of fetching
+    # it again.
+    with CACHE_LOCK:
+        itemFuture = cache.get(cacheKey)
+        fetchNow = itemFuture is None
+        if fetchNow:
+            itemFuture = concurrent.futures.Future()
+            cache[cacheKey] = itemFuture
+    if fetchNow:
+        try:
+            itemFuture.set_result(fetchItem())
+        except Exception as e:
+            # Do not keep the failure, the next caller will try again
+            with CACHE_LOCK:
+                del cache[cacheKey]
+            itemFuture.set_exception(e)
+    return itemFuture.result()
+
+def getImprovementPlanPage(
+    ImprovementPlanUrl
+    ):
+    # Each choice only changes the #anchor of the page, so cache on the page itself
+    pageUrl = ImprovementPlanUrl.split('#')[0]
+    def downloadPage():
+        urlresponse = urllib.request.urlopen(pageUrl)
+        htmlBytes = urlresponse.read()
+        htmlStr = htmlBytes.decode("utf8")
+        return htmlStr.split('\n')
+    return getCachedItem(IMPROVEMENT_PLAN_PAGE_CACHE, pageUrl, downloadPage)
+
 def getImprovementPlanHTMLDescription(
     ImprovementPlanUrl,
     PillarId
     ):
 
-    logger.debug("ImprovementPlanUrl: %s for pillar %s " % (ImprovementPlanUrl,PILLAR_PARSE_MAP[PillarId]))
+    logger.debug("ImprovementPlanUrl: %s for pillar %s " % (ImprovementPlanUrl,PILLAR_PARSE_MAP.get(PillarId,PillarId)))
     stepRaw = ImprovementPlanUrl.rsplit('#')[1]
 
     if len(stepRaw) <= 5:
@@ -217,16 +273,13 @@ def getImprovementPlanHTMLDescription(
     firstItem = "step"+stepNumber
     secondItem = ("step"+str((int(stepNumber)+1)))
     logger.debug ("Going from %s to %s" % (firstItem, secondItem))
-    urlresponse = urllib.request.urlopen(ImprovementPlanUrl)
-    htmlBytes = urlresponse.read()
-    htmlStr = htmlBytes.decode("utf8")
-    htmlSplit = htmlStr.split('\n')
+    htmlSplit = getImprovementPlanPage(ImprovementPlanUrl)
 
     foundit = 0
     ipString = ""
     questionIdText = ""
     for i in htmlSplit:
-        if PILLAR_PARSE_MAP[PillarId] in i:
+        if PILLAR_PARSE_MAP.get(PillarId,PillarId) in i:
             bsparse = BeautifulSoup(i,features="html.parser")
             questionIdText = str(bsparse.text).split(':')[0].strip()
         if (secondItem in i) or ("</div>" in i):
@@ -245,6 +298,16 @@ def getImprovementPlanHTMLDescription(
 
     return prettyHTML, questionIdText
 
+def getImprovementPlanFragment(
+    ImprovementPlanUrl,
+    PillarId
+    ):
+    # The prettified improvement plan item for a choice is identical for every workload
+    def buildFragment():
+        ipItemHTML, questionIdText = getImprovementPlanHTMLDescription(ImprovementPlanUrl,PillarId)
+        return (ipItemHTML.prettify(), questionIdText)
+    return getCachedItem(IMPROVEMENT_PLAN_FRAGMENT_CACHE, (ImprovementPlanUrl, PillarId), buildFragment)
+
 def getImprovementPlanItems(
     waclient,
     workloadId,
@@ -255,13 +318,10 @@ def getImprovementPlanItems(
 ):
     response = {}
     htmlString = ""
-    unanswered = getUnansweredForQuestion(waclient,workloadId,'wellarchitected',QuestionId)
+    unanswered = getUnansweredForQuestion(waclient,workloadId,lensAlias,QuestionId)
     # print("Unanswered: ",json.dumps(unanswered))
 
-    urlresponse = urllib.request.urlopen(ImprovementPlanUrl)
-    htmlBytes = urlresponse.read()
-    htmlStr = htmlBytes.decode("utf8")
-    htmlSplit = htmlStr.split('\n')
+    htmlSplit = getImprovementPlanPage(ImprovementPlanUrl)
     # print(" ")
     # htmlString += 'Improvement Plan Items:<br>'
     # htmlString += '<div id="detect-investigate-events"><ul>'
@@ -289,45 +349,118 @@ def listLensReviewImprovements(
     pillarId,
     milestoneNumber=""
 ):
-    response = {}
+    improvements = []
+    kwargs = {'WorkloadId': workloadId, 'LensAlias': lensAlias, 'PillarId': pillarId}
+    if milestoneNumber:
+        kwargs['MilestoneNumber'] = milestoneNumber
+    while True:
+        try:
+            response=waclient.list_lens_review_improvements(**kwargs)
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            break
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            break
+
+        # print("Full JSON:",json.dumps(response['LensReviewReport']['Base64String'], cls=DateTimeEncoder))
+        improvements.extend(response['ImprovementSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+
+    return improvements
+
+def listLensVersions(
+    waclient,
+    workloadId
+    ):
+    # Returns the lens version each lens review of a workload is using. Workloads
+    # that have not been upgraded can be on an older version of the same lens.
+    lensVersions = {}
+    kwargs = {'WorkloadId': workloadId}
+    while True:
+        try:
+            response=waclient.list_lens_reviews(**kwargs)
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            break
+        for lensReview in response['LensReviewSummaries']:
+            lensVersions[lensReview['LensAlias']] = lensReview.get('LensVersion')
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return lensVersions
+
+def getLensStructure(
+    waclient,
+    workloadId,
+    lensAlias,
+    lensVersion=None
+    ):
+    # Returns the lens name and its list of (PillarId, PillarName). This is the same
+    # for every workload using the same version of the lens, so it is only looked up
+    # once per run. Without a version we cannot share it and always look it up.
+    cacheKey = (lensAlias, lensVersion)
+    with CACHE_LOCK:
+        if lensVersion and cacheKey in LENS_STRUCTURE_CACHE:
+            return LENS_STRUCTURE_CACHE[cacheKey]
     try:
-        if milestoneNumber:
-            response=waclient.list_lens_review_improvements(
-            WorkloadId=workloadId,
-            LensAlias=lensAlias,
-            PillarId=pillarId,
-            MilestoneNumber=milestoneNumber
-            )
-        else:
-            response=waclient.list_lens_review_improvements(
-            WorkloadId=workloadId,
-            LensAlias=lensAlias,
-            PillarId=pillarId
-            )
-
-    except botocore.exceptions.ParamValidationError as e:
-        logger.error("ERROR - Parameter validation error: %s" % e)
+        response=waclient.get_lens_review(
+        WorkloadId=workloadId,
+        LensAlias=lensAlias
+        )
+        lensName = response['LensReview'].get('LensName', lensAlias)
+        pillars = [(pillar['PillarId'], pillar.get('PillarName', PILLAR_PROPER_NAME_MAP.get(pillar['PillarId'], pillar['PillarId']))) for pillar in response['LensReview']['PillarReviewSummaries']]
     except botocore.exceptions.ClientError as e:
         logger.error("ERROR - Unexpected error: %s" % e)
-
-    # print("Full JSON:",json.dumps(response['LensReviewReport']['Base64String'], cls=DateTimeEncoder))
-
-    return response['ImprovementSummaries']
+        # Fall back to the standard pillars and do not cache the result
+        return lensAlias, [(pillar, PILLAR_PROPER_NAME_MAP[pillar]) for pillar in PILLAR_PARSE_MAP]
+    if lensVersion:
+        with CACHE_LOCK:
+            LENS_STRUCTURE_CACHE[cacheKey] = (lensName, pillars)
+    return lensName, pillars
+
+def listAllWorkloads(
+    waclient,
+    workloadNamePrefix=""
+    ):
+    # List every workload (optionally filtered by name prefix), following the NextToken
+    workloads = []
+    kwargs = {}
+    if workloadNamePrefix:
+        kwargs['WorkloadNamePrefix'] = workloadNamePrefix
+    while True:
+        try:
+            response=waclient.list_workloads(**kwargs)
+        except botocore.exceptions.ParamValidationError as e:
+            logger.error("ERROR - Parameter validation error: %s" % e)
+            break
+        except botocore.exceptions.ClientError as e:
+            logger.error("ERROR - Unexpected error: %s" % e)
+            break
+        workloads.extend(response['WorkloadSummaries'])
+        if "NextToken" not in response:
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return workloads
 
 def GetWorkload(
     waclient,
     workloadId
     ):
 
-    # Get the WorkloadId
+    # Get the WorkloadId, returns None if the workload could not be retrieved
     try:
         response=waclient.get_workload(
         WorkloadId=workloadId
         )
     except botocore.exceptions.ParamValidationError as e:
         logger.error("ERROR - Parameter validation error: %s" % e)
+        return None
     except botocore.exceptions.ClientError as e:
         logger.error("ERROR - Unexpected error: %s" % e)
+        return None
 
     # print("Full JSON:",json.dumps(response['Workload'], cls=DateTimeEncoder))
     workload = response['Workload']
@@ -340,11 +473,13 @@ def generateHTMLHeader():
     # Here is how I would do do that:
     # htmlPage = Path('header_file.html').read_text()
     htmlPage += '<div id="main" role="main">'
-    htmlPage += "<h1>Python Well-Architected Report v"+__version__
+    htmlPage += "<h1>Python Well-Architected Report v"+__version__+"</h1>"
     htmlPage += "<br></div>"
     return htmlPage
 
-def generateHTMLTOC():
+def generateHTMLTOC(
+    lensSections
+    ):
     htmlPage = ""
     htmlPage += '<div id="main" role="main">'
     htmlPage += '<h1>Table of Contents</h1>'
@@ -352,21 +487,28 @@ def generateHTMLTOC():
     htmlPage += "<br>"
 
 
-    for pillar in PILLAR_PARSE_MAP:
-        htmlPage += ('<li class="listitem"><b><a href="#%s">%s</a></b> </li>' % (pillar,PILLAR_PROPER_NAME_MAP[pillar]))
+    for lensSection in lensSections:
+        htmlPage += ('<li class="listitem"><b>%s</b><ul class="itemizedlist" type="circle">' % lensSection['LensName'])
+        for pillarId, pillarName in lensSection['Pillars']:
+            htmlPage += ('<li class="listitem"><b><a href="#%s-%s">%s</a></b> </li>' % (lensSection['LensAlias'],pillarId,pillarName))
+        htmlPage += '</ul></li>'
 
-    htmlPage += '<br></div>'
+    htmlPage += '</ul><br></div>'
 
 
     return htmlPage
 
 def getWorkloadProperties(
     waclient,
-    workloadId
+    workloadId,
+    workloadJson=None
     ):
     htmlPage = ""
 
-    workloadJson = GetWorkload(waclient,workloadId)
+    if workloadJson is None:
+        workloadJson = GetWorkload(waclient,workloadId)
+        if workloadJson is None:
+            return htmlPage
 
     htmlPage += '<div id="main" role="main">'
     htmlPage += "<h1>Workload Properties</h1>"
@@ -386,6 +528,7 @@ def getWorkloadProperties(
     htmlPage += '<li class="listitem"><b>Description:</b> ' + workloadJson['Description'] + "</li>"
     htmlPage += '<li class="listitem"><b>Review Owner:</b> ' + workloadJson['ReviewOwner'] + "</li>"
     htmlPage += '<li class="listitem"><b>Industry Type:</b> ' + workloadJson['IndustryType'] + "</li>" if "IndustryType" in workloadJson else ""
+    htmlPage += '<li class="listitem"><b>Lenses:</b> ' + ", ".join(workloadJson['Lenses']) + "</li>"
     # Environment
     # AwsRegions
     # NonAwsRegions
@@ -404,21 +547,21 @@ def getPillarReport(
     ):
     htmlPage = ""
 
-    fullResponse = listLensReviewImprovements(waclient,workloadId,"wellarchitected",pillarId)
+    fullResponse = listLensReviewImprovements(waclient,workloadId,lensAlias,pillarId)
 
     for answeredQuestion in fullResponse:
         htmlString = ""
         headerString = ""
-        ipList = getImprovementPlanItems(waclient,workloadId,"wellarchitected",answeredQuestion['QuestionId'],answeredQuestion['PillarId'],answeredQuestion['ImprovementPlanUrl'])
+        ipList = getImprovementPlanItems(waclient,workloadId,lensAlias,answeredQuestion['QuestionId'],answeredQuestion['PillarId'],answeredQuestion['ImprovementPlanUrl'])
         for showChoices in ipList:
-            ipItemHTML, questionIdText = getImprovementPlanHTMLDescription(showChoices['ParsedURL'],answeredQuestion['PillarId'])
+            ipItemHTML, questionIdText = getImprovementPlanFragment(showChoices['ParsedURL'],answeredQuestion['PillarId'])
 
-            headerString = "<h2><b>"+questionIdText+" - "+answeredQuestion['QuestionTitle']+"</h2>"
+            headerString = "<h2><b>"+questionIdText+" - "+answeredQuestion['QuestionTitle']+"</b></h2>"
             # headerString = '<div class="wrap-collabsible"> <input id="collapsible" class="toggle" type="checkbox"> <label for="collapsible" class="lbl-toggle">'
             # headerString += questionIdText+" - "+answeredQuestion['QuestionTitle']
             # headerString += '</label><div class="collapsible-content"><div class="content-inner"><p>'
-            headerString += "<h2><b>Current Risk: "+answeredQuestion['Risk']+"</h2>"
-            htmlString += ipItemHTML.prettify()
+            headerString += "<h2><b>Current Risk: "+answeredQuestion['Risk']+"</b></h2>"
+            htmlString += ipItemHTML
             # htmlString += "</p></div></div></div>"
             # print(htmlString)
 
@@ -443,6 +586,88 @@ def getPillarSummary(
 
     return htmlPage
 
+def getPillarSection(
+    waclient,
+    workloadId,
+    lensAlias,
+    pillarId,
+    pillarName
+    ):
+    # Everything for a single pillar, this runs in its own worker thread
+    htmlPage = ('<h1 id="%s-%s">%s Improvement Plans</h1>' % (lensAlias, pillarId, pillarName))
+    htmlPage += getPillarSummary(waclient,workloadId,lensAlias,pillarId)
+    htmlPage += getPillarReport(waclient,workloadId,lensAlias,pillarId)
+    return htmlPage
+
+def submitWorkloadReport(
+    executor,
+    waclient,
+    workloadId
+    ):
+    # Queue up every lens and pillar for a workload on the shared executor.
+    # This never waits on the pillar futures, so it is safe to run it on the
+    # same executor without risking a deadlock.
+    # Returns None if the workload could not be retrieved, so the caller can skip it.
+    workloadJson = GetWorkload(waclient,workloadId)
+    if workloadJson is None:
+        logger.info("Skipping workload %s since it could not be retrieved" % workloadId)
+        return None
+    lensVersions = listLensVersions(waclient,workloadId)
+    lensSections = []
+    # Make sure the base framework is always first
+    for lensAlias in sorted(workloadJson['Lenses'], key=lambda x: (x != "wellarchitected", x)):
+        lensName, pillars = getLensStructure(waclient,workloadId,lensAlias,lensVersions.get(lensAlias))
+        pillarFutures = [executor.submit(getPillarSection,waclient,workloadId,lensAlias,pillarId,pillarName) for pillarId, pillarName in pillars]
+        lensSections.append({'LensAlias': lensAlias, 'LensName': lensName, 'Pillars': pillars, 'Futures': pillarFutures})
+    return {'Workload': workloadJson, 'Lenses': lensSections}
+
+def writeHTMLReport(
+    htmlFile,
+    workloadReport,
+    indexLink=""
+    ):
+    # Stream each section to the file in page order as soon as it is ready.
+    # Each improvement plan item is already prettified, so we no longer need to
+    # re-parse the whole document at the end.
+    workloadJson = workloadReport['Workload']
+    htmlFile.write(generateHTMLHeader())
+    if indexLink:
+        htmlFile.write('<div id="main" role="main"><a href="%s">&larr; All workloads</a></div>' % indexLink)
+    htmlFile.write(getWorkloadProperties(None,workloadJson['WorkloadId'],workloadJson))
+    # htmlPage += "<h1>Improvement Plan</h1>"
+    htmlFile.write(generateHTMLTOC(workloadReport['Lenses']))
+
+    htmlFile.write('<div id="main" role="main">')
+    for lensSection in workloadReport['Lenses']:
+        htmlFile.write('<h1>%s</h1>' % lensSection['LensName'])
+        for pillarFuture in lensSection['Futures']:
+            htmlFile.write(pillarFuture.result())
+
+    # Close out the HTML for the page
+    htmlFile.write("</div></body></html>")
+
+def writeHTMLIndex(
+    htmlFile,
+    workloadReports
+    ):
+    # Landing page for a multi-workload report with a link to each workload page
+    htmlFile.write(generateHTMLHeader())
+    htmlFile.write('<div id="main" role="main">')
+    htmlFile.write('<h1>Workloads</h1>')
+    htmlFile.write('<table class="waTable"><thead><tr><td>Workload</td><td>Lenses</td><td>High Risks</td><td>Medium Risks</td><td>Updated</td></tr></thead>')
+    for workloadReport in workloadReports:
+        workloadJson = workloadReport['Workload']
+        riskCounts = workloadJson.get('RiskCounts', {})
+        htmlFile.write('<tr><td><a href="%s.html">%s</a></td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>' % (
+            workloadJson['WorkloadId'],
+            workloadJson['WorkloadName'],
+            ", ".join([lensSection['LensName'] for lensSection in workloadReport['Lenses']]),
+            riskCounts.get('HIGH', 0),
+            riskCounts.get('MEDIUM', 0),
+            workloadJson.get('UpdatedAt', '')
+            ))
+    htmlFile.write('</table></div></body></html>')
+
 
 def main():
     boto3_min_version = "1.16.38"
@@ -461,38 +686,51 @@ def main():
     WACLIENT = SESSION1.client(
         service_name='wellarchitected',
         region_name=REGION_NAME,
+        config=botocore.config.Config(
+            max_pool_connections=max(10, CONCURRENCY),
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
     )
 
-    htmlPage = generateHTMLHeader()
-
-    htmlPage += getWorkloadProperties(WACLIENT,WORKLOADID)
-    # TODO - This currently will only do the base framework.
-    #   If people are interested, I can add an enumeration over the
-    #   Lenses and gather the same report for them.
-
-
-    # htmlPage += "<h1>Improvement Plan</h1>"
-    htmlPage += generateHTMLTOC()
-
-    htmlPage += '<div id="main" role="main">'
-    for pillar in PILLAR_PARSE_MAP:
-        # htmlPage += "<h1 id="+pillar+Improvement Plan</h1>"
-        htmlPage += ('<h1 id="%s">%s Improvement Plans</h1>' % (pillar, PILLAR_PROPER_NAME_MAP[pillar]))
-        htmlPage += getPillarSummary(WACLIENT,WORKLOADID,"wellarchitected",pillar)
-        htmlPage += getPillarReport(WACLIENT,WORKLOADID,"wellarchitected",pillar)
-
+    workloadIds = list(WORKLOADIDS)
+    if WORKLOADPREFIX:
+        for workload in listAllWorkloads(WACLIENT,WORKLOADPREFIX):
+            if workload['WorkloadId'] not in workloadIds:
+                workloadIds.append(workload['WorkloadId'])
+    if not workloadIds:
+        logger.error("No workloads found to report on")
+        exit()
 
-    # Close out the HTML for the page
-    htmlPage += "</body>"
-    htmlPretty = BeautifulSoup(htmlPage,features="html.parser")
-    htmlPage = htmlPretty.prettify()
-
-    # Open the file in a browser
-    # Might want to make this an argument in the future
-    with tempfile.NamedTemporaryFile('w', delete=False, suffix='.html') as f:
-        url = 'file://' + f.name
-        logger.info("Creating HTML file %s " % f.name)
-        f.write(htmlPage)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        # Queue every workload first so all of their pillars are gathered concurrently
+        workloadFutures = [executor.submit(submitWorkloadReport,executor,WACLIENT,workloadId) for workloadId in workloadIds]
+        workloadReports = [workloadFuture.result() for workloadFuture in workloadFutures]
+        workloadReports = [workloadReport for workloadReport in workloadReports if workloadReport is not None]
+        if not workloadReports:
+            logger.error("None of the workloads could be retrieved")
+            exit()
+
+        if len(workloadReports) == 1 and not OUTPUTDIR:
+            # Open the file in a browser
+            # Might want to make this an argument in the future
+            with tempfile.NamedTemporaryFile('w', delete=False, suffix='.html') as f:
+                url = 'file://' + f.name
+                logger.info("Creating HTML file %s " % f.name)
+                writeHTMLReport(f,workloadReports[0])
+        else:
+            # Generate a static site with an index page and one page per workload
+            outputDir = Path(OUTPUTDIR) if OUTPUTDIR else Path(tempfile.mkdtemp(prefix='wafr-report-'))
+            outputDir.mkdir(parents=True, exist_ok=True)
+            for workloadReport in workloadReports:
+                pagePath = outputDir / (workloadReport['Workload']['WorkloadId']+'.html')
+                logger.info("Creating HTML file %s " % pagePath)
+                with open(pagePath, 'w') as f:
+                    writeHTMLReport(f,workloadReport,'index.html')
+            indexPath = outputDir / 'index.html'
+            logger.info("Creating HTML file %s " % indexPath)
+            with open(indexPath, 'w') as f:
+                writeHTMLIndex(f,workloadReports)
+            url = indexPath.resolve().as_uri()
 
     logger.info("Opening HTML URL (%s) in default WebBrowser" % url)
     webbrowser.open(url)
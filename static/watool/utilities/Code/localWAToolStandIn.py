@@ -0,0 +1,976 @@
+#!/usr/bin/env python3
+"""
+This is a local stand-in for the wellarchitected, ssm (OpsCenter) and dynamodb APIs used
+by the Well-Architected utilities, so they can be run and profiled without an AWS account
+
+It is seeded with synthetic lenses, workloads, answers and milestones, serves synthetic
+improvement plan pages over a local HTTP server, and can add latency and throttling to
+every call. Use patchBoto3() to route boto3 sessions and clients to the stand-in.
+
+This code is only for use in Well-Architected labs
+*** NOT FOR PRODUCTION USE ***
+
+Licensed under the Apache 2.0 and MITnoAttr License.
+
+Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License").
+You may not use this file except in compliance with the License.
+A copy of the License is located at https://aws.amazon.com/apache2.0/
+"""
+
+import base64
+import collections
+import contextlib
+import copy
+import datetime
+import http.server
+import json
+import random
+import threading
+import time
+import uuid
+from unittest import mock
+
+import boto3
+import botocore.exceptions
+
+
+__author__    = "Eric Pullen"
+__email__     = "eppullen@amazon.com"
+__copyright__ = "Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved."
+__credits__   = ["Eric Pullen"]
+__version__   = "0.1"
+
+ACCOUNT_ID = "123456789012"
+DEFAULT_REGION = "us-east-1"
+
+# Pillars in the order the API returns them, with the short names used on the improvement plan pages
+PILLARS = [
+    ("operationalExcellence", "Operational Excellence", "OPS"),
+    ("security", "Security", "SEC"),
+    ("reliability", "Reliability", "REL"),
+    ("performance", "Performance Efficiency", "PERF"),
+    ("costOptimization", "Cost Optimization", "COST"),
+]
+
+# Lenses available in every region
+LENSES = [
+    ("wellarchitected", "AWS Well-Architected Framework", "2020-07-02"),
+    ("serverless", "Serverless Lens", "2020-02-04"),
+    ("softwareasaservice", "SaaS Lens", "2020-12-03"),
+]
+
+# The lab example looks this question and these best practices up by title
+LAB_QUESTION = (
+    "wellarchitected",
+    "operationalExcellence",
+    "dev-integ",
+    "How do you reduce defects, ease remediation, and improve flow into production?",
+    [
+        "Use version control",
+        "Use configuration management systems",
+        "Use build and deployment management systems",
+        "Perform patch management",
+        "Share design standards",
+        "Implement practices to improve code quality",
+        "Use multiple environments",
+        "Make frequent, small, reversible changes",
+        "Fully automate integration and deployment",
+    ]
+)
+
+NONE_OF_THESE = "None of these"
+RISK_LEVELS = ["UNANSWERED", "HIGH", "MEDIUM", "NONE", "NOT_APPLICABLE"]
+
+# How many API calls a page returns when the caller does not pass MaxResults
+DEFAULT_PAGE_SIZE = 50
+
+# Operations that count as writes, used to pick the throttling rate
+WRITE_OPERATIONS = {
+    "create_workload", "update_workload", "delete_workload", "associate_lenses", "disassociate_lenses",
+    "tag_resource", "untag_resource", "update_answer", "create_milestone",
+    "create_ops_item", "update_ops_item",
+    "put_item", "delete_item", "update_item", "batch_write_item",
+}
+
+
+def clientError(
+    code,
+    message,
+    operationName
+    ):
+    """ Build the same exception botocore raises for an API error """
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': message}}, operationName)
+
+def toOperationName(
+    methodName
+    ):
+    """ Convert a boto3 method name (get_answer) into its API operation name (GetAnswer) """
+    return "".join(part.capitalize() for part in methodName.split("_"))
+
+def paginate(
+    items,
+    kwargs
+    ):
+    """ Return one page of items and the NextToken for the next page, if any """
+    start = int(kwargs.get('NextToken') or 0)
+    pageSize = kwargs.get('MaxResults') or DEFAULT_PAGE_SIZE
+    page = items[start:start + pageSize]
+    nextToken = str(start + pageSize) if start + pageSize < len(items) else None
+    return page, nextToken
+
+def withNextToken(
+    response,
+    nextToken
+    ):
+    if nextToken:
+        response['NextToken'] = nextToken
+    return response
+
+
+class StandInConfig(object):
+    """ Size of the synthetic portfolio and the behaviour of the simulated API """
+    def __init__(
+        self,
+        workloads=10,
+        questionsPerPillar=6,
+        choicesPerQuestion=6,
+        milestonesPerWorkload=3,
+        lensesPerWorkload=2,
+        latency=0.0,
+        latencyJitter=0.0,
+        pageLatency=0.0,
+        throttleRate=0.0,
+        writeThrottleRate=None,
+        seed=42,
+        region=DEFAULT_REGION,
+        workloadPrefix="Bench Workload"
+        ):
+        self.workloads = workloads
+        self.questionsPerPillar = questionsPerPillar
+        self.choicesPerQuestion = choicesPerQuestion
+        self.milestonesPerWorkload = milestonesPerWorkload
+        self.lensesPerWorkload = lensesPerWorkload
+        # Seconds added to every API call, plus up to latencyJitter more
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        # Seconds added to every improvement plan page download
+        self.pageLatency = pageLatency
+        # Fraction of calls rejected with ThrottlingException (writes can use a different rate)
+        self.throttleRate = throttleRate
+        self.writeThrottleRate = throttleRate if writeThrottleRate is None else writeThrottleRate
+        self.seed = seed
+        self.region = region
+        self.workloadPrefix = workloadPrefix
+
+
+class ImprovementPlanHandler(http.server.BaseHTTPRequestHandler):
+    """ Serve the synthetic improvement plan page for /<lens>/<pillar>/<question>.html """
+    standIn = None
+
+    def do_GET(self):
+        page = self.standIn.renderImprovementPlanPage(self.path.split('#')[0].split('?')[0])
+        if page is None:
+            self.send_error(404)
+            return
+        if self.standIn.config.pageLatency:
+            time.sleep(self.standIn.config.pageLatency)
+        body = page.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.standIn.lock:
+            self.standIn.callCounts[("http", "GetImprovementPlanPage")] += 1
+
+    def log_message(self, format, *args):
+        return
+
+
+class LocalWAToolStandIn(object):
+    """ In-memory Well-Architected Tool, OpsCenter and DynamoDB shared by every stand-in client """
+    def __init__(
+        self,
+        config=None
+        ):
+        self.config = config or StandInConfig()
+        self.lock = threading.RLock()
+        self.random = random.Random(self.config.seed)
+        self.callCounts = collections.Counter()
+        self.throttleCounts = collections.Counter()
+        self.server = None
+        self.baseUrl = "http://127.0.0.1"
+        self.lenses = self.buildLenses()
+        # Per region state, so copying a workload between regions behaves like the real service
+        self.regions = collections.defaultdict(lambda: {"workloads": {}, "opsItems": {}, "tables": collections.defaultdict(dict)})
+        self.seedWorkloads(self.config.region)
+
+    # --- Lifecycle -------------------------------------------------------
+
+    def start(self):
+        """ Start the improvement plan page server on a free local port """
+        handler = type("BoundImprovementPlanHandler", (ImprovementPlanHandler,), {"standIn": self})
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.baseUrl = "http://127.0.0.1:%d" % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def client(
+        self,
+        serviceName,
+        regionName=None,
+        config=None
+        ):
+        return StandInClient(self, serviceName, regionName or DEFAULT_REGION, config)
+
+    def apiCallCount(self):
+        return sum(count for (service, operation), count in self.callCounts.items() if service != "http")
+
+    # --- Synthetic content ------------------------------------------------
+
+    def buildLenses(self):
+        lenses = {}
+        letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        for lensAlias, lensName, lensVersion in LENSES:
+            pillars = []
+            for pillarNumber, (pillarId, pillarName, pillarShort) in enumerate(PILLARS, 1):
+                questions = []
+                for questionNumber in range(1, self.config.questionsPerPillar + 1):
+                    questionId = "%s-%s-q%d" % (lensAlias[:4], pillarShort.lower(), questionNumber)
+                    questionTitle = "How do you manage synthetic %s area %d.%d?" % (pillarName.lower(), pillarNumber, questionNumber)
+                    choiceTitles = ["Practice %s for question %d.%d" % (letters[i], pillarNumber, questionNumber) for i in range(self.config.choicesPerQuestion)]
+                    if (lensAlias, pillarId) == LAB_QUESTION[:2] and questionNumber == 1:
+                        questionId, questionTitle, choiceTitles = LAB_QUESTION[2], LAB_QUESTION[3], LAB_QUESTION[4]
+                    choices = [
+                        {
+                            "ChoiceId": "%s_%s" % (questionId, letters[i].lower()),
+                            "Title": title,
+                            "Description": "Synthetic description of %s." % title.lower()
+                        }
+                        for i, title in enumerate(choiceTitles)
+                    ]
+                    choices.append({"ChoiceId": "%s_no" % questionId, "Title": NONE_OF_THESE, "Description": "None of these practices are followed."})
+                    questions.append({
+                        "QuestionId": questionId,
+                        "PillarId": pillarId,
+                        "QuestionNumber": questionNumber,
+                        "QuestionTitle": questionTitle,
+                        "QuestionDescription": "Synthetic question %d of the %s pillar." % (questionNumber, pillarName),
+                        "Choices": choices,
+                        "PagePath": "/%s/%s/%s.html" % (lensAlias, pillarId, questionId),
+                    })
+                pillars.append({"PillarId": pillarId, "PillarName": pillarName, "Short": pillarShort, "Questions": questions})
+            lenses[lensAlias] = {
+                "LensAlias": lensAlias,
+                "LensName": lensName,
+                "LensVersion": lensVersion,
+                "Pillars": pillars,
+                "Questions": {question["QuestionId"]: question for pillar in pillars for question in pillar["Questions"]},
+            }
+        return lenses
+
+    def renderImprovementPlanPage(
+        self,
+        path
+        ):
+        """ Render the page in the layout the utilities parse: one line per best practice with a stepN anchor """
+        for lens in self.lenses.values():
+            for pillar in lens["Pillars"]:
+                for question in pillar["Questions"]:
+                    if question["PagePath"] != path:
+                        continue
+                    lines = [
+                        "<html><head><title>%s</title></head><body>" % question["QuestionTitle"],
+                        "<h2>%s %d: %s</h2>" % (pillar["Short"], question["QuestionNumber"], question["QuestionTitle"]),
+                        "<div class=\"improvement-plan\">",
+                    ]
+                    for step, choice in enumerate(question["Choices"][:-1], 1):
+                        lines.append(
+                            "<p id=\"step%d\"><a href=\"%s%s#step%d\" id=\"%s\">%s</a>: %s See the <a class=\"glossref\" href=\"../glossary.html\">glossary</a>.</p>"
+                            % (step, self.baseUrl, path, step, choice["ChoiceId"], choice["Title"], choice["Description"])
+                        )
+                    lines.append("</div>")
+                    lines.append("</body></html>")
+                    return "\n".join(lines)
+        return None
+
+    def improvementPlanUrl(
+        self,
+        question,
+        step=1
+        ):
+        return "%s%s#step%d" % (self.baseUrl, question["PagePath"], step)
+
+    def seedWorkloads(
+        self,
+        region
+        ):
+        """ Create the synthetic portfolio, each workload with answers and a history of milestones """
+        lensAliases = [lensAlias for lensAlias, lensName, lensVersion in LENSES][:max(1, self.config.lensesPerWorkload)]
+        start = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        for workloadNumber in range(1, self.config.workloads + 1):
+            workload = self.newWorkload(region, {
+                "WorkloadName": "%s %04d" % (self.config.workloadPrefix, workloadNumber),
+                "Description": "Synthetic workload %d" % workloadNumber,
+                "Environment": "PRODUCTION",
+                "ReviewOwner": "benchmark@example.com",
+                "AwsRegions": [region],
+                "Lenses": lensAliases,
+                "Tags": {"Environment": "bench", "Team": "team-%d" % (workloadNumber % 3)},
+            })
+            # Each milestone answers a few more best practices than the one before
+            coverage = self.random.uniform(0.1, 0.4)
+            for milestoneNumber in range(1, self.config.milestonesPerWorkload + 1):
+                self.answerRandomly(workload, coverage)
+                self.saveMilestone(workload, "Review %d" % milestoneNumber, start + datetime.timedelta(days=30 * milestoneNumber + workloadNumber))
+                coverage = min(1.0, coverage + self.random.uniform(0.1, 0.3))
+            self.answerRandomly(workload, coverage)
+
+    def answerRandomly(
+        self,
+        workload,
+        coverage
+        ):
+        for lensAlias in workload["Lenses"]:
+            for question in self.lenses[lensAlias]["Questions"].values():
+                choiceIds = [choice["ChoiceId"] for choice in question["Choices"][:-1]]
+                selected = [choiceId for choiceId in choiceIds if self.random.random() < coverage]
+                if not selected and self.random.random() < coverage:
+                    selected = [question["Choices"][-1]["ChoiceId"]]
+                if selected:
+                    workload["Answers"][(lensAlias, question["QuestionId"])] = {"SelectedChoices": selected, "Notes": "", "IsApplicable": True}
+
+    def newWorkload(
+        self,
+        region,
+        properties
+        ):
+        workloadId = uuid.UUID(int=self.random.getrandbits(128)).hex
+        now = datetime.datetime.now(datetime.timezone.utc)
+        workload = {
+            "WorkloadId": workloadId,
+            "WorkloadArn": "arn:aws:wellarchitected:%s:%s:workload/%s" % (region, ACCOUNT_ID, workloadId),
+            "Description": "",
+            "Environment": "PREPRODUCTION",
+            "AccountIds": [],
+            "AwsRegions": [],
+            "NonAwsRegions": [],
+            "ArchitecturalDesign": "",
+            "ReviewOwner": "",
+            "IsReviewOwnerUpdateAcknowledged": False,
+            "IndustryType": "",
+            "Industry": "",
+            "Notes": "",
+            "ImprovementStatus": "NOT_APPLICABLE",
+            "PillarPriorities": [pillarId for pillarId, pillarName, pillarShort in PILLARS],
+            "Lenses": [],
+            "Owner": ACCOUNT_ID,
+            "Tags": {},
+            "UpdatedAt": now,
+            "Answers": {},
+            "Milestones": [],
+        }
+        workload.update(copy.deepcopy(properties))
+        workload["Lenses"] = list(dict.fromkeys(workload["Lenses"]))
+        self.regions[region]["workloads"][workloadId] = workload
+        return workload
+
+    def saveMilestone(
+        self,
+        workload,
+        milestoneName,
+        recordedAt=None
+        ):
+        snapshot = copy.deepcopy({key: value for key, value in workload.items() if key != "Milestones"})
+        milestone = {
+            "MilestoneNumber": len(workload["Milestones"]) + 1,
+            "MilestoneName": milestoneName,
+            "RecordedAt": recordedAt or datetime.datetime.now(datetime.timezone.utc),
+            "Workload": snapshot,
+        }
+        workload["Milestones"].append(milestone)
+        return milestone
+
+    # --- Risk calculation ---------------------------------------------
+
+    def answerRisk(
+        self,
+        question,
+        answer
+        ):
+        if answer is None or not answer["SelectedChoices"]:
+            return "UNANSWERED"
+        if not answer.get("IsApplicable", True):
+            return "NOT_APPLICABLE"
+        practices = [choice["ChoiceId"] for choice in question["Choices"][:-1]]
+        selected = [choiceId for choiceId in answer["SelectedChoices"] if choiceId in practices]
+        if len(selected) == len(practices):
+            return "NONE"
+        if len(selected) * 2 >= len(practices):
+            return "MEDIUM"
+        return "HIGH"
+
+    def riskCounts(
+        self,
+        workload,
+        lensAlias=None,
+        pillarId=None
+        ):
+        counts = dict.fromkeys(RISK_LEVELS, 0)
+        for alias in workload["Lenses"]:
+            if lensAlias and alias != lensAlias:
+                continue
+            for question in self.lenses[alias]["Questions"].values():
+                if pillarId and question["PillarId"] != pillarId:
+                    continue
+                counts[self.answerRisk(question, workload["Answers"].get((alias, question["QuestionId"])))] += 1
+        return counts
+
+    # --- Helpers shared by the operations ------------------------------
+
+    def findWorkload(
+        self,
+        region,
+        kwargs,
+        operationName
+        ):
+        workload = self.regions[region]["workloads"].get(kwargs.get("WorkloadId"))
+        if workload is None:
+            raise clientError("ResourceNotFoundException", "Workload %s not found" % kwargs.get("WorkloadId"), operationName)
+        milestoneNumber = kwargs.get("MilestoneNumber")
+        if milestoneNumber:
+            if milestoneNumber > len(workload["Milestones"]):
+                raise clientError("ResourceNotFoundException", "Milestone %s not found" % milestoneNumber, operationName)
+            return workload["Milestones"][milestoneNumber - 1]["Workload"]
+        return workload
+
+    def findLens(
+        self,
+        workload,
+        lensAlias,
+        operationName
+        ):
+        if lensAlias not in workload["Lenses"]:
+            raise clientError("ResourceNotFoundException", "Lens %s is not associated with the workload" % lensAlias, operationName)
+        return self.lenses[lensAlias]
+
+    def findQuestion(
+        self,
+        lens,
+        questionId,
+        operationName
+        ):
+        question = lens["Questions"].get(questionId)
+        if question is None:
+            raise clientError("ResourceNotFoundException", "Question %s not found" % questionId, operationName)
+        return question
+
+    def answerBody(
+        self,
+        workload,
+        lensAlias,
+        question,
+        summary=False
+        ):
+        answer = workload["Answers"].get((lensAlias, question["QuestionId"]))
+        selected = list(answer["SelectedChoices"]) if answer else []
+        body = {
+            "QuestionId": question["QuestionId"],
+            "PillarId": question["PillarId"],
+            "QuestionTitle": question["QuestionTitle"],
+            "Choices": copy.deepcopy(question["Choices"]),
+            "SelectedChoices": selected,
+            "IsApplicable": answer.get("IsApplicable", True) if answer else True,
+            "Risk": self.answerRisk(question, answer),
+        }
+        if summary:
+            body["ChoiceAnswerSummaries"] = [{"ChoiceId": choiceId, "Status": "SELECTED"} for choiceId in selected]
+        else:
+            body.update({
+                "QuestionDescription": question["QuestionDescription"],
+                "ImprovementPlanUrl": self.improvementPlanUrl(question),
+                "HelpfulResourceUrl": "%s/helpful/%s.html" % (self.baseUrl, question["QuestionId"]),
+                "ChoiceAnswers": [{"ChoiceId": choiceId, "Status": "SELECTED"} for choiceId in selected],
+                "Notes": answer.get("Notes", "") if answer else "",
+            })
+        return body
+
+    def workloadBody(
+        self,
+        workload
+        ):
+        body = copy.deepcopy({key: value for key, value in workload.items() if key not in ("Answers", "Milestones")})
+        body["RiskCounts"] = self.riskCounts(workload)
+        return body
+
+    def workloadSummary(
+        self,
+        workload
+        ):
+        return {
+            "WorkloadId": workload["WorkloadId"],
+            "WorkloadArn": workload["WorkloadArn"],
+            "WorkloadName": workload["WorkloadName"],
+            "Owner": workload["Owner"],
+            "UpdatedAt": workload["UpdatedAt"],
+            "Lenses": list(workload["Lenses"]),
+            "RiskCounts": self.riskCounts(workload),
+            "ImprovementStatus": workload["ImprovementStatus"],
+        }
+
+    def lensReviewBody(
+        self,
+        workload,
+        lens
+        ):
+        return {
+            "LensAlias": lens["LensAlias"],
+            "LensVersion": lens["LensVersion"],
+            "LensName": lens["LensName"],
+            "LensStatus": "CURRENT",
+            "UpdatedAt": workload["UpdatedAt"],
+            "RiskCounts": self.riskCounts(workload, lens["LensAlias"]),
+        }
+
+    def touch(
+        self,
+        workload
+        ):
+        workload["UpdatedAt"] = datetime.datetime.now(datetime.timezone.utc)
+
+    # --- wellarchitected ------------------------------------------------
+
+    def wellarchitected_list_lenses(self, region, kwargs):
+        summaries = [
+            {"LensAlias": lens["LensAlias"], "LensName": lens["LensName"], "LensVersion": lens["LensVersion"], "Description": lens["LensName"]}
+            for lens in self.lenses.values()
+        ]
+        page, nextToken = paginate(summaries, kwargs)
+        return withNextToken({"LensSummaries": page}, nextToken)
+
+    def wellarchitected_list_workloads(self, region, kwargs):
+        prefix = kwargs.get("WorkloadNamePrefix", "")
+        workloads = [
+            self.workloadSummary(workload)
+            for workload in self.regions[region]["workloads"].values()
+            if workload["WorkloadName"].startswith(prefix)
+        ]
+        page, nextToken = paginate(workloads, kwargs)
+        return withNextToken({"WorkloadSummaries": page}, nextToken)
+
+    def wellarchitected_get_workload(self, region, kwargs):
+        return {"Workload": self.workloadBody(self.findWorkload(region, kwargs, "GetWorkload"))}
+
+    def wellarchitected_create_workload(self, region, kwargs):
+        for workload in self.regions[region]["workloads"].values():
+            if workload["WorkloadName"].lower() == kwargs["WorkloadName"].lower():
+                raise clientError("ConflictException", "Workload name %s already exists" % kwargs["WorkloadName"], "CreateWorkload")
+        unknownLenses = [lensAlias for lensAlias in kwargs.get("Lenses", []) if lensAlias not in self.lenses]
+        if unknownLenses:
+            raise clientError("ValidationException", "Unknown lenses %s" % unknownLenses, "CreateWorkload")
+        properties = {key: value for key, value in kwargs.items() if key != "ClientRequestToken"}
+        workload = self.newWorkload(region, properties)
+        return {"WorkloadId": workload["WorkloadId"], "WorkloadArn": workload["WorkloadArn"]}
+
+    def wellarchitected_update_workload(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "UpdateWorkload")
+        workload.update({key: copy.deepcopy(value) for key, value in kwargs.items() if key != "WorkloadId"})
+        self.touch(workload)
+        return {"Workload": self.workloadBody(workload)}
+
+    def wellarchitected_delete_workload(self, region, kwargs):
+        self.findWorkload(region, kwargs, "DeleteWorkload")
+        del self.regions[region]["workloads"][kwargs["WorkloadId"]]
+        return {}
+
+    def wellarchitected_associate_lenses(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "AssociateLenses")
+        for lensAlias in kwargs["LensAliases"]:
+            if lensAlias not in self.lenses:
+                raise clientError("ValidationException", "Unknown lens %s" % lensAlias, "AssociateLenses")
+            if lensAlias not in workload["Lenses"]:
+                workload["Lenses"].append(lensAlias)
+        self.touch(workload)
+        return {}
+
+    def wellarchitected_disassociate_lenses(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "DisassociateLenses")
+        workload["Lenses"] = [lensAlias for lensAlias in workload["Lenses"] if lensAlias not in kwargs["LensAliases"]]
+        self.touch(workload)
+        return {}
+
+    def wellarchitected_list_tags_for_resource(self, region, kwargs):
+        workloadId = kwargs["WorkloadArn"].rsplit("/", 1)[-1]
+        return {"Tags": dict(self.findWorkload(region, {"WorkloadId": workloadId}, "ListTagsForResource")["Tags"])}
+
+    def wellarchitected_tag_resource(self, region, kwargs):
+        workloadId = kwargs["WorkloadArn"].rsplit("/", 1)[-1]
+        self.findWorkload(region, {"WorkloadId": workloadId}, "TagResource")["Tags"].update(kwargs["Tags"])
+        return {}
+
+    def wellarchitected_untag_resource(self, region, kwargs):
+        workloadId = kwargs["WorkloadArn"].rsplit("/", 1)[-1]
+        tags = self.findWorkload(region, {"WorkloadId": workloadId}, "UntagResource")["Tags"]
+        for tagKey in kwargs["TagKeys"]:
+            tags.pop(tagKey, None)
+        return {}
+
+    def wellarchitected_list_answers(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "ListAnswers")
+        lens = self.findLens(workload, kwargs["LensAlias"], "ListAnswers")
+        answers = [
+            self.answerBody(workload, lens["LensAlias"], question, summary=True)
+            for pillar in lens["Pillars"] if kwargs.get("PillarId") in (None, pillar["PillarId"])
+            for question in pillar["Questions"]
+        ]
+        page, nextToken = paginate(answers, kwargs)
+        response = {"WorkloadId": kwargs["WorkloadId"], "LensAlias": lens["LensAlias"], "AnswerSummaries": page}
+        if kwargs.get("MilestoneNumber"):
+            response["MilestoneNumber"] = kwargs["MilestoneNumber"]
+        return withNextToken(response, nextToken)
+
+    def wellarchitected_get_answer(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "GetAnswer")
+        lens = self.findLens(workload, kwargs["LensAlias"], "GetAnswer")
+        question = self.findQuestion(lens, kwargs["QuestionId"], "GetAnswer")
+        response = {"WorkloadId": kwargs["WorkloadId"], "LensAlias": lens["LensAlias"], "Answer": self.answerBody(workload, lens["LensAlias"], question)}
+        if kwargs.get("MilestoneNumber"):
+            response["MilestoneNumber"] = kwargs["MilestoneNumber"]
+        return response
+
+    def wellarchitected_update_answer(self, region, kwargs):
+        workload = self.findWorkload(region, {"WorkloadId": kwargs["WorkloadId"]}, "UpdateAnswer")
+        lens = self.findLens(workload, kwargs["LensAlias"], "UpdateAnswer")
+        question = self.findQuestion(lens, kwargs["QuestionId"], "UpdateAnswer")
+        validChoices = {choice["ChoiceId"] for choice in question["Choices"]}
+        invalidChoices = [choiceId for choiceId in kwargs.get("SelectedChoices", []) if choiceId not in validChoices]
+        if invalidChoices:
+            raise clientError("ValidationException", "Invalid choices %s" % invalidChoices, "UpdateAnswer")
+        answer = workload["Answers"].setdefault((lens["LensAlias"], question["QuestionId"]), {"SelectedChoices": [], "Notes": "", "IsApplicable": True})
+        if "SelectedChoices" in kwargs:
+            answer["SelectedChoices"] = list(dict.fromkeys(kwargs["SelectedChoices"]))
+        if "Notes" in kwargs:
+            answer["Notes"] = kwargs["Notes"]
+        if "IsApplicable" in kwargs:
+            answer["IsApplicable"] = kwargs["IsApplicable"]
+        self.touch(workload)
+        return {"WorkloadId": kwargs["WorkloadId"], "LensAlias": lens["LensAlias"], "Answer": self.answerBody(workload, lens["LensAlias"], question)}
+
+    def wellarchitected_list_lens_reviews(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "ListLensReviews")
+        summaries = [self.lensReviewBody(workload, self.lenses[lensAlias]) for lensAlias in workload["Lenses"]]
+        page, nextToken = paginate(summaries, kwargs)
+        return withNextToken({"WorkloadId": kwargs["WorkloadId"], "LensReviewSummaries": page}, nextToken)
+
+    def wellarchitected_get_lens_review(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "GetLensReview")
+        lens = self.findLens(workload, kwargs["LensAlias"], "GetLensReview")
+        lensReview = self.lensReviewBody(workload, lens)
+        lensReview["Notes"] = ""
+        lensReview["PillarReviewSummaries"] = [
+            {
+                "PillarId": pillar["PillarId"],
+                "PillarName": pillar["PillarName"],
+                "Notes": "",
+                "RiskCounts": self.riskCounts(workload, lens["LensAlias"], pillar["PillarId"]),
+            }
+            for pillar in lens["Pillars"]
+        ]
+        return {"WorkloadId": kwargs["WorkloadId"], "LensReview": lensReview}
+
+    def wellarchitected_list_lens_review_improvements(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "ListLensReviewImprovements")
+        lens = self.findLens(workload, kwargs["LensAlias"], "ListLensReviewImprovements")
+        improvements = []
+        for pillar in lens["Pillars"]:
+            if kwargs.get("PillarId") not in (None, pillar["PillarId"]):
+                continue
+            for question in pillar["Questions"]:
+                risk = self.answerRisk(question, workload["Answers"].get((lens["LensAlias"], question["QuestionId"])))
+                if risk in ("HIGH", "MEDIUM"):
+                    improvements.append({
+                        "QuestionId": question["QuestionId"],
+                        "PillarId": pillar["PillarId"],
+                        "QuestionTitle": question["QuestionTitle"],
+                        "Risk": risk,
+                        "ImprovementPlanUrl": self.improvementPlanUrl(question),
+                    })
+        page, nextToken = paginate(improvements, kwargs)
+        return withNextToken({"WorkloadId": kwargs["WorkloadId"], "LensAlias": lens["LensAlias"], "ImprovementSummaries": page}, nextToken)
+
+    def wellarchitected_get_lens_review_report(self, region, kwargs):
+        workload = self.findWorkload(region, kwargs, "GetLensReviewReport")
+        lens = self.findLens(workload, kwargs["LensAlias"], "GetLensReviewReport")
+        report = ("%PDF-1.4\n% Synthetic report for " + workload["WorkloadName"] + " " + json.dumps(self.riskCounts(workload, lens["LensAlias"])) + "\n%%EOF\n").encode("utf8")
+        return {"WorkloadId": kwargs["WorkloadId"], "LensReviewReport": {"LensAlias": lens["LensAlias"], "Base64String": base64.b64encode(report).decode("ascii")}}
+
+    def wellarchitected_create_milestone(self, region, kwargs):
+        workload = self.findWorkload(region, {"WorkloadId": kwargs["WorkloadId"]}, "CreateMilestone")
+        if any(milestone["MilestoneName"] == kwargs["MilestoneName"] for milestone in workload["Milestones"]):
+            raise clientError("ConflictException", "Milestone name %s already exists" % kwargs["MilestoneName"], "CreateMilestone")
+        milestone = self.saveMilestone(workload, kwargs["MilestoneName"])
+        return {"WorkloadId": kwargs["WorkloadId"], "MilestoneNumber": milestone["MilestoneNumber"]}
+
+    def wellarchitected_list_milestones(self, region, kwargs):
+        workload = self.findWorkload(region, {"WorkloadId": kwargs["WorkloadId"]}, "ListMilestones")
+        summaries = [
+            {
+                "MilestoneNumber": milestone["MilestoneNumber"],
+                "MilestoneName": milestone["MilestoneName"],
+                "RecordedAt": milestone["RecordedAt"],
+                "WorkloadSummary": self.workloadSummary(milestone["Workload"]),
+            }
+            for milestone in workload["Milestones"]
+        ]
+        page, nextToken = paginate(summaries, kwargs)
+        return withNextToken({"WorkloadId": kwargs["WorkloadId"], "MilestoneSummaries": page}, nextToken)
+
+    def wellarchitected_get_milestone(self, region, kwargs):
+        workload = self.findWorkload(region, {"WorkloadId": kwargs["WorkloadId"]}, "GetMilestone")
+        if not 0 < kwargs["MilestoneNumber"] <= len(workload["Milestones"]):
+            raise clientError("ResourceNotFoundException", "Milestone %s not found" % kwargs["MilestoneNumber"], "GetMilestone")
+        milestone = workload["Milestones"][kwargs["MilestoneNumber"] - 1]
+        return {
+            "WorkloadId": kwargs["WorkloadId"],
+            "Milestone": {
+                "MilestoneNumber": milestone["MilestoneNumber"],
+                "MilestoneName": milestone["MilestoneName"],
+                "RecordedAt": milestone["RecordedAt"],
+                "Workload": self.workloadBody(milestone["Workload"]),
+            }
+        }
+
+    # --- ssm (OpsCenter) --------------------------------------------------
+
+    def ssm_create_ops_item(self, region, kwargs):
+        opsItems = self.regions[region]["opsItems"]
+        opsItemId = "oi-%012x" % (len(opsItems) + 1)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        opsItem = copy.deepcopy(kwargs)
+        opsItem.update({"OpsItemId": opsItemId, "Status": "Open", "CreatedTime": now, "LastModifiedTime": now})
+        opsItems[opsItemId] = opsItem
+        return {"OpsItemId": opsItemId}
+
+    def ssm_get_ops_item(self, region, kwargs):
+        opsItem = self.regions[region]["opsItems"].get(kwargs["OpsItemId"])
+        if opsItem is None:
+            raise clientError("OpsItemNotFoundException", "OpsItem %s not found" % kwargs["OpsItemId"], "GetOpsItem")
+        return {"OpsItem": copy.deepcopy(opsItem)}
+
+    def ssm_update_ops_item(self, region, kwargs):
+        opsItem = self.regions[region]["opsItems"].get(kwargs["OpsItemId"])
+        if opsItem is None:
+            raise clientError("OpsItemNotFoundException", "OpsItem %s not found" % kwargs["OpsItemId"], "UpdateOpsItem")
+        opsItem.update({key: copy.deepcopy(value) for key, value in kwargs.items() if key != "OpsItemId"})
+        opsItem["LastModifiedTime"] = datetime.datetime.now(datetime.timezone.utc)
+        return {}
+
+    def opsItemMatches(
+        self,
+        opsItem,
+        opsItemFilter
+        ):
+        key, values, operator = opsItemFilter["Key"], opsItemFilter["Values"], opsItemFilter["Operator"]
+        if key == "OperationalData":
+            operationalData = opsItem.get("OperationalData", {})
+            for value in values:
+                wanted = json.loads(value)
+                if operationalData.get(wanted["key"], {}).get("Value") == wanted["value"]:
+                    return True
+            return False
+        if key == "CreatedTime":
+            boundary = datetime.datetime.strptime(values[0], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+            return opsItem["CreatedTime"] < boundary if operator == "LessThan" else opsItem["CreatedTime"] > boundary
+        return opsItem.get(key) in values
+
+    def ssm_describe_ops_items(self, region, kwargs):
+        summaries = [
+            {key: copy.deepcopy(opsItem.get(key)) for key in ("OpsItemId", "Title", "Source", "Status", "Severity", "CreatedTime", "LastModifiedTime", "OperationalData")}
+            for opsItem in self.regions[region]["opsItems"].values()
+            if all(self.opsItemMatches(opsItem, opsItemFilter) for opsItemFilter in kwargs.get("OpsItemFilters", []))
+        ]
+        page, nextToken = paginate(summaries, kwargs)
+        return withNextToken({"OpsItemSummaries": page}, nextToken)
+
+    # --- dynamodb ---------------------------------------------------------
+
+    def itemKey(
+        self,
+        key
+        ):
+        return json.dumps(key, sort_keys=True)
+
+    def dynamodb_get_item(self, region, kwargs):
+        item = self.regions[region]["tables"][kwargs["TableName"]].get(self.itemKey(kwargs["Key"]))
+        return {"Item": copy.deepcopy(item)} if item else {}
+
+    def dynamodb_put_item(self, region, kwargs):
+        table = self.regions[region]["tables"][kwargs["TableName"]]
+        hashKey = next(iter(kwargs["Item"]))
+        table[self.itemKey({hashKey: kwargs["Item"][hashKey]})] = copy.deepcopy(kwargs["Item"])
+        return {}
+
+    def dynamodb_delete_item(self, region, kwargs):
+        self.regions[region]["tables"][kwargs["TableName"]].pop(self.itemKey(kwargs["Key"]), None)
+        return {}
+
+    def dynamodb_update_item(self, region, kwargs):
+        # Only the expressions used by the lab functions are supported
+        table = self.regions[region]["tables"][kwargs["TableName"]]
+        itemKey = self.itemKey(kwargs["Key"])
+        condition = kwargs.get("ConditionExpression")
+        if condition and condition.startswith("attribute_exists") and itemKey not in table:
+            raise clientError("ConditionalCheckFailedException", "The conditional request failed", "UpdateItem")
+        item = table.setdefault(itemKey, copy.deepcopy(kwargs["Key"]))
+        action, attribute, placeholder = kwargs["UpdateExpression"].split()
+        value = kwargs["ExpressionAttributeValues"][placeholder]
+        if action == "DELETE":
+            remaining = [member for member in item.get(attribute, {}).get("SS", []) if member not in value["SS"]]
+            if remaining:
+                item[attribute] = {"SS": remaining}
+            else:
+                item.pop(attribute, None)
+        elif action == "SET":
+            item[attribute.rstrip("=")] = copy.deepcopy(value)
+        else:
+            raise clientError("ValidationException", "Unsupported update expression %s" % kwargs["UpdateExpression"], "UpdateItem")
+        return {}
+
+    def dynamodb_batch_get_item(self, region, kwargs):
+        responses = {}
+        for tableName, request in kwargs["RequestItems"].items():
+            table = self.regions[region]["tables"][tableName]
+            responses[tableName] = [copy.deepcopy(table[self.itemKey(key)]) for key in request["Keys"] if self.itemKey(key) in table]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def dynamodb_batch_write_item(self, region, kwargs):
+        for tableName, requests in kwargs["RequestItems"].items():
+            if len(requests) > 25:
+                raise clientError("ValidationException", "Too many items requested for the BatchWriteItem call", "BatchWriteItem")
+            for request in requests:
+                if "PutRequest" in request:
+                    self.dynamodb_put_item(region, {"TableName": tableName, "Item": request["PutRequest"]["Item"]})
+                else:
+                    self.dynamodb_delete_item(region, {"TableName": tableName, "Key": request["DeleteRequest"]["Key"]})
+        return {"UnprocessedItems": {}}
+
+
+class StandInClient(object):
+    """ Looks like a boto3 client for one service and region, every call is counted and can be slowed or throttled """
+    def __init__(
+        self,
+        standIn,
+        serviceName,
+        regionName,
+        config=None
+        ):
+        self.standIn = standIn
+        self.serviceName = serviceName
+        self.regionName = regionName
+        # Behave like the SDK retry handler the caller configured, so throttling costs time rather than failing outright
+        retries = getattr(config, "retries", None) or {}
+        if retries.get("mode", "legacy") == "legacy":
+            self.maxAttempts = retries.get("max_attempts", 4) + 1
+        else:
+            self.maxAttempts = retries.get("max_attempts", 3)
+        exceptionNames = ["ConditionalCheckFailedException", "ResourceNotFoundException", "ConflictException", "ValidationException", "ThrottlingException", "OpsItemNotFoundException"]
+        self.exceptions = type("StandInExceptions", (object,), {
+            name: type(name, (botocore.exceptions.ClientError,), {}) for name in exceptionNames
+        })
+        self.exceptions.ClientError = botocore.exceptions.ClientError
+
+    def __getattr__(
+        self,
+        methodName
+        ):
+        handler = getattr(self.standIn, "%s_%s" % (self.serviceName, methodName), None)
+        if handler is None:
+            raise AttributeError("The local stand-in does not implement %s.%s" % (self.serviceName, methodName))
+
+        def apiCall(**kwargs):
+            return self.invoke(methodName, handler, kwargs)
+        return apiCall
+
+    def invoke(
+        self,
+        methodName,
+        handler,
+        kwargs
+        ):
+        standIn = self.standIn
+        config = standIn.config
+        operationName = toOperationName(methodName)
+        throttleRate = config.writeThrottleRate if methodName in WRITE_OPERATIONS else config.throttleRate
+        for attempt in range(self.maxAttempts):
+            if config.latency or config.latencyJitter:
+                time.sleep(config.latency + standIn.random.uniform(0, config.latencyJitter))
+            with standIn.lock:
+                standIn.callCounts[(self.serviceName, operationName)] += 1
+                throttled = throttleRate and standIn.random.random() < throttleRate
+                if throttled:
+                    standIn.throttleCounts[(self.serviceName, operationName)] += 1
+                else:
+                    try:
+                        return copy.deepcopy(handler(self.regionName, kwargs))
+                    except botocore.exceptions.ClientError as e:
+                        raise self.modelledError(e)
+            if attempt < self.maxAttempts - 1:
+                time.sleep(min(1.0, 0.05 * (2 ** attempt)) * standIn.random.uniform(0.5, 1.0))
+        raise self.modelledError(clientError("ThrottlingException", "Rate exceeded", operationName))
+
+    def modelledError(
+        self,
+        error
+        ):
+        """ Re-raise as the client's modelled exception class, as boto3 does, so except clauses on client.exceptions work """
+        errorClass = getattr(self.exceptions, error.response['Error']['Code'], None)
+        if errorClass is None:
+            return error
+        return errorClass(error.response, error.operation_name)
+
+
+class StandInSession(object):
+    """ Replacement for boto3.session.Session that hands out stand-in clients """
+    standIn = None
+
+    def __init__(
+        self,
+        *args,
+        **kwargs
+        ):
+        self.region_name = kwargs.get("region_name") or DEFAULT_REGION
+        self.profile_name = kwargs.get("profile_name")
+
+    def client(
+        self,
+        service_name,
+        region_name=None,
+        config=None,
+        **kwargs
+        ):
+        return self.standIn.client(service_name, region_name or self.region_name, config)
+
+
+@contextlib.contextmanager
+def patchBoto3(
+    standIn
+    ):
+    """ Route boto3.session.Session() and boto3.client() to the stand-in while the block runs """
+    sessionClass = type("BoundStandInSession", (StandInSession,), {"standIn": standIn})
+
+    def standInClient(service_name, region_name=None, config=None, **kwargs):
+        return standIn.client(service_name, region_name, config)
+
+    with mock.patch.object(boto3.session, "Session", sessionClass), \
+         mock.patch.object(boto3, "Session", sessionClass), \
+         mock.patch.object(boto3, "client", standInClient):
+        yield standIn